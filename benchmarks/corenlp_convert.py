@@ -0,0 +1,93 @@
+"""
+Benchmark the streaming CoreNLP xml -> csv conversion against the corenlp_xml (lxml DOM) based conversion
+used by earlier versions of nlpipe.
+
+Generates a synthetic CoreNLP document of the requested number of sentences, checks that both converters produce
+identical csv, and reports timings. Requires corenlp_xml to be installed for the comparison:
+
+python -m benchmarks.corenlp_convert --sentences 20000
+"""
+import argparse
+import csv
+import time
+from io import StringIO
+
+from nlpipe.modules.corenlp import CoreNLPParser, POSMAP
+
+_WORDS = [("The", "the", "DT"), ("quick", "quick", "JJ"), ("foxes", "fox", "NNS"),
+          ("jumped", "jump", "VBD"), ("over", "over", "IN"), ("Amsterdam", "Amsterdam", "NNP"), (".", ".", ".")]
+
+
+def generate(nsentences):
+    """Generate a CoreNLP xml document with nsentences sentences and collapsed-ccprocessed dependencies"""
+    out = ['<?xml version="1.0" encoding="UTF-8"?>\n<root><document><sentences>']
+    offset = 0
+    for sid in range(1, nsentences + 1):
+        out.append('<sentence id="{sid}"><tokens>'.format(**locals()))
+        for tid, (word, lemma, pos) in enumerate(_WORDS, start=1):
+            end = offset + len(word)
+            ner = "LOCATION" if pos == "NNP" else "O"
+            out.append('<token id="{tid}"><word>{word}</word><lemma>{lemma}</lemma>'
+                       '<CharacterOffsetBegin>{offset}</CharacterOffsetBegin>'
+                       '<CharacterOffsetEnd>{end}</CharacterOffsetEnd><POS>{pos}</POS><NER>{ner}</NER>'
+                       '</token>'.format(**locals()))
+            offset = end + 1
+        out.append('</tokens><parse>(ROOT (S (NP (DT The) (JJ quick) (NNS foxes)) (VP (VBD jumped) '
+                   '(PP (IN over) (NP (NNP Amsterdam)))) (. .)))</parse>')
+        for deptype in ("basic-dependencies", "collapsed-ccprocessed-dependencies"):
+            out.append('<dependencies type="{deptype}">'.format(**locals()))
+            out.append('<dep type="root"><governor idx="0">ROOT</governor><dependent idx="4">jumped</dependent></dep>')
+            for dependent, governor, rel in [(1, 3, "det"), (2, 3, "amod"), (3, 4, "nsubj"),
+                                             (6, 4, "nmod:over"), (7, 4, "punct")]:
+                out.append('<dep type="{rel}"><governor idx="{governor}">x</governor>'
+                           '<dependent idx="{dependent}">y</dependent></dep>'.format(**locals()))
+            out.append('</dependencies>')
+        out.append('</sentence>')
+    out.append('</sentences></document></root>\n')
+    return "".join(out)
+
+
+def convert_dom(id, result):
+    """The corenlp_xml based conversion from nlpipe <= 0.46"""
+    from corenlp_xml.document import Document
+    doc = Document(result.encode("utf-8"))
+    s = StringIO()
+    w = csv.writer(s)
+    w.writerow(["doc", "sentence", "id", "offset", "word", "lemma", "POS", "pos1", "ner", "relation", "parent"])
+    parents = {}
+    for sent in doc.sentences:
+        if sent.collapsed_ccprocessed_dependencies:
+            for dep in sent.collapsed_ccprocessed_dependencies.links:
+                if dep.type != 'root':
+                    parents[sent.id, dep.dependent.idx] = (dep.type, dep.governor.idx)
+    for sent in doc.sentences:
+        for t in sent.tokens:
+            rel, parent = parents.get((sent.id, t.id), (None, None))
+            w.writerow([id, sent.id, t.id, t.character_offset_begin, t.word, t.lemma,
+                        t.pos, POSMAP[t.pos], t.ner, rel, parent])
+    return s.getvalue()
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", "-n", type=int, default=20000, help="Number of sentences in the document")
+    args = parser.parse_args()
+
+    xml = generate(args.sentences)
+    print("Document: {} sentences, {:.1f} MB xml".format(args.sentences, len(xml) / 1e6))
+
+    streaming, t_streaming = timeit(CoreNLPParser().convert, 1, xml, "csv")
+    print("streaming (iterparse): {t_streaming:.2f}s".format(**locals()))
+    try:
+        dom, t_dom = timeit(convert_dom, 1, xml)
+    except ImportError:
+        print("corenlp_xml not installed, skipping comparison")
+    else:
+        print("corenlp_xml (DOM):     {t_dom:.2f}s".format(**locals()))
+        print("speedup: {:.1f}x, identical output: {}".format(t_dom / t_streaming, dom == streaming))
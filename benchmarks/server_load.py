@@ -0,0 +1,108 @@
+"""
+Load test of the REST server: client processes submit documents, claim them as tasks, store the results and
+retrieve them (4 requests per document) as fast as they can, and the total number of requests per second is reported.
+
+By default, a server is started on a temporary directory for each number of processes, to show how the throughput
+scales with the number of cores (requires gunicorn, except for --processes 0 which uses the development server):
+
+python -m benchmarks.server_load --processes 0 1 2 4 8 --clients 32 --duration 10
+
+Use --url to test a running server instead (e.g. started with nlpipe.wsgi and specific gunicorn settings).
+"""
+import argparse
+import multiprocessing
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from tempfile import TemporaryDirectory
+
+import requests
+
+from nlpipe.client import HTTPClient
+
+MODULE = "test_upper"
+
+
+def run_client(args):
+    """Process documents for duration seconds, returning the number of requests"""
+    url, duration, size = args
+    client = HTTPClient(url, compression=None)
+    text = "x" * size
+    n = 0
+    deadline = time.time() + duration
+    while time.time() < deadline:
+        # unique documents, so the other clients' tasks are claimed as well
+        client.process(MODULE, "{} {}".format(uuid.uuid4(), text))
+        id, doc = client.get_task(MODULE)
+        n += 2
+        if id is not None:
+            client.store_result(MODULE, id, doc.upper())
+            client.result(MODULE, id)
+            n += 2
+    return n
+
+
+def measure(url, clients, duration, size):
+    with multiprocessing.Pool(clients) as pool:
+        start = time.time()
+        n = sum(pool.map(run_client, [(url, duration, size)] * clients))
+        return n / (time.time() - start)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def start_server(directory, processes, threads):
+    """Start a server on a free port, returning the (process, url) pair"""
+    port = _free_port()
+    cmd = [sys.executable, "-m", "nlpipe.restserver", directory, "--port", str(port)]
+    if processes:
+        cmd += ["--processes", str(processes), "--threads", str(threads)]
+    server = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = "http://localhost:{port}".format(**locals())
+    for _ in range(100):
+        try:
+            requests.head("{url}/api/modules/{MODULE}/x".format(MODULE=MODULE, **locals()))
+            return server, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    server.kill()
+    raise Exception("Server did not start: {}".format(" ".join(cmd)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Test a running server rather than starting one")
+    parser.add_argument("--processes", "-P", type=int, nargs="+", default=[1, 2, 4],
+                        help="Numbers of server processes to test, 0 for the development server")
+    parser.add_argument("--threads", "-T", type=int, default=8, help="Threads per server process")
+    parser.add_argument("--clients", "-c", type=int, default=multiprocessing.cpu_count() * 2,
+                        help="Number of concurrent client processes")
+    parser.add_argument("--duration", "-d", type=float, default=10, help="Seconds per test")
+    parser.add_argument("--size", "-s", type=int, default=1000, help="Document size in characters")
+    args = parser.parse_args()
+
+    if args.url:
+        rate = measure(args.url, args.clients, args.duration, args.size)
+        print("{args.url}: {rate:.0f} requests/s".format(**locals()))
+        sys.exit()
+
+    print("{} cores, {args.clients} clients, {args.size} character documents".format(multiprocessing.cpu_count(),
+                                                                                   **locals()))
+    baseline = None
+    for processes in args.processes:
+        with TemporaryDirectory() as dir:
+            server, url = start_server(dir, processes, args.threads)
+            try:
+                rate = measure(url, args.clients, args.duration, args.size)
+            finally:
+                server.terminate()
+                server.wait()
+        baseline = baseline or rate
+        name = "{processes} processes".format(**locals()) if processes else "development server"
+        print("{name:>20}: {rate:6.0f} requests/s ({:.1f}x)".format(rate / baseline, **locals()))
@@ -0,0 +1,202 @@
+"""
+Asyncio client for the REST server, for submitting and collecting large numbers of documents concurrently.
+Requires aiohttp (pip install aiohttp). Example:
+
+async def main():
+    async with AsyncHTTPClient("http://localhost:5001") as c:
+        ids = await c.bulk_process("corenlp_lemmatize", texts)
+        results = await c.bulk_result("corenlp_lemmatize", ids)
+
+The methods mirror HTTPClient (as coroutines), including the batching and retries of the bulk methods, with at most
+`parallel` requests in flight.
+"""
+import asyncio
+import itertools
+import json
+from urllib.parse import urlencode
+
+from nlpipe.client import HTTPClient, ServerError, _bytes, _lane_query
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ValueError("The asyncio client requires aiohttp, use e.g. pip install aiohttp")
+    return aiohttp
+
+
+class AsyncHTTPClient(object):
+    """
+    NLPipe client that connects to the REST server using asyncio. Use it as an async context manager,
+    or call close() when done
+    """
+
+    # bulk requests are split into batches and retried like those of the synchronous client, see HTTPClient.
+    # parallel also limits the other requests (and the pooled connections)
+    batch_size = HTTPClient.batch_size
+    max_batch_bytes = HTTPClient.max_batch_bytes
+    parallel = HTTPClient.parallel
+    retries = HTTPClient.retries
+    retry_wait = HTTPClient.retry_wait
+
+    def __init__(self, server="http://localhost:5000", compression="gzip", progress=None):
+        """
+        :param server: The url of the NLPipe server
+        :param compression: Codec to compress large request bodies with, see HTTPClient
+        :param progress: Function that is called as progress(done, total) after each batch of a bulk method
+        """
+        _aiohttp()  # fail early if aiohttp is not installed
+        self.server = server
+        self.compression = compression
+        self.progress = progress
+        self._session = None  # created in the event loop on the first request
+        self._semaphore = None
+
+    # request bodies are compressed and batched like those of the synchronous client
+    _body = HTTPClient._body
+    _json_body = HTTPClient._json_body
+    _batches = HTTPClient._batches
+    _document_batches = HTTPClient._document_batches
+    _retry_wait = HTTPClient._retry_wait
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, method, url, expected, data=None, headers=None, action="request"):
+        """
+        Perform a request, returning the (response, body) pair. Raises an Exception if the status is unexpected,
+        or a ServerError on connection problems and server errors
+        """
+        aiohttp = _aiohttp()
+        if self._session is None:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.parallel))
+            self._semaphore = asyncio.Semaphore(self.parallel)
+        async with self._semaphore:
+            try:
+                async with self._session.request(method, url, data=data, headers=headers) as res:
+                    body = await res.read()
+            except aiohttp.ClientConnectionError as e:
+                raise ServerError("Error on {action}: {e}".format(**locals()))
+        if res.status not in expected:
+            text = body.decode("utf-8", errors="replace")
+            error = ServerError if res.status >= 500 else Exception
+            raise error("Error on {action}; return code: {res.status}:\n{text}".format(**locals()))
+        return res, body
+
+    async def status(self, module: str, id: str, stale=False) -> str:
+        url = "{self.server}/api/modules/{module}/{id}".format(**locals())
+        if stale:
+            url += "?stale=1"
+        res, _ = await self._request("HEAD", url, expected=(200, 202, 404, 500),
+                                     action="getting status for {module}/{id}".format(**locals()))
+        return res.headers['Status']
+
+    async def process(self, module, doc, id=None, priority=None, submitter=None):
+        url = "{self.server}/api/modules/{module}/".format(**locals())
+        query = {k: v for (k, v) in [("id", id), ("priority", priority), ("submitter", submitter)] if v is not None}
+        if query:
+            url = "{url}?{query}".format(url=url, query=urlencode(query))
+        data, headers = self._body(_bytes(doc))
+        res, _ = await self._request("POST", url, expected=(202,), data=data, headers=headers,
+                                     action="processing doc with {module}".format(**locals()))
+        return res.headers['ID']
+
+    async def result(self, module, id, format=None):
+        url = "{self.server}/api/modules/{module}/{id}".format(**locals())
+        if format is not None:
+            url = "{url}?format={format}".format(**locals())
+        _, body = await self._request("GET", url, expected=(200,),
+                                      action="getting result for {module}/{id}".format(**locals()))
+        return body.decode("utf-8")
+
+    async def get_task(self, module, sizes=None):
+        url = "{self.server}/api/modules/{module}/".format(**locals())
+        if sizes:
+            url += "?" + urlencode({"sizes": ",".join(sizes)})
+        res, body = await self._request("GET", url, expected=(200, 404),
+                                        action="getting a task for {module}".format(**locals()))
+        if res.status == 404:
+            return None, None
+        return res.headers['ID'], body.decode("utf-8")
+
+    async def store_result(self, module, id, result, fingerprint=None):
+        url = "{self.server}/api/modules/{module}/{id}".format(**locals())
+        data, headers = self._body(_bytes(result), {'Fingerprint': fingerprint} if fingerprint is not None else None)
+        await self._request("PUT", url, expected=(204,), data=data, headers=headers,
+                            action="storing result for {module}:{id}".format(**locals()))
+
+    async def store_error(self, module, id, result):
+        from nlpipe.restserver import ERROR_MIME
+        url = "{self.server}/api/modules/{module}/{id}".format(**locals())
+        data, headers = self._body(_bytes(result), {'Content-type': ERROR_MIME})
+        await self._request("PUT", url, expected=(204,), data=data, headers=headers,
+                            action="storing error for {module}:{id}".format(**locals()))
+
+    async def _post_batch(self, url, body, action):
+        data, headers = self._json_body(body)
+        _, res = await self._request("POST", url, expected=(200,), data=data, headers=headers, action=action)
+        return json.loads(res.decode("utf-8"))
+
+    async def _bulk(self, url, batches, action, retries=None):
+        """POST the batches concurrently, retrying on server errors, and return the responses in order"""
+        retries = self.retries if retries is None else retries
+        total = sum(len(batch) for batch in batches)
+        done = 0
+
+        async def post(batch):
+            nonlocal done
+            for attempt in itertools.count():
+                try:
+                    result = await self._post_batch(url, batch, action)
+                    break
+                except Exception as e:
+                    wait = self._retry_wait(e, attempt, retries)
+                    if wait is None:
+                        raise
+                    await asyncio.sleep(wait)
+            done += len(batch)
+            if self.progress is not None:
+                self.progress(done, total)
+            return result
+        tasks = [asyncio.ensure_future(post(batch)) for batch in batches]
+        try:
+            return await asyncio.gather(*tasks)
+        except Exception:
+            for task in tasks:
+                task.cancel()  # another batch failed, so the results will not be used
+            raise
+
+    async def bulk_status(self, module, ids, stale=False):
+        url = "{self.server}/api/modules/{module}/bulk/status".format(**locals())
+        if stale:
+            url += "?stale=1"
+        action = "getting bulk status for {module}".format(**locals())
+        results = await self._bulk(url, self._batches(list(ids)), action)
+        return {id: status for result in results for (id, status) in result.items()}
+
+    async def bulk_result(self, module, ids, format=None):
+        url = "{self.server}/api/modules/{module}/bulk/result".format(**locals())
+        if format is not None:
+            url = "{url}?format={format}".format(**locals())
+        action = "getting bulk results for {module}".format(**locals())
+        results = await self._bulk(url, self._batches(list(ids)), action)
+        return {id: r for result in results for (id, r) in result.items()}
+
+    async def bulk_process(self, module, docs, ids=None, reset_error=False, reset_pending=False, priority=None,
+                           submitter=None):
+        url = ("{self.server}/api/modules/{module}/bulk/process?reset_error={reset_error}&reset_pending={reset_pending}"
+               .format(**locals()))
+        url += _lane_query(priority, submitter)
+        action = "bulk process for {module}".format(**locals())
+        retries = 0 if (reset_error or reset_pending) else None  # see HTTPClient.bulk_process
+        results = await self._bulk(url, self._document_batches(docs, ids), action, retries=retries)
+        return [id for result in results for id in result]
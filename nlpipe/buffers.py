@@ -0,0 +1,50 @@
+"""
+Helpers for reading stored results as bytes-like buffers (e.g. memory-mapped files) without copying them
+
+The converters accept a str, bytes or any buffer (memoryview, mmap) as result, so the bulk and conversion paths
+can hand the stored bytes directly to the xml parsers instead of reading, decoding and re-encoding each result.
+"""
+import mmap
+from xml.etree.ElementTree import XMLPullParser
+
+# Bytes fed to the xml parser at a time, so slices of a memory-mapped file are parsed without copying the whole file
+CHUNK_SIZE = 64 * 1024
+
+
+def map_file(filename):
+    """Memory-map the given file read-only, returning a memoryview (or b'' if the file is empty)"""
+    with open(filename, 'rb') as f:
+        try:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except ValueError:  # cannot map an empty file
+            return b""
+
+
+def to_bytes(data):
+    """Get the data as a bytes-like object: str is encoded as utf-8, bytes and buffers are returned as is"""
+    return data.encode("utf-8") if isinstance(data, str) else data
+
+
+def to_text(data) -> str:
+    """Get the data as str, decoding bytes and buffers as utf-8"""
+    return data if isinstance(data, str) else str(data, "utf-8")
+
+
+def startswith(data, prefix: bytes) -> bool:
+    """Check whether the data (after any leading whitespace) starts with the given bytes"""
+    head = bytes(memoryview(to_bytes(data))[:len(prefix) + 64]).lstrip()
+    return head[:len(prefix)] == prefix
+
+
+def iterparse(data, events=("end",)):
+    """
+    Incrementally parse xml from a str, bytes or buffer, like xml.etree.ElementTree.iterparse.
+    The data is fed to the parser in slices of a memoryview, so it is never copied as a whole.
+    """
+    view = memoryview(to_bytes(data))
+    parser = XMLPullParser(events=events)
+    for start in range(0, len(view), CHUNK_SIZE):
+        parser.feed(view[start:start + CHUNK_SIZE])
+        yield from parser.read_events()
+    parser.close()
+    yield from parser.read_events()
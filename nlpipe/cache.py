@@ -0,0 +1,77 @@
+"""
+On-disk cache of results for the HTTP client, so results are not downloaded again (see HTTPClient(cache=...)).
+
+Results are stored with the ETag the server sent them with, and the client validates a cached result by sending
+its ETag: the server only sends the result again if it changed (e.g. because it was reprocessed).
+The least recently used results are removed when the cache grows larger than its maximum size.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from typing import Optional, Tuple
+
+
+class ResultCache(object):
+    """Directory with a file per cached result, its modification time being the time it was last used"""
+
+    def __init__(self, directory=None, max_bytes=1024 ** 3):
+        """
+        :param directory: Cache directory (default: ~/.cache/nlpipe)
+        :param max_bytes: Maximum total size of the cached results
+        """
+        self.directory = directory or os.path.join(os.path.expanduser("~"), ".cache", "nlpipe")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(e.stat().st_size for e in os.scandir(self.directory) if not e.name.startswith("."))
+
+    def _filename(self, key: Tuple) -> str:
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode("utf-8")).hexdigest())
+
+    def get(self, key: Tuple) -> Optional[Tuple[str, str]]:
+        """Get the (etag, result) pair cached for the key, or None"""
+        fn = self._filename(key)
+        try:
+            with open(fn, 'rb') as f:
+                etag, _, result = f.read().partition(b"\n")
+            os.utime(fn)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return etag.decode("utf-8"), result.decode("utf-8")
+
+    def put(self, key: Tuple, etag: str, result: str):
+        data = etag.encode("utf-8") + b"\n" + result.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        fn = self._filename(key)
+        # write to a temporary file and rename it, so other clients using the cache never see a partial result
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self._size -= os.path.getsize(fn)
+            except FileNotFoundError:
+                pass
+            os.rename(tmp, fn)
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove the least recently used results until the cache is at most 90% full"""
+        entries = sorted((e for e in os.scandir(self.directory) if not e.name.startswith(".")),
+                         key=lambda e: e.stat().st_mtime)
+        self._size = sum(e.stat().st_size for e in entries)
+        for e in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            size = e.stat().st_size
+            try:
+                os.remove(e.path)
+            except FileNotFoundError:
+                pass  # removed by another client
+            self._size -= size
+        logging.debug("Evicted results from {self.directory}, {self._size} bytes left".format(**locals()))
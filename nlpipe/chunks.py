@@ -0,0 +1,39 @@
+"""
+Splitting large documents into chunks that are processed as separate tasks (see FSClient.chunk_size)
+
+Documents are split on paragraph boundaries (blank lines, as produced by e.g. nlpamcat), and the results of the
+chunks are merged back into a single result by the module (see Module.merge).
+"""
+import re
+from typing import List, Tuple
+
+# Chunks are processed as tasks with id <document id>~chunk<n>
+CHUNK = "~chunk"
+
+PARAGRAPH = re.compile("\n\n")
+
+
+def chunk_id(id: str, n: int) -> str:
+    return "{id}{CHUNK}{n}".format(CHUNK=CHUNK, **locals())
+
+
+def parent_id(id: str) -> str:
+    """Get the id of the document of the given chunk"""
+    return id.rpartition(CHUNK)[0]
+
+
+def split(text: str, size: int) -> List[Tuple[int, str]]:
+    """
+    Split the text on paragraph boundaries into chunks of at most size characters, unless a paragraph is larger
+    :return: a list of (offset, chunk) pairs, offset being the position of the chunk in the text
+    """
+    chunks = []
+    start = end = 0  # the current chunk is text[start:end]
+    for bound in [m.start() for m in PARAGRAPH.finditer(text)] + [len(text)]:
+        if bound - start > size and end > start:
+            chunks.append((start, text[start:end]))
+            start = end + 2
+        end = bound
+    if start < len(text) or not chunks:
+        chunks.append((start, text[start:]))
+    return chunks
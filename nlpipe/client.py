@@ -4,14 +4,22 @@ import time
 import os.path
 import errno
 import logging
-import subprocess
+import re
+import tempfile
+import threading
 
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 
 import requests
 
+from nlpipe.buffers import map_file
+from nlpipe.chunks import CHUNK, chunk_id, parent_id, split
 from nlpipe.module import Module, get_module, known_modules
+from nlpipe.pipeline import Pipeline, get_pipeline
+from nlpipe.events import follow
+from nlpipe.compression import compress, decompress, get_codec, default_compression, HTTP_MIN_SIZE
 
 # Status definitions and subdir names
 
@@ -20,42 +28,138 @@ STATUS = {"PENDING": "queue",
           "DONE": "results",
           "ERROR": "errors"}
 
+# The input document of failed tasks is kept under this pseudo-status, so they can be requeued.
+# Documents that are split into chunks have a list of their chunks as pseudo-status CHUNKED (reported as PENDING),
+# which is moved to MERGING (reported as STARTED) while the results of the chunks are merged.
+# Tasks that are part of a pipeline have the pipeline (its name and stages, so workers that did not register it can
+# hand off the result) under pseudo-status NEXT until their result is handed off.
+# The fingerprint of the module that produced a result (see Module.fingerprint) is stored as pseudo-status VERSION,
+# and the fingerprint most recently reported by a worker as pseudo-status FINGERPRINT with id LATEST.
+# BYHASH is an index of the id of a document with the given content hash (see get_id), to reuse its result
+# (documents that were submitted without an id are not indexed, their id is the hash).
+# Started tasks have a marker as pseudo-status CLAIMED that is written when they are claimed: the task itself is moved
+# (and may be a hard link to a stored document), so its file times do not tell when it was started. The marker holds
+# the submitter of the task, and is kept with the ERROR_DOCUMENT of failed tasks so they are requeued in their lane
+SUBDIRS = dict(STATUS, ERROR_DOCUMENT="errordocs", CHUNKED="chunks", MERGING="merging", NEXT="next",
+               VERSION="versions", FINGERPRINT="fingerprint", BYHASH="byhash", CLAIMED="claimed")
+LATEST = "latest"
+
+# Subdir of the storage directory for the documents shared by all modules
+DOCUMENTS = "_documents"
+# Stored documents are keyed by id and format, so e.g. the plain text and the NAF version of an article can share its
+# id. Plain text documents are stored in DOCUMENTS, other formats in DOCUMENTS.<format>, see _document_format
+TEXT, NAF = "text", "naf"
+DOCUMENT_FORMATS = (TEXT, NAF)
+
+# Pending tasks can be put in lanes (e.g. a priority), which are stored as pseudo-status LANE + <lane name>
+# that only mark the task, in <module>/lanes/<lane name>/<id> with the file system client
+LANE = "LANE:"
+
+# Task priorities: workers take interactive tasks before batch tasks (the default)
+PRIORITIES = ("interactive", "batch")
+
+# Batch tasks are put in a lane per submitter (e.g. a research group or project), prefixed by SUBMITTER.
+# Workers share the batch throughput over the submitters, see FSClient.submitter_weights
+SUBMITTER = "submitter."
+DEFAULT_SUBMITTER = "default"
+# Stale results are reprocessed as batch tasks of this submitter, see FSClient.reprocess_weight
+REPROCESS_SUBMITTER = "reprocess"
+
+# Size classes of documents as (name, upper bound in bytes of the stored document), the last class has no bound.
+# Batch lanes are split per size class as <submitter lane>@<size class>, see FSClient.size_aging
+SIZE = "@"
+SIZE_CLASSES = (("small", 16 * 1024), ("medium", 256 * 1024), ("large", None))
+
 
 def get_id(doc):
     """
     Calculate the id (hash) of the given document
-    :param doc: The document (string)
+    :param doc: The document (string or utf-8 bytes)
     :return: a task id (hash)
     """
-    if len(doc) == 34 and doc.startswith("0x"):
-        # it sure looks like a hash
-        return doc
-    m = hashlib.md5()
+    if isinstance(doc, bytes) and len(doc) == 34 and doc.startswith(b"0x"):
+        doc = doc.decode("utf-8")  # only (ascii) bytes of this length can be a hash, so others need not be decoded
     if isinstance(doc, str):
+        if len(doc) == 34 and doc.startswith("0x"):
+            # it sure looks like a hash
+            return doc
         doc = doc.encode("utf-8")
+    m = hashlib.md5()
     m.update(doc)
     return "0x" + m.hexdigest()
 
+
+def _parse_change(line: bytes):
+    """Parse a line of a change log (see FSClient._publish) into an (id, status, submitter) triple"""
+    fields = line.decode("utf-8").rstrip("\n").split("\t")
+    id, status = fields[:2]
+    submitter = fields[2] if len(fields) > 2 and fields[2] else None  # older logs have no submitter
+    return id, status, submitter
+
+
+def _check_priority(priority):
+    if priority is not None and priority not in PRIORITIES:
+        raise ValueError("Unknown priority: {priority}, use one of {PRIORITIES}"
+                         .format(priority=priority, PRIORITIES=PRIORITIES))
+
+
+def _check_submitter(submitter):
+    if submitter is not None and not re.match(r"^[\w.-]+$", submitter):
+        raise ValueError("Invalid submitter: {submitter!r}, use only letters, digits, '_', '.' and '-'"
+                         .format(**locals()))
+
+
+def _check_sizes(sizes):
+    names = [name for (name, _bound) in SIZE_CLASSES]
+    for size in sizes or ():
+        if size not in names:
+            raise ValueError("Unknown size class: {size}, use one of {names}".format(**locals()))
+
+
+def size_class(size: int) -> str:
+    """Get the name of the size class for a document of the given size (in bytes)"""
+    for name, bound in SIZE_CLASSES:
+        if bound is None or size < bound:
+            return name
+
+
+def _bytes(doc):
+    return doc.encode("utf-8") if isinstance(doc, str) else doc
+
+
+def _document_format(data: bytes) -> str:
+    """Get the format of a document for the document store: NAF if it is xml with a NAF root element, else TEXT"""
+    head = data[:4096]
+    return NAF if head.lstrip().startswith(b"<") and b"<NAF" in head else TEXT
+
+
 class Client(object):
     """Abstract class for NLPipe client bindings"""
 
-    def process(self, module, doc, id=None, reset_error=False, reset_pending=False):
+    def process(self, module, doc, id=None, reset_error=False, reset_pending=False, priority=None, submitter=None):
         """Add a document to be processed by module, returning the task ID
         :param module: Module name
-        :param doc: A document (string)
+        :param doc: A document (string or utf-8 bytes)
         :param id: An optional id for the task
         :param reset_error: Re-assign documents that have status 'ERROR'
         :param reset_pending: Re-assign documents that have status 'PENDING'
+        :param priority: 'interactive' or 'batch' (default), interactive tasks are processed first.
+                         Giving interactive priority for a pending document moves it to the interactive lane
+        :param submitter: Submitter or project key, batch tasks are processed in turn for each submitter
         :return: task ID
         :rtype: str
         """
         raise NotImplementedError()
 
-    def status(self, module, id):
+    def status(self, module, id, stale=False):
         """Get processing status
         :param module: Module name
         :param id: Task ID
-        :return: any of 'UNKNOWN', 'PENDING', 'STARTED', 'DONE', 'ERROR'
+        :param stale: Report 'STALE' rather than 'DONE' if the result was produced by another version or
+                      configuration of the module than the one most recently reported by a worker
+                      (see Module.fingerprint)
+        :return: any of 'UNKNOWN', 'PENDING', 'STARTED', 'DONE', 'ERROR' (or 'STALE').
+                 Results that are being reprocessed are DONE, as the previous result is available
         """
         raise NotImplementedError()
 
@@ -71,47 +175,52 @@ class Client(object):
         """
         raise NotImplementedError()
 
-    def process_inline(self, module, doc, format=None, id=None):
+    def process_inline(self, module, doc, format=None, id=None, priority="interactive"):
         """
         Process the given document, use cached version if possible, wait and return result
         :param module: Module name
         :param doc: A document (string)
+        :param priority: Task priority, by default it is processed before batch tasks (see process)
         :return: The result of processing (string)
         """
         if id is None:
             id = get_id(doc)
-        if self.status(module, id) == 'UNKNOWN':
-            self.process(module, doc, id)
+        if self.status(module, id) in ('UNKNOWN', 'PENDING'):
+            self.process(module, doc, id, priority=priority)
         while True:
             status = self.status(module, id)
             if status in ('DONE', 'ERROR'):
                 return self.result(module, id, format=format)
             time.sleep(0.1)
 
-    def get_task(self, module):
+    def get_task(self, module, sizes=None):
         """
         Get a document to process with the given module, marking the document as 'in progress'
         :param module: Name of the module
+        :param sizes: Only take batch tasks of these size classes (see SIZE_CLASSES), e.g. ['large'] for a worker
+                      with more memory. Such a worker does not take interactive tasks
         :return: a pair (id, string) for the document to be processed
         """
         raise NotImplementedError()
 
-    def get_tasks(self, module, n):
+    def get_tasks(self, module, n, sizes=None):
         """
         Get multiple documents to process
         :param module: Name of the module for processing
         :param n: Number of documents to retrieve
+        :param sizes: Size classes to take batch tasks from, see get_task
         :return: a sequence of (id, document string) pairs
         """
         for i in range(n):
-            yield self.get_task(module)
+            yield self.get_task(module, sizes=sizes)
 
-    def store_result(self, module, id, result):
+    def store_result(self, module, id, result, fingerprint=None):
         """
         Store the given result
         :param module: Module name
         :param id: Document or task ID
-        :param result: Result (string)
+        :param result: Result (string or utf-8 bytes)
+        :param fingerprint: The fingerprint of the module that produced the result, see Module.fingerprint
         """
         raise NotImplementedError()
 
@@ -125,13 +234,53 @@ class Client(object):
         raise NotImplementedError()
 
 
-    def bulk_status(self, module, ids):
+    def changes(self, module, since=0, limit=1000, results=False):
+        """
+        Get the tasks that were completed (status DONE or ERROR) since the given cursor, in order of completion
+        :param module: Module name
+        :param since: Cursor, 0 for all changes or the cursor of the last change that was processed before
+        :param limit: Maximum number of changes to get
+        :param results: Include the result of DONE tasks
+        :return: a list of {'id': id, 'status': status, 'cursor': cursor} dicts (with 'result' if requested).
+                 Tasks that are completed again (e.g. when they are reprocessed) appear again
+        """
+        raise NotImplementedError()
+
+    def iter_changes(self, module, since=0, results=False, follow=False, batch=1000, poll=1):
+        """
+        Iterate over the changes since the given cursor (see changes), getting them in batches.
+        Store the cursor of the last processed change to continue from there later
+        :param follow: Keep waiting for new changes, rather than stopping when all changes are retrieved
+        :param poll: Seconds to wait before checking for new changes if follow is True
+        """
+        while True:
+            changes = self.changes(module, since=since, limit=batch, results=results)
+            yield from changes
+            if changes:
+                since = changes[-1]["cursor"]
+            if len(changes) < batch:
+                if not follow:
+                    return
+                time.sleep(poll)
+
+    def events(self, modules=None, submitters=None):
+        """
+        Iterate over task status changes as they happen (of all processes), e.g. to act on completed tasks
+        :param modules: Only get events for these module names
+        :param submitters: Only get events for tasks of these submitters
+        :return: an (endless) iterator of {'id': id, 'module': module, 'status': status, 'submitter': submitter}
+                 dicts, submitter being None if it is not known
+        """
+        raise NotImplementedError()
+
+    def bulk_status(self, module, ids, stale=False):
         """Get processing status of multiple ids
         :param module: Module name
         :param ids: Task IDs
+        :param stale: Report stale results as 'STALE', see status
         :return: a dict of {id: status}
         """
-        return {id: self.status(module, id) for id in ids}
+        return {id: self.status(module, id, stale=stale) for id in ids}
 
     def bulk_result(self, module, ids, format=None):
         """Get results for multiple ids
@@ -141,6 +290,16 @@ class Client(object):
         """
         return {id: self.result(module, id, format=format) for id in ids}
 
+    def bulk_export(self, module, ids, format="parquet"):
+        """Export the results for multiple ids as a single columnar file
+        :param module: Module name
+        :param ids: Task IDs
+        :param format: 'parquet' or 'arrow' (arrow ipc file format)
+        :return: The file contents (bytes)
+        """
+        from nlpipe.export import export
+        return export(module, self.bulk_result(module, ids), format=format)
+
     def bulk_process(self, module, docs, ids=None, **kargs):
         """
         Add multiple documents to the processing queue
@@ -154,19 +313,109 @@ class Client(object):
             ids = itertools.repeat(None)
         return [self.process(module, doc, id=id, **kargs) for (doc, id) in zip(docs, ids)]
 
+    def requeue(self, module, status="ERROR", ids=None, older_than=None, message=None):
+        """
+        Put failed (ERROR) or stalled (STARTED) tasks back on the queue, using the stored input documents
+        :param module: Module name
+        :param status: 'ERROR', 'STARTED' or a list of both
+        :param ids: Only requeue these task IDs (default: all tasks with the given status)
+        :param older_than: Only requeue tasks that have had their status for at least this many seconds
+        :param message: Only requeue errors whose message matches this regular expression
+        :return: a list of the requeued ids
+        """
+        raise NotImplementedError()
+
+    def reprocess(self, module, ids=None):
+        """
+        Queue the documents with a stale result (see status) to be processed again by the current module version.
+        They are processed as batch tasks with a low share of the workers, and the old result stays available until
+        the new result is stored (or if reprocessing fails)
+        :param module: Module name
+        :param ids: Only reprocess these task IDs (default: all stale results)
+        :return: a list of the ids that were queued
+        :raises ValueError: if the input document of a stale result is not stored, nothing is queued then
+        """
+        raise NotImplementedError()
+
+    def enqueue(self, module, ids, reset_error=False, reset_pending=False, priority=None, submitter=None):
+        """
+        Add plain text documents that are already stored (e.g. because they were processed by another module)
+        to the processing queue, without uploading them again. Stored documents in another format (e.g. NAF)
+        are not used, even if they have the same id
+        :param module: Module name
+        :param ids: Document IDs
+        :param reset_error: Re-assign documents with status ERROR
+        :param reset_pending: Re-assign documents with status STARTED
+        :param priority: Task priority, see process
+        :param submitter: Submitter or project key, see process
+        :return: a list of the ids whose document is not known, these should be added with (bulk_)process
+        """
+        raise NotImplementedError()
+
+    def process_pipeline(self, pipeline, doc, id=None, priority=None, submitter=None):
+        """
+        Add a document to be processed by a pipeline (see nlpipe.pipeline) registered on the server.
+        The result of each module is queued as input for the next module(s) as soon as it is done
+        :param pipeline: Pipeline name
+        :param doc: A document (string or utf-8 bytes)
+        :param id: An optional id for the task, the document has this id in all modules of the pipeline
+        :param priority: Task priority for all modules, see process
+        :param submitter: Submitter or project key, see process
+        :return: task ID
+        """
+        raise NotImplementedError()
+
+    def pipeline_status(self, pipeline, id):
+        """
+        Get the processing status of a document in each module of a pipeline
+        :return: a dict of {module: status}
+        """
+        raise NotImplementedError()
+
 
 class FSClient(Client):
     """
     NLPipe client that relies on direct filesystem access (e.g. on local machine or over NFS)
     """
 
-    def __init__(self, result_dir):
+    # Starvation guard: every n-th task is taken from the batch lane, even if there are interactive tasks
+    batch_every = 10
+    # Relative share of the batch throughput per submitter, e.g. {"groupA": 2}; submitters not listed get 1
+    submitter_weights = {}
+    # Shortest job first: a submitter's smaller documents are processed first, but a task gets ahead of the tasks
+    # of the next smaller size class once it has waited this many seconds longer than them
+    size_aging = 600
+    # Split documents larger than this (in characters) on paragraph boundaries and process the chunks as separate
+    # tasks, for modules that can merge their results (see Module.merge). None (default) disables chunking
+    chunk_size = None
+    # Share of the batch throughput for reprocessing stale results, relative to the submitter weights
+    reprocess_weight = 0.1
+    # Reuse the result of an identical document that was submitted with another explicit id, see _reuse_result
+    dedup = True
+    # Keep stored documents after they are processed, so they can be enqueued for other modules and stale results
+    # can be reprocessed later. If False, a document is removed once no module has it pending, started or failed,
+    # which saves disk space but means that documents have to be uploaded again for other modules
+    keep_documents = True
+
+    def __init__(self, result_dir, compression=None):
+        """
+        :param result_dir: The storage directory
+        :param compression: Compression codec ('gzip' or 'zstd') for all modules, a {module: codec} dict,
+                            or None to use $NLPIPE_COMPRESSION (see nlpipe.compression.parse_compression)
+        """
         self.result_dir = result_dir
+        self.compression = default_compression() if compression is None else compression
+        self._lock = threading.Lock()  # guards the scheduling state below when the client is used by threads
+        self._claims = 0
+        self._served = {}  # module : {submitter lane : number of claimed tasks divided by the submitter's weight}
+        self._dedup = {}  # module : [hits, misses] of the result reuse for identical documents
+        self._submitters = {}  # (module, id) : submitter of the started tasks and chunked documents, see _publish
+        self._mtimes = {}  # directory : {(file name, inode) : modification time} of the tasks, see _oldest
         for module in known_modules():
             self._check_dirs(module.name)
 
     def _check_dirs(self, module: str):
-        for subdir in STATUS.values():
+        for subdir in SUBDIRS.values():
             dirname = os.path.join(self.result_dir, module, subdir)
             try:
                 os.makedirs(dirname)
@@ -177,12 +426,54 @@ class FSClient(Client):
     def _write(self, module, status, id, doc):
         self._check_dirs(module)
         fn = self._filename(module, status, id)
-        open(fn, 'w', encoding="UTF-8").write(doc)
+        if status.startswith(LANE):
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+        # write to a temporary file and replace the old file, so the file is never changed in place: a reader may
+        # have it memory-mapped (see _buffer) or it may be shared with another task (see _link)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn), prefix=".")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self._encode(module, doc))
+            os.replace(tmp, fn)
+        except:
+            os.remove(tmp)
+            raise
         return fn
 
+    def _encode(self, module, doc):
+        """Encode the document to bytes as it should be stored, i.e. compressed if needed"""
+        data = doc.encode("UTF-8") if isinstance(doc, str) else doc
+        codec = get_codec(self.compression, module)
+        if codec is not None:
+            data = compress(data, codec)
+        return data
+
     def _read(self, module, status, id):
-        fn = self._filename(module, status, id)
-        return open(fn, encoding="UTF-8").read()
+        return decompress(self._read_raw(module, status, id)).decode("UTF-8")
+
+    def _read_raw(self, module, status, id):
+        """Read the stored bytes, which might be compressed (see nlpipe.compression.detect)"""
+        with self._open(module, status, id) as f:
+            return f.read()
+
+    def _open(self, module, status, id):
+        """Open the stored file as a binary file object"""
+        return open(self._filename(module, status, id), 'rb')
+
+    def _buffer(self, module, status, id):
+        """Get the (decompressed) data as a bytes-like buffer, memory-mapping the file if it is not compressed"""
+        return decompress(map_file(self._filename(module, status, id)))
+
+    def _link(self, module, status, id, to_id):
+        """Store the data of a task for another id as well, as a hard link if possible"""
+        fn_from, fn_to = self._filename(module, status, id), self._filename(module, status, to_id)
+        try:
+            os.link(fn_from, fn_to)
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.EXDEV, errno.EMLINK):
+                raise
+            with open(fn_from, 'rb') as f, open(fn_to, 'wb') as out:
+                out.write(f.read())
 
     def _move(self, module, id, from_status, to_status):
         fn_from = self._filename(module, from_status, id)
@@ -193,8 +484,69 @@ class FSClient(Client):
         fn = self._filename(module, status, id)
         os.remove(fn)
 
+    def _exists(self, module, status, id):
+        return os.path.exists(self._filename(module, status, id))
+
+    def _oldest(self, module, status):
+        """Get the id of the least recently modified document with the given status, or None if there are none"""
+        path = self._filename(module, status)
+        try:
+            entries = [(e.name, e.inode()) for e in os.scandir(path) if not e.name.startswith(".")]
+        except FileNotFoundError:  # lanes are created when needed
+            return None
+        # only new files are stat'ed, the listing itself does not need a stat call per file
+        with self._lock:
+            cached = self._mtimes.get(path, {})
+        mtimes = {}
+        for entry in entries:
+            mtime = cached.get(entry)
+            if mtime is None:
+                try:
+                    mtime = os.stat(os.path.join(path, entry[0])).st_mtime
+                except FileNotFoundError:
+                    continue  # claimed or removed in the meantime
+            mtimes[entry] = mtime
+        with self._lock:
+            self._mtimes[path] = mtimes
+        return min(mtimes, key=mtimes.get)[0] if mtimes else None
+
+    def _list(self, module, status):
+        """Get the ids of all documents with the given status"""
+        try:
+            return [fn for fn in os.listdir(self._filename(module, status)) if not fn.startswith(".")]
+        except FileNotFoundError:  # lanes are created when needed
+            return []
+
+    def _age(self, module, status, id):
+        """Get the time in seconds since the task got its status (i.e. since its file was written, see CLAIMED)"""
+        if status == 'STARTED':
+            try:
+                return time.time() - os.stat(self._filename(module, 'CLAIMED', id)).st_mtime
+            except FileNotFoundError:
+                pass  # claimed before markers were used, so it has been started at least since it was queued
+        return time.time() - os.stat(self._filename(module, status, id)).st_mtime
+
+    def _size(self, module, status, id):
+        """Get the size in bytes of the stored (i.e. possibly compressed) document"""
+        return os.path.getsize(self._filename(module, status, id))
+
+    def _etag(self, module, status, id):
+        """Get a string that changes whenever the document is (re)written, e.g. for HTTP caching"""
+        st = os.stat(self._filename(module, status, id))
+        return "{:x}-{:x}-{:x}".format(st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _count(self, module, status):
+        """Get the number of documents with the given status"""
+        try:
+            return sum(1 for entry in os.scandir(self._filename(module, status)) if not entry.name.startswith("."))
+        except FileNotFoundError:  # lanes are created when needed
+            return 0
+
     def _filename(self, module, status, id=None):
-        dirname = os.path.join(self.result_dir, module, STATUS[status])
+        if status.startswith(LANE):
+            dirname = os.path.join(self.result_dir, module, "lanes", status[len(LANE):])
+        else:
+            dirname = os.path.join(self.result_dir, module, SUBDIRS[status])
         if id is None:
             return dirname
         else:
@@ -204,102 +556,890 @@ class FSClient(Client):
         self._check_dirs(self, module)
         return module.check_status()
         
-    def status(self, module, id):
+    def status(self, module, id, stale=False):
+        status = self._task_status(module, id)
+        if status in ('PENDING', 'STARTED') and self._exists(module, 'DONE', id):
+            status = 'DONE'  # being reprocessed, the previous result is available until the new result is stored
+        if stale and status == 'DONE' and self._is_stale(module, id, self._current_fingerprint(module)):
+            return 'STALE'
+        return status
+
+    def _task_status(self, module, id):
+        """Get the status of the task itself, i.e. PENDING or STARTED for a result that is being reprocessed"""
         for status in STATUS.keys():
-            if os.path.exists(self._filename(module, status, id)):
+            if self._exists(module, status, id):
                 return status
+        if self._exists(module, 'CHUNKED', id):
+            return 'PENDING'
+        if self._exists(module, 'MERGING', id):
+            return 'STARTED'
         return 'UNKNOWN'
 
-    def process(self, module, doc, id=None, reset_error=False, reset_pending=False):
+    def process(self, module, doc, id=None, reset_error=False, reset_pending=False, priority=None, submitter=None):
+        _check_priority(priority)
+        _check_submitter(submitter)
         if id is None:
             id = get_id(doc)
-        status = self.status(module, id)
+        if self._can_assign(module, id, reset_error, reset_pending):
+            if self._reuse_result(module, id, doc, submitter):
+                return id
+            chunks = self._split(module, doc)
+            if chunks:
+                self._queue_chunks(module, id, doc, chunks, priority, submitter)
+                return id
+            self._queue(module, id, doc)
+            self._mark_batch(module, id, submitter)
+        self._prioritize(module, id, priority)
+        return id
+
+    def enqueue(self, module, ids, reset_error=False, reset_pending=False, priority=None, submitter=None):
+        _check_priority(priority)
+        _check_submitter(submitter)
+        unknown = []
+        for id in ids:
+            if not self._has_document(id):
+                unknown.append(id)
+                continue
+            if self._can_assign(module, id, reset_error, reset_pending):
+                try:
+                    self._link_document(module, 'PENDING', id)
+                except FileNotFoundError:
+                    unknown.append(id)  # removed concurrently, see _release_document
+                    continue
+                self._mark_batch(module, id, submitter)
+            self._prioritize(module, id, priority)
+        return unknown
+
+    def process_pipeline(self, pipeline, doc, id=None, priority=None, submitter=None):
+        p = get_pipeline(pipeline)
+        if id is None:
+            id = get_id(doc)
+        for module in p.first:
+            self._start_stage(p, module, id, doc, priority, submitter, first=True)
+        return id
+
+    def pipeline_status(self, pipeline, id):
+        return {module: self.status(module, id) for module in get_pipeline(pipeline).modules}
+
+    def _start_stage(self, pipeline, module, id, doc, priority=None, submitter=None, first=False):
+        """Queue a document for a module of the pipeline, the first modules get the original document"""
+        if pipeline.next(module):
+            info = dict(pipeline=pipeline.name, stages=pipeline.stages, priority=priority, submitter=submitter)
+            self._write(module, 'NEXT', id, json.dumps(info))
+        if first:
+            self.process(module, doc, id=id, priority=priority, submitter=submitter)
+        elif self._can_assign(module, id, False, False):
+            # the input of later modules is a result, so it is not put in the shared document store
+            self._write(module, 'PENDING', id, doc)
+            self._mark_batch(module, id, submitter)
+            self._prioritize(module, id, priority)
+        if self.status(module, id) == 'DONE':
+            self._next_stages(module, id)  # processed before, so continue with the existing result
+
+    def _next_stages(self, module, id):
+        """Queue the result of a pipeline task as input for the next modules of the pipeline"""
+        try:
+            info = json.loads(self._read(module, 'NEXT', id))
+            result = self._read(module, 'DONE', id)
+        except FileNotFoundError:
+            return  # not part of a pipeline, or handed off already
+        try:
+            if "stages" in info:
+                pipeline = Pipeline(info["pipeline"], info["stages"])
+            else:
+                pipeline = get_pipeline(info["pipeline"])  # queued before the stages were stored
+            for next in pipeline.next(module):
+                self._start_stage(pipeline, next, id, result, info["priority"], info["submitter"])
+        except Exception:
+            # the result is stored, so the task should not fail; the marker is kept to hand off a new result
+            logging.exception("Error handing off {module}/{id} to the next modules of pipeline {}"
+                              .format(info["pipeline"], **locals()))
+            return
+        try:
+            self._delete(module, 'NEXT', id)
+        except FileNotFoundError:
+            pass
+
+    def _mark(self, module, id, lane):
+        """Put a pending task in the given lane"""
+        self._write(module, LANE + lane, id, b"")
+
+    def _mark_batch(self, module, id, submitter=None):
+        """Put a pending task in the lane of its submitter and size class"""
+        size = size_class(self._size(module, 'PENDING', id))
+        submitter = submitter or DEFAULT_SUBMITTER
+        self._mark(module, id, SUBMITTER + submitter + SIZE + size)
+        if CHUNK not in str(id):
+            self._publish(module, id, 'PENDING', submitter)
+
+    def _prioritize(self, module, id, priority):
+        """Put a pending task in the interactive lane if requested"""
+        if priority == "interactive" and self._exists(module, 'PENDING', id):
+            self._mark(module, id, priority)
+
+    def _lanes(self, module):
+        """Get the names of the lanes of this module"""
+        try:
+            return os.listdir(os.path.join(self.result_dir, module, "lanes"))
+        except FileNotFoundError:
+            return []
+
+    def _can_assign(self, module, id, reset_error, reset_pending):
+        """Check whether the document can be (re)assigned to the module, removing it from its current status"""
+        status = self._task_status(module, id)
         if status == 'UNKNOWN':
             logging.debug("Assigning doc {id} to {module}".format(**locals()))
-            self._write(module, 'PENDING', id, doc)
-        elif (status == "ERROR" and reset_error) or (status == "STARTED" and reset_pending):
+            return True
+        if (status == "ERROR" and reset_error) or (status == "STARTED" and reset_pending):
+            if not self._exists(module, status, id):
+                # a chunked document whose results are being merged (MERGING is reported as STARTED)
+                logging.debug("Not re-assigning doc {id} to {module}, its chunks are being merged".format(**locals()))
+                return False
             logging.debug("Re-assigning doc {id} with status {status} to {module}".format(**locals()))
             self._delete(module, status, id)
-            self._write(module, 'PENDING', id, doc)
-        else:
-            logging.debug("Document {id} had status {}".format(self.status(module, id), **locals()))
-        return id
+            self._unclaim(module, id)
+            if status == "ERROR":
+                self._delete_error_document(module, id)
+            return True
+        logging.debug("Document {id} had status {status}".format(**locals()))
+        return False
+
+    def _queue(self, module, id, doc):
+        """Put the document on the module's queue, storing it in the shared document store if it is new"""
+        data = _bytes(doc)
+        format = _document_format(data)
+        if not self._has_document(id, format):
+            # compressed with the codec of the first module, readers detect the compression of each file
+            self._write_document(id, self._encode(module, data), format)
+        elif id != get_id(data) and self._read_document(id, format) != data:
+            # an explicit id that is used for different documents of the same format, so keep a private copy
+            self._write(module, 'PENDING', id, data)
+            return
+        try:
+            self._link_document(module, 'PENDING', id, format)
+        except FileNotFoundError:
+            self._write(module, 'PENDING', id, data)  # removed concurrently, see _release_document
+
+    def _reuse_result(self, module, id, doc, submitter=None):
+        """
+        If an identical document was processed under another id with the current module version, link its result
+        instead of processing the document again. Returns whether a result was reused
+        """
+        hash = get_id(doc)
+        if not self.dedup or hash == id:
+            return False  # documents without explicit id are deduplicated by their id
+        with self._lock:
+            counts = self._dedup.setdefault(module, [0, 0])
+        try:
+            source = self._read(module, 'BYHASH', hash)
+        except FileNotFoundError:
+            source = hash  # documents without explicit id are not indexed, as their id is the hash
+        status = self.status(module, source, stale=True)
+        if status == 'DONE':
+            try:
+                self._link(module, 'DONE', source, id)
+                self._set_version(module, id, self._version(module, source))
+                with self._lock:
+                    counts[0] += 1
+                self._completed(module, id, 'DONE', submitter or DEFAULT_SUBMITTER)
+                logging.debug("Reusing result of {module}/{source} for identical document {id}".format(**locals()))
+                return True
+            except FileNotFoundError:
+                pass  # result was removed in the meantime
+        with self._lock:
+            counts[1] += 1
+        if status not in ('PENDING', 'STARTED'):
+            self._write(module, 'BYHASH', hash, id)
+        return False
+
+    def _split(self, module, doc):
+        """Split the document into (offset, text) chunks if it should be chunked (see chunk_size), else None"""
+        # a utf-8 document has at least as many bytes as characters, so small documents need not be decoded
+        if self.chunk_size is None or len(doc) <= self.chunk_size or not get_module(module).chunkable:
+            return None
+        text = doc.decode("utf-8") if isinstance(doc, bytes) else doc
+        if len(text) <= self.chunk_size:
+            return None
+        chunks = split(text, self.chunk_size)
+        return chunks if len(chunks) > 1 else None
+
+    def _queue_chunks(self, module, id, doc, chunks, priority, submitter):
+        """Queue the chunks of a document as separate tasks, their results are merged when all are done"""
+        data = _bytes(doc)
+        format = _document_format(data)
+        if not self._has_document(id, format):
+            self._write_document(id, self._encode(module, data), format)
+        ids = [chunk_id(id, i) for i in range(len(chunks))]
+        self._write(module, 'CHUNKED', id, json.dumps([[cid, offset] for (cid, (offset, _)) in zip(ids, chunks)]))
+        for cid, (_offset, text) in zip(ids, chunks):
+            self._write(module, 'PENDING', cid, text)
+            self._mark_batch(module, cid, submitter)
+            self._prioritize(module, cid, priority)
+        self._publish(module, id, 'PENDING', submitter or DEFAULT_SUBMITTER)
+        self._submitters[module, id] = submitter or DEFAULT_SUBMITTER  # the chunks are not published
+        logging.debug("Split {module}/{id} into {} chunks".format(len(chunks), **locals()))
+
+    def _chunks(self, module, id):
+        """Get the (chunk id, offset) pairs of a chunked document, or None if it is not (or no longer) chunked"""
+        try:
+            return json.loads(self._read(module, 'CHUNKED', id))
+        except FileNotFoundError:
+            return None
+
+    def _chunk_done(self, module, id, fingerprint=None):
+        """Merge the results of a chunked document if the given chunk was the last one to finish"""
+        parent = parent_id(id)
+        chunks = self._chunks(module, parent)
+        if chunks is None:
+            if self._exists(module, 'ERROR', parent):
+                self._delete(module, 'DONE', id)  # another chunk failed, so this result is not needed
+            return
+        if not all(self._exists(module, 'DONE', cid) for (cid, _offset) in chunks):
+            return
+        try:
+            self._move(module, parent, 'CHUNKED', 'MERGING')
+        except FileNotFoundError:
+            return  # merged by the worker that stored another chunk
+        try:
+            results = [(offset, self._read(module, 'DONE', cid)) for (cid, offset) in chunks]
+            self._write(module, 'DONE', parent, get_module(module).merge(results))
+            self._set_version(module, parent, fingerprint)
+            self._completed(module, parent, 'DONE')
+            self._next_stages(module, parent)
+        except Exception as e:
+            logging.exception("Error merging the chunks of {module}/{parent}".format(**locals()))
+            self._fail_chunked(module, parent, "Error merging chunks: {e}".format(**locals()),
+                               self._submitters.get((module, parent)))
+        finally:
+            self._delete(module, 'MERGING', parent)
+        self._discard_chunks(module, chunks)
+        self._release_document(parent)
+
+    def _chunk_failed(self, module, id, message):
+        """Store the error of a chunk as error of its document, returning False if the task is not a chunk"""
+        parent = parent_id(id)
+        chunks = self._chunks(module, parent)
+        if chunks is None:
+            if not self._exists(module, 'ERROR', parent):
+                return False
+            self._delete(module, 'STARTED', id)  # another chunk failed before
+            self._unclaim(module, id)
+            return True
+        try:
+            self._delete(module, 'CHUNKED', parent)
+        except FileNotFoundError:
+            pass  # another chunk failed concurrently
+        self._fail_chunked(module, parent, "Error processing chunk {id}: {message}".format(**locals()),
+                           self._claimant(module, id))
+        self._delete(module, 'STARTED', id)
+        self._unclaim(module, id)
+        self._discard_chunks(module, chunks)
+        return True
+
+    def _fail_chunked(self, module, id, message, submitter=None):
+        self._write(module, 'ERROR', id, message)
+        self._completed(module, id, 'ERROR', submitter)
+        # the whole document (not chunked) can be requeued, in the lane of its submitter
+        format = self._stored_format(module, id)
+        if format is not None and not self._exists(module, 'ERROR_DOCUMENT', id):
+            self._link_document(module, 'ERROR_DOCUMENT', id, format)
+            if submitter is not None:
+                self._write(module, 'CLAIMED', id, submitter)
+
+    def _discard_chunks(self, module, chunks):
+        """Remove the pending tasks and results of the given chunks, chunks in progress are removed when stored"""
+        for cid, _offset in chunks:
+            for status in 'PENDING', 'DONE', 'VERSION':
+                try:
+                    self._delete(module, status, cid)
+                except FileNotFoundError:
+                    pass
+            self._unmark(module, cid)
+
+    def _document_filename(self, id, format=TEXT):
+        dirname = DOCUMENTS if format == TEXT else DOCUMENTS + "." + format
+        return os.path.join(self.result_dir, dirname, str(id))
+
+    def _has_document(self, id, format=TEXT):
+        return os.path.exists(self._document_filename(id, format))
+
+    def _stored_format(self, module, id):
+        """Get the format of the stored input document of a task, or None if it is not (unambiguously) stored"""
+        formats = [format for format in DOCUMENT_FORMATS if self._has_document(id, format)]
+        if len(formats) > 1:
+            logging.warning("{module}/{id} has stored documents in several formats ({formats}), "
+                            "so its input document is not known".format(**locals()))
+            return None
+        return formats[0] if formats else None
+
+    def _read_document(self, id, format=TEXT):
+        """Read a document from the document store as (decompressed) bytes"""
+        with open(self._document_filename(id, format), 'rb') as f:
+            return decompress(f.read())
+
+    def _write_document(self, id, data, format=TEXT):
+        """Store a document (encoded bytes, see _encode) in the document store"""
+        fn = self._document_filename(id, format)
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        # write to a temporary file and rename it, so a concurrent writer or reader never sees a partial document
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn), prefix=".")
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, fn)
+
+    def _delete_document(self, id, format=TEXT):
+        os.remove(self._document_filename(id, format))
+
+    def _document_in_use(self, id, format=TEXT):
+        """Check whether a module has the stored document as task, i.e. whether the document file has other links"""
+        return os.stat(self._document_filename(id, format)).st_nlink > 1
+
+    def _release_document(self, id):
+        """Remove the stored documents of a processed task if no other module has them (unless keep_documents)"""
+        if self.keep_documents:
+            return
+        for format in DOCUMENT_FORMATS:
+            try:
+                if self._has_document(id, format) and not self._document_in_use(id, format):
+                    self._delete_document(id, format)
+            except FileNotFoundError:
+                pass  # removed concurrently
+
+    def _link_document(self, module, status, id, format=TEXT):
+        """Give the module a task for a stored document. The task is a hard link, so the text is not copied"""
+        self._check_dirs(module)
+        try:
+            os.link(self._document_filename(id, format), self._filename(module, status, id))
+        except FileExistsError:
+            pass  # assigned concurrently
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.EXDEV, errno.EMLINK):
+                raise
+            # file system does not support (more) hard links, so copy the document instead
+            self._write(module, status, id, self._read_document(id, format))
 
     def result(self, module, id, format=None):
         status = self.status(module, id)
         if status == 'DONE':
-            result = self._read(module, 'DONE', id)
-            if format is not None:
-                try:
-                    result = get_module(module).convert(id, result, format)
-                except:
-                    logging.exception("Error converting document {id} to {format}".format(**locals()))
-                    raise
-            return result
+            if format is None:
+                return self._read(module, 'DONE', id)
+            m = get_module(module)
+            # token table conversions parse the stored bytes directly instead of a decoded copy
+            result = self._read(module, 'DONE', id) if m.columns is None else self._buffer(module, 'DONE', id)
+            try:
+                return m.convert(id, result, format)
+            except:
+                logging.exception("Error converting document {id} to {format}".format(**locals()))
+                raise
         if status == 'ERROR':
             raise Exception(self._read(module, 'ERROR', id))
         raise ValueError("Status of {id} is {status}".format(**locals()))
 
-    def get_task(self, module):
-        path = self._filename(module, 'PENDING')
-        # I can't find a way to get newest file in python without iterating over all of them
-        # So this seems more robust/faster than looping over python with .getctime for every entry
-        cmd = "ls -rt {path} | head -1".format(**locals())
-        fn = subprocess.check_output(cmd, shell=True).decode("utf-8").strip()
-        if not fn: 
-            return None, None  # no files to process
+    def result_file(self, module, id):
+        """
+        Open the result as stored (i.e. without decoding or decompressing) for streaming it to a client
+        :return: a binary file object, use nlpipe.compression.detect_file to check whether it is compressed
+        """
+        status = self.status(module, id)
+        if status != 'DONE':
+            raise ValueError("Status of {id} is {status}".format(**locals()))
+        return self._open(module, 'DONE', id)
+
+    def result_etag(self, module, id, format=None):
+        """
+        Get an ETag for the result in the given format, which changes when the result is replaced (e.g. reprocessed)
+        :return: the ETag, or None if the result is not (or no longer) DONE
+        """
+        if self.status(module, id) != 'DONE':
+            return None
+        try:
+            etag = self._etag(module, 'DONE', id)
+        except FileNotFoundError:
+            return None
+        return etag if format is None else "{etag}-{format}".format(**locals())
+
+    def result_buffer(self, module, id):
+        """
+        Get the result as a bytes-like buffer (see nlpipe.buffers) that can be passed to Module.tokens.
+        Uncompressed results are memory-mapped rather than read into memory.
+        """
+        status = self.status(module, id)
+        if status == 'DONE':
+            return self._buffer(module, 'DONE', id)
+        if status == 'ERROR':
+            raise Exception(self._read(module, 'ERROR', id))
+        raise ValueError("Status of {id} is {status}".format(**locals()))
+
+    def bulk_export(self, module, ids, format="parquet"):
+        from nlpipe.export import export
+        # results are converted one at a time directly from their (memory-mapped) buffers
+        return export(module, ((id, self.result_buffer(module, id)) for id in ids), format=format)
+
+    def get_task(self, module, sizes=None):
+        id = self._claim_task(module, sizes)
+        if id is None:
+            return None, None
+        return id, self._read(module, 'STARTED', id)
+
+    def get_task_file(self, module, sizes=None):
+        """
+        Get a task like get_task, but return the document as stored (see result_file)
+        :return: a pair (id, binary file object), or (None, None) if there are no tasks
+        """
+        id = self._claim_task(module, sizes)
+        if id is None:
+            return None, None
+        return id, self._open(module, 'STARTED', id)
+
+    def _claim_task(self, module, sizes=None):
+        """Move the next pending task to STARTED, returning its id (or None if the queue is empty)"""
+        _check_sizes(sizes)
+        if sizes:
+            # workers for specific sizes only take batch tasks, the size of interactive tasks is not checked
+            return self._claim_batch(module, sizes)
+        with self._lock:
+            self._claims += 1
+            n = self._claims
+        claims = [self._claim_interactive, self._claim_batch]
+        if n % self.batch_every == 0:
+            claims.reverse()  # make sure the batch lane keeps moving
+        for claim in claims:
+            id = claim(module)
+            if id is not None:
+                return id
+        return None
+
+    def _claim_interactive(self, module):
+        return self._claim_lane(module, "interactive")
+
+    def _claim_batch(self, module, sizes=None):
+        """
+        Claim a batch task from the submitter that has been served least (relative to its weight),
+        or the oldest pending task if no submitter has tasks (and the sizes are not restricted)
+        """
+        lanes = {}  # submitter lane : [size lanes]
+        for lane in self._lanes(module):
+            if lane.startswith(SUBMITTER):
+                submitter, _, size = lane.partition(SIZE)
+                if not sizes or size in sizes:
+                    lanes.setdefault(submitter, []).append(lane)
+        with self._lock:
+            served = {lane: n for (lane, n) in self._served.get(module, {}).items() if lane in lanes}
+            # a submitter that (re)appears starts at the level of the current submitters, so it doesn't catch up
+            level = min(served.values(), default=0)
+            for lane in lanes:
+                served.setdefault(lane, level)
+            self._served[module] = served
+            order = sorted(lanes, key=lambda lane: (served[lane], lane))
+        for lane in order:
+            id = self._claim_smallest(module, lanes[lane])
+            with self._lock:
+                if id is not None:
+                    served[lane] = served.get(lane, level) + 1 / self._weight(lane[len(SUBMITTER):])
+                    return id
+                served.pop(lane, None)
+        return None if sizes else self._claim_oldest(module)
+
+    def _weight(self, submitter):
+        default = self.reprocess_weight if submitter == REPROCESS_SUBMITTER else 1
+        return self.submitter_weights.get(submitter, default)
+
+    def _claim_smallest(self, module, lanes):
+        """Claim a task from the lane with the smallest documents, unless larger tasks have waited long enough"""
+        if len(lanes) > 1:
+            ranks = {name: i for (i, (name, _bound)) in enumerate(SIZE_CLASSES)}
+
+            def waited(lane):
+                id = self._oldest(module, LANE + lane)
+                try:
+                    age = 0 if id is None else self._age(module, LANE + lane, id)
+                except FileNotFoundError:
+                    age = 0  # claimed concurrently
+                return ranks.get(lane.partition(SIZE)[2], 0) * self.size_aging - age
+
+            lanes = sorted(lanes, key=waited)
+        for lane in lanes:
+            id = self._claim_lane(module, lane)
+            if id is not None:
+                return id
+        return None
+
+    def _claim_lane(self, module, lane):
+        """Claim the oldest task in the given lane"""
+        while True:
+            id = self._oldest(module, LANE + lane)
+            if id is None:
+                return None
+            try:
+                self._move(module, id, 'PENDING', 'STARTED')
+            except FileNotFoundError:
+                self._unmark(module, id)
+                continue  # already claimed by another worker
+            self._claimed(module, id, self._unmark(module, id))
+            return id
+
+    def _claim_oldest(self, module):
+        """Claim the oldest pending task (e.g. queued before lanes were used)"""
+        fn = self._oldest(module, 'PENDING')
+        if fn is None:
+            return None  # no files to process
         try:
             self._move(module, fn, 'PENDING', 'STARTED')
         except FileNotFoundError:
             # file was removed between choosing it and now, so try again
-            return self.get_task(module)
-        return fn, self._read(module, 'STARTED', fn)
+            return self._claim_oldest(module)
+        self._claimed(module, fn, self._unmark(module, fn))
+        return fn
 
-    def store_result(self, module, id, result):
-        status = self.status(module, id)
+    def _unmark(self, module, id):
+        """Remove a claimed task from all lanes, returning the submitter of the task (or None if it was not marked)"""
+        submitter = None
+        for lane in self._lanes(module):
+            try:
+                self._delete(module, LANE + lane, id)
+            except FileNotFoundError:
+                continue
+            if lane.startswith(SUBMITTER):
+                submitter = lane[len(SUBMITTER):].partition(SIZE)[0]
+        return submitter
+
+    def _claimed(self, module, id, submitter):
+        self._write(module, 'CLAIMED', id, submitter or "")
+        if CHUNK not in str(id):
+            self._publish(module, id, 'STARTED', submitter)
+
+    def _claimant(self, module, id):
+        """Get the submitter of a started or failed task from its CLAIMED marker, or None if it is not known"""
+        try:
+            return self._read(module, 'CLAIMED', id) or None
+        except FileNotFoundError:
+            return None
+
+    def _unclaim(self, module, id):
+        """Remove the CLAIMED marker of a task that is no longer started (or failed)"""
+        try:
+            self._delete(module, 'CLAIMED', id)
+        except FileNotFoundError:
+            pass
+
+    def store_result(self, module, id, result, fingerprint=None):
+        status = self._task_status(module, id)
         if status not in ('STARTED', 'DONE', 'ERROR'):
             raise ValueError("Cannot store result for task {id} with status {status}".format(**locals()))
         self._write(module, 'DONE', id, result)
+        self._set_version(module, id, fingerprint)
+        if fingerprint is not None and fingerprint != self._reported_fingerprint(module):
+            self._write(module, 'FINGERPRINT', LATEST, fingerprint)
         if status in ('STARTED', 'ERROR'):
             self._delete(module, status, id)
+            self._unclaim(module, id)
+        if status == 'ERROR':
+            self._delete_error_document(module, id)
+        if CHUNK in str(id):
+            self._chunk_done(module, id, fingerprint)
+        else:
+            self._release_document(id)
+            self._completed(module, id, 'DONE')
+            self._next_stages(module, id)
 
     def store_error(self, module, id, result):
-        status = self.status(module, id)
+        status = self._task_status(module, id)
         if status not in ('STARTED', 'DONE', 'ERROR'):
             raise ValueError("Cannot store error for task {id} with status {status}".format(**locals()))
+        if status == 'STARTED' and CHUNK in str(id) and self._chunk_failed(module, id, result):
+            return
+        if status == 'STARTED' and self._exists(module, 'DONE', id):
+            logging.warning("Reprocessing {module}/{id} failed, keeping the previous result: {result}"
+                            .format(**locals()))
+            self._delete(module, 'STARTED', id)
+            self._unclaim(module, id)
+            self._release_document(id)
+            self._publish(module, id, 'DONE')
+            return
         self._write(module, 'ERROR', id, result)
-        if status in ('STARTED', 'DONE'):
+        self._completed(module, id, 'ERROR')
+        if status == 'STARTED':
+            # keep the input document (and the CLAIMED marker with its submitter) so the task can be requeued
+            self._move(module, id, 'STARTED', 'ERROR_DOCUMENT')
+        elif status == 'DONE':
             self._delete(module, status, id)
+            self._set_version(module, id, None)
+
+    def _changes_filename(self, module, status='DONE'):
+        """Get the log of completed (DONE or ERROR) tasks (see changes), or of the other status changes"""
+        return os.path.join(self.result_dir, module, "changes.log" if status in ('DONE', 'ERROR') else "events.log")
+
+    def _completed(self, module, id, status, submitter=None):
+        """Append the completed task to the change log of the module, see changes and _publish"""
+        self._publish(module, id, status, submitter)
+
+    def _publish(self, module, id, status, submitter=None):
+        """
+        Append a status change to the log of the module, so it is seen by the events of all processes.
+        The submitter of a task is only known to the client that queued or claimed it, so it is remembered while
+        the task is started
+        """
+        if status in ('DONE', 'ERROR'):
+            submitter = self._submitters.pop((module, id), submitter)
+        elif status == 'STARTED':
+            self._submitters[module, id] = submitter
+        else:
+            self._submitters.pop((module, id), None)
+        line = "{id}\t{status}\t{}\n".format(submitter or "", **locals()).encode("utf-8")
+        fn = self._changes_filename(module, status)
+        try:
+            f = open(fn, 'ab')
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            f = open(fn, 'ab')
+        with f:
+            f.write(line)  # a single (small) write in append mode, so lines of concurrent writers are not mixed
+
+    def events(self, modules=None, submitters=None, timeout=None):
+        """
+        Iterate over the status changes of all processes by following the logs of the modules, see Client.events
+        :param timeout: If given, yield None if there was no event for this many seconds (e.g. to send a keepalive)
+        """
+        def logs():
+            names = modules or [name for name in os.listdir(self.result_dir) if not name.startswith(("_", "."))]
+            return [((module, status), self._changes_filename(module, status))
+                    for module in names for status in ('PENDING', 'DONE')]  # per module, events before completions
+        return self._events(follow(logs, timeout=timeout), submitters)
+
+    @staticmethod
+    def _events(lines, submitters):
+        for item in lines:
+            if item is None:
+                yield None
+                continue
+            (module, _log), line = item
+            id, status, submitter = _parse_change(line)
+            if not submitters or submitter in submitters:
+                yield dict(id=id, module=module, status=status, submitter=submitter)
+
+    def changes(self, module, since=0, limit=1000, results=False):
+        changes = []
+        try:
+            f = open(self._changes_filename(module), 'rb')
+        except FileNotFoundError:
+            return changes
+        with f:
+            f.seek(since)
+            cursor = since
+            for line in f:
+                if len(changes) >= limit or not line.endswith(b"\n"):
+                    break  # the last line can be incomplete while it is being written
+                cursor += len(line)
+                id, status, _submitter = _parse_change(line)
+                change = dict(id=id, status=status, cursor=cursor)
+                if results and status == 'DONE':
+                    try:
+                        change['result'] = self._read(module, 'DONE', id)
+                    except FileNotFoundError:
+                        change['status'] = self.status(module, id)  # the result was removed since
+                changes.append(change)
+        return changes
+
+    def _set_version(self, module, id, fingerprint):
+        """Store the fingerprint of the module that produced the result, or remove it if it is None"""
+        if fingerprint is not None:
+            self._write(module, 'VERSION', id, fingerprint)
+            return
+        try:
+            self._delete(module, 'VERSION', id)
+        except FileNotFoundError:
+            pass
+
+    def _version(self, module, id):
+        """Get the fingerprint of the module that produced the result, or None if it is not known"""
+        try:
+            return self._read(module, 'VERSION', id)
+        except FileNotFoundError:
+            return None
+
+    def _current_fingerprint(self, module):
+        """
+        Get the fingerprint of the current module version: the one most recently reported by a worker, as the server
+        may not have the environment of the workers (e.g. $ALPINO_VERSION), or else that of the server's module
+        """
+        return self._reported_fingerprint(module) or get_module(module).fingerprint()
+
+    def _reported_fingerprint(self, module):
+        try:
+            return self._read(module, 'FINGERPRINT', LATEST)
+        except FileNotFoundError:
+            return None
+
+    def _is_stale(self, module, id, fingerprint):
+        """Check whether the result was produced by another module version (results without fingerprint are not)"""
+        version = self._version(module, id)
+        return version is not None and version != fingerprint
+
+    def reprocess(self, module, ids=None):
+        fingerprint = self._current_fingerprint(module)
+        stale = []  # (id, format of the stored document) pairs
+        for id in self._list(module, 'DONE') if ids is None else ids:
+            if self._task_status(module, id) != 'DONE' or not self._is_stale(module, id, fingerprint):
+                continue  # not stale, or being reprocessed already
+            stale.append((id, self._stored_format(module, id)))
+        missing = [id for (id, format) in stale if format is None]
+        if missing:
+            raise ValueError("Cannot reprocess {n} stale results of {module}, their input documents are not stored "
+                             "(see FSClient.keep_documents): {examples}"
+                             .format(n=len(missing), examples=", ".join(map(str, missing[:10])), **locals()))
+        requeued = []
+        for id, format in stale:
+            # the old result is kept (and reported as DONE) until the new result is stored, see status
+            self._link_document(module, 'PENDING', id, format)
+            self._mark_batch(module, id, REPROCESS_SUBMITTER)
+            requeued.append(id)
+        logging.info("Queued {} stale results of {module} for reprocessing".format(len(requeued), **locals()))
+        return requeued
+
+    def _delete_error_document(self, module, id):
+        try:
+            self._delete(module, 'ERROR_DOCUMENT', id)
+        except FileNotFoundError:
+            pass
+
+    def requeue(self, module, status="ERROR", ids=None, older_than=None, message=None):
+        statuses = [status] if isinstance(status, str) else status
+        try:
+            pattern = None if message is None else re.compile(message)
+        except re.error as e:
+            raise ValueError("Invalid message pattern {message!r}: {e}".format(**locals()))
+        requeued = []
+        for status in statuses:
+            if status not in ('ERROR', 'STARTED'):
+                raise ValueError("Cannot requeue tasks with status {status}".format(**locals()))
+            todo = self._list(module, status) if ids is None else [id for id in ids if self._exists(module, status, id)]
+            for id in todo:
+                try:
+                    if older_than is not None and self._age(module, status, id) < older_than:
+                        continue
+                    if pattern is not None and not (status == 'ERROR' and
+                                                    pattern.search(self._read(module, 'ERROR', id))):
+                        continue
+                    if self._requeue_task(module, status, id):
+                        requeued.append(id)
+                except FileNotFoundError:
+                    pass  # task was finished or requeued concurrently
+        logging.info("Requeued {} tasks for {module}".format(len(requeued), **locals()))
+        return requeued
+
+    def _requeue_task(self, module, status, id):
+        # requeued tasks return to the lane of their submitter, the marker is removed before a worker can claim them
+        submitter = self._claimant(module, id)
+        if status == 'STARTED':
+            self._unclaim(module, id)
+            self._move(module, id, 'STARTED', 'PENDING')
+            self._mark_batch(module, id, submitter)
+            return True
+        if self._exists(module, 'ERROR_DOCUMENT', id):
+            self._unclaim(module, id)
+            self._move(module, id, 'ERROR_DOCUMENT', 'PENDING')
+        else:
+            format = self._stored_format(module, id)
+            if format is None:
+                logging.warning("Cannot requeue {module}/{id}: the input document is not stored".format(**locals()))
+                return False
+            self._unclaim(module, id)
+            self._link_document(module, 'PENDING', id, format)
+        self._mark_batch(module, id, submitter)
+        self._delete(module, 'ERROR', id)
+        return True
 
     def statistics(self, module):
-        """Get number of docs for each status for this module"""
+        """
+        Get number of docs for each status for this module,
+        followed by the number of pending tasks per submitter as ('PENDING:<submitter>', n),
+        per size class as ('PENDING@<size class>', n),
+        and the number of documents for which the result of an identical document was (not) reused since the
+        client was started as ('DEDUP:hits', n) and ('DEDUP:misses', n)
+        """
         for status in STATUS:
-            path = self._filename(module, status)
-            cmd = "ls {path} | wc -l".format(**locals())
-            n = int(subprocess.check_output(cmd, shell=True).decode("utf-8"))
-            yield status, n
+            yield status, self._count(module, status)
+        submitters, sizes = {}, {}
+        for lane in self._lanes(module):
+            if lane.startswith(SUBMITTER):
+                n = self._count(module, LANE + lane)
+                submitter, _, size = lane[len(SUBMITTER):].partition(SIZE)
+                submitters[submitter] = submitters.get(submitter, 0) + n
+                if size:
+                    sizes[size] = sizes.get(size, 0) + n
+        for submitter, n in sorted(submitters.items()):
+            if n:
+                yield "PENDING:" + submitter, n
+        for size, _bound in SIZE_CLASSES:
+            if sizes.get(size):
+                yield "PENDING" + SIZE + size, sizes[size]
+        if module in self._dedup:
+            hits, misses = self._dedup[module]
+            yield "DEDUP:hits", hits
+            yield "DEDUP:misses", misses
+
+class ServerError(Exception):
+    """An error response (5xx) or connection error that may be transient, so the request can be retried"""
+    pass
+
 
 class HTTPClient(Client):
     """
     NLPipe client that connects to the REST server
     """
 
-    def __init__(self, server="http://localhost:5000"):
+    # The bulk methods split their ids or documents into batches of at most batch_size items and (for documents)
+    # max_batch_bytes of json, and send up to parallel batches at a time
+    batch_size = 1000
+    max_batch_bytes = 8 * 1024 * 1024
+    parallel = 4
+    # Failed batches (server errors or connection problems) are retried this many times, waiting
+    # retry_wait, 2 * retry_wait, ... seconds in between
+    retries = 3
+    retry_wait = 1
+
+    def __init__(self, server="http://localhost:5000", compression="gzip", progress=None, cache=None):
+        """
+        :param server: The url of the NLPipe server
+        :param compression: Codec ('gzip' or 'zstd') to compress request bodies larger than
+                            nlpipe.compression.HTTP_MIN_SIZE with, or None to disable
+        :param progress: Function that is called as progress(done, total) after each batch of a bulk method
+        :param cache: A nlpipe.cache.ResultCache to keep downloaded results in, so they are only downloaded again
+                      if they changed on the server
+        """
         self.server = server
+        self.compression = compression
+        self.progress = progress
+        self.cache = cache
 
-    def status(self, module: str, id: str) -> str:
+    def _body(self, data: bytes, headers=None):
+        """Compress the request body if it is large enough, returning a (data, headers) pair"""
+        headers = dict(headers or {})
+        if self.compression is not None and len(data) >= HTTP_MIN_SIZE:
+            data = compress(data, self.compression)
+            headers['Content-Encoding'] = self.compression
+        return data, headers
+
+    def _json_body(self, body):
+        return self._body(json.dumps(body).encode("utf-8"), {'Content-Type': 'application/json'})
+
+    def status(self, module: str, id: str, stale=False) -> str:
         url = "{self.server}/api/modules/{module}/{id}".format(**locals())
+        if stale:
+            url += "?stale=1"
         res = requests.head(url)
         if 'Status' in res.headers:
             return res.headers['Status']
         raise Exception("Cannot determine status for {module}/{id}; return code: {res.status_code}"
                         .format(**locals()))
 
-    def process(self, module, doc, id=None):
+    def process(self, module, doc, id=None, priority=None, submitter=None):
         url = "{self.server}/api/modules/{module}/".format(**locals())
-        if id is not None:
-            url = "{url}?id={id}".format(**locals())
-        res = requests.post(url, data=doc.encode("utf-8"))
+        query = {k: v for (k, v) in [("id", id), ("priority", priority), ("submitter", submitter)] if v is not None}
+        if query:
+            url = "{url}?{query}".format(url=url, query=urlencode(query))
+        data, headers = self._body(_bytes(doc))
+        res = requests.post(url, data=data, headers=headers)
         if res.status_code != 202:
             raise Exception("Error on processing doc with {module}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
@@ -309,14 +1449,23 @@ class HTTPClient(Client):
         url = "{self.server}/api/modules/{module}/{id}".format(**locals())
         if format is not None:
             url = "{url}?format={format}".format(**locals())
-        res = requests.get(url)
+        key = (self.server, module, id, format)
+        cached = self.cache.get(key) if self.cache is not None else None
+        headers = {'If-None-Match': '"{}"'.format(cached[0])} if cached else None
+        res = requests.get(url, headers=headers)
+        if res.status_code == 304 and cached:
+            return cached[1]
         if res.status_code != 200:
             raise Exception("Error on getting result for {module}/{id}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
+        if self.cache is not None and 'ETag' in res.headers:
+            self.cache.put(key, _unquote_etag(res.headers['ETag']), res.text)
         return res.text
 
-    def get_task(self, module):
+    def get_task(self, module, sizes=None):
         url = "{self.server}/api/modules/{module}/".format(**locals())
+        if sizes:
+            url += "?" + urlencode({"sizes": ",".join(sizes)})
         res = requests.get(url)
 
         if res.status_code == 404:
@@ -326,10 +1475,10 @@ class HTTPClient(Client):
                             .format(**locals()))
         return res.headers['ID'], res.text
 
-    def store_result(self, module, id, result):
+    def store_result(self, module, id, result, fingerprint=None):
         url = "{self.server}/api/modules/{module}/{id}".format(**locals())
-        data = result.encode("utf-8")
-        res = requests.put(url, data=data)
+        data, headers = self._body(_bytes(result), {'Fingerprint': fingerprint} if fingerprint is not None else None)
+        res = requests.put(url, data=data, headers=headers)
 
         if res.status_code != 204:
             raise Exception("Error on storing result for {module}:{id}; return code: {res.status_code}:\n{res.text}"
@@ -338,42 +1487,244 @@ class HTTPClient(Client):
 
     def store_error(self, module, id, result):
         url = "{self.server}/api/modules/{module}/{id}".format(**locals())
-        data = result.encode("utf-8")
         from nlpipe.restserver import ERROR_MIME
-        headers = {'Content-type': ERROR_MIME}
+        data, headers = self._body(_bytes(result), {'Content-type': ERROR_MIME})
         res = requests.put(url, data=data, headers=headers)
         if res.status_code != 204:
             raise Exception("Error on storing error for {module}:{id}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
 
-    def bulk_status(self, module, ids):
-        url = "{self.server}/api/modules/{module}/bulk/status".format(**locals())
-        res = requests.post(url, json=ids)
+    def _batches(self, items, sizes=None):
+        """Split the items into batches of at most batch_size items and max_batch_bytes (total of sizes, if given)"""
+        batches, batch, total = [], [], 0
+        for i, item in enumerate(items):
+            size = sizes[i] if sizes else 0
+            if batch and (len(batch) >= self.batch_size or total + size > self.max_batch_bytes):
+                batches.append(batch)
+                batch, total = [], 0
+            batch.append(item)
+            total += size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _post_batch(self, url, body, action):
+        try:
+            data, headers = self._json_body(body)
+            res = requests.post(url, data=data, headers=headers)
+        except requests.ConnectionError as e:
+            raise ServerError("Error on {action}: {e}".format(**locals()))
         if res.status_code != 200:
-            raise Exception("Error on getting bulk status for {module}; return code: {res.status_code}:\n{res.text}"
-                            .format(**locals()))
+            error = ServerError if res.status_code >= 500 else Exception
+            raise error("Error on {action}; return code: {res.status_code}:\n{res.text}".format(**locals()))
         return res.json()
 
+    def _retry_wait(self, error, attempt, retries):
+        """Return the seconds to wait before retrying a batch after the error, or None if it should not be retried"""
+        if attempt == retries or not isinstance(error, ServerError):
+            return None
+        wait = self.retry_wait * 2 ** attempt
+        logging.warning("{error}, retrying in {wait} seconds".format(**locals()))
+        return wait
+
+    def _bulk(self, url, batches, action, retries=None):
+        """
+        POST the batches (in parallel), retrying on server errors, and return the responses in order
+        :param retries: Number of retries (default: self.retries), use 0 for requests that are not idempotent
+        """
+        failed = threading.Event()
+        retries = self.retries if retries is None else retries
+
+        def post(batch):
+            for attempt in range(retries + 1):
+                if failed.is_set():
+                    return None  # another batch failed, so the results will not be used
+                try:
+                    return self._post_batch(url, batch, action)
+                except Exception as e:
+                    wait = self._retry_wait(e, attempt, retries)
+                    if wait is None:
+                        failed.set()
+                        raise
+                    time.sleep(wait)
+        total = sum(len(batch) for batch in batches)
+        done = 0
+        results = []
+        with ThreadPoolExecutor(self.parallel) as pool:
+            for batch, result in zip(batches, pool.map(post, batches)):
+                results.append(result)
+                done += len(batch)
+                logging.debug("{action}: {done} / {total}".format(**locals()))
+                if self.progress is not None:
+                    self.progress(done, total)
+        return results
+
+    def bulk_status(self, module, ids, stale=False):
+        url = "{self.server}/api/modules/{module}/bulk/status".format(**locals())
+        if stale:
+            url += "?stale=1"
+        action = "getting bulk status for {module}".format(**locals())
+        results = self._bulk(url, self._batches(list(ids)), action)
+        return {id: status for result in results for (id, status) in result.items()}
+
     def bulk_result(self, module, ids, format=None):
+        ids = list(ids)
+        if self.cache is not None:
+            return self._cached_bulk_result(module, ids, format)
+        return self._bulk_result(module, ids, format)
+
+    def _bulk_result(self, module, ids, format=None):
         url = "{self.server}/api/modules/{module}/bulk/result".format(**locals())
         if format is not None:
             url = "{url}?format={format}".format(**locals())
-        res = requests.post(url, json=ids)
+        action = "getting bulk results for {module}".format(**locals())
+        results = self._bulk(url, self._batches(ids), action)
+        return {id: r for result in results for (id, r) in result.items()}
+
+    def _cached_bulk_result(self, module, ids, format=None):
+        """Get the results that are not cached (or changed since) with bulk_result, and the others from the cache"""
+        url = "{self.server}/api/modules/{module}/bulk/etag".format(**locals())
+        if format is not None:
+            url = "{url}?format={format}".format(**locals())
+        action = "getting bulk etags for {module}".format(**locals())
+        etags = {id: etag for result in self._bulk(url, self._batches(ids), action) for (id, etag) in result.items()}
+        results, download = {}, []
+        for id in ids:
+            cached = self.cache.get((self.server, module, id, format)) if id in etags else None
+            if cached and cached[0] == etags[id]:
+                results[id] = cached[1]
+            else:
+                download.append(id)
+        if download:
+            downloaded = self._bulk_result(module, download, format=format)
+            for id, result in downloaded.items():
+                if id in etags:
+                    self.cache.put((self.server, module, id, format), etags[id], result)
+            results.update(downloaded)
+        return {id: results[id] for id in ids if id in results}
+
+    def bulk_export(self, module, ids, format="parquet"):
+        url = "{self.server}/api/modules/{module}/bulk/export?format={format}".format(**locals())
+        data, headers = self._json_body(ids)
+        res = requests.post(url, data=data, headers=headers)
         if res.status_code != 200:
-            raise Exception("Error on getting bulk results for {module}; return code: {res.status_code}:\n{res.text}"
+            raise Exception("Error on bulk export for {module}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
-        return res.json()
+        return res.content
 
-    def bulk_process(self, module, docs, ids=None, reset_error=False, reset_pending=False):
+    def bulk_process(self, module, docs, ids=None, reset_error=False, reset_pending=False, priority=None,
+                     submitter=None):
         url = ("{self.server}/api/modules/{module}/bulk/process?reset_error={reset_error}&reset_pending={reset_pending}"\
                .format(**locals()))
-        body = list(docs) if ids is None else dict(zip(ids, docs))
-        res = requests.post(url, json=body)
+        url += _lane_query(priority, submitter)
+        action = "bulk process for {module}".format(**locals())
+        # a batch that failed may still have been processed, and resetting its tasks again could reset tasks that
+        # workers have started in the meantime, so batches that reset tasks are not retried
+        retries = 0 if (reset_error or reset_pending) else None
+        results = self._bulk(url, self._document_batches(docs, ids), action, retries=retries)
+        return [id for result in results for id in result]
+
+    def _document_batches(self, docs, ids=None):
+        """Split the documents (and ids) into batches of request bodies for bulk_process"""
+        docs = list(docs)
+        batches = self._batches(docs if ids is None else list(zip(ids, docs)),
+                                sizes=[len(json.dumps(doc)) for doc in docs])
+        if ids is not None:
+            batches = [dict(batch) for batch in batches]
+        return batches
+
+    def requeue(self, module, status="ERROR", ids=None, older_than=None, message=None):
+        url = "{self.server}/api/modules/{module}/requeue".format(**locals())
+        query = [("status", s) for s in ([status] if isinstance(status, str) else status)]
+        if older_than is not None:
+            query.append(("older_than", older_than))
+        if message is not None:
+            query.append(("message", message))
+        url = "{url}?{query}".format(url=url, query=urlencode(query))
+        data, headers = self._json_body(list(ids)) if ids is not None else (None, None)
+        res = requests.post(url, data=data, headers=headers)
+        if res.status_code != 200:
+            raise Exception("Error on requeue for {module}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+        return res.json()
+
+    def changes(self, module, since=0, limit=1000, results=False):
+        url = "{self.server}/api/modules/{module}/changes".format(**locals())
+        query = dict(since=since, limit=limit)
+        if results:
+            query['results'] = 1
+        res = requests.get("{url}?{query}".format(url=url, query=urlencode(query)))
+        if res.status_code != 200:
+            raise Exception("Error getting changes for {module}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+        return res.json()['changes']
+
+    def events(self, modules=None, submitters=None):
+        url = "{self.server}/api/events".format(**locals())
+        query = [("module", m) for m in modules or []] + [("submitter", s) for s in submitters or []]
+        if query:
+            url = "{url}?{query}".format(url=url, query=urlencode(query))
+        res = requests.get(url, stream=True)
+        if res.status_code != 200:
+            raise Exception("Error getting events; return code: {res.status_code}:\n{res.text}".format(**locals()))
+        with res:
+            for line in res.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    yield json.loads(line[len("data:"):])
+
+    def reprocess(self, module, ids=None):
+        url = "{self.server}/api/modules/{module}/reprocess".format(**locals())
+        data, headers = self._json_body(list(ids)) if ids is not None else (None, None)
+        res = requests.post(url, data=data, headers=headers)
+        if res.status_code != 200:
+            raise Exception("Error on reprocess for {module}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+        return res.json()
+
+    def enqueue(self, module, ids, reset_error=False, reset_pending=False, priority=None, submitter=None):
+        url = ("{self.server}/api/modules/{module}/bulk/enqueue?reset_error={reset_error}&reset_pending={reset_pending}"
+               .format(**locals()))
+        url += _lane_query(priority, submitter)
+        data, headers = self._json_body(list(ids))
+        res = requests.post(url, data=data, headers=headers)
         if res.status_code != 200:
-            raise Exception("Error on bulk processfor {module}; return code: {res.status_code}:\n{res.text}"
+            raise Exception("Error on enqueue for {module}; return code: {res.status_code}:\n{res.text}"
                             .format(**locals()))
         return res.json()
 
+    def process_pipeline(self, pipeline, doc, id=None, priority=None, submitter=None):
+        url = "{self.server}/api/pipelines/{pipeline}/".format(**locals())
+        query = {k: v for (k, v) in [("id", id), ("priority", priority), ("submitter", submitter)] if v is not None}
+        if query:
+            url = "{url}?{query}".format(url=url, query=urlencode(query))
+        data, headers = self._body(_bytes(doc))
+        res = requests.post(url, data=data, headers=headers)
+        if res.status_code != 202:
+            raise Exception("Error processing document with pipeline {pipeline}; return code: {res.status_code}:\n"
+                            "{res.text}".format(**locals()))
+        return res.headers['ID']
+
+    def pipeline_status(self, pipeline, id):
+        url = "{self.server}/api/pipelines/{pipeline}/{id}".format(**locals())
+        res = requests.get(url)
+        if res.status_code != 200:
+            raise Exception("Error getting pipeline status of {id}; return code: {res.status_code}:\n{res.text}"
+                            .format(**locals()))
+        return res.json()
+
+
+def _unquote_etag(etag):
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def _lane_query(priority, submitter):
+    """Additional query string parameters for the priority and submitter (if given)"""
+    query = [(k, v) for (k, v) in [("priority", priority), ("submitter", submitter)] if v is not None]
+    return "&" + urlencode(query) if query else ""
+
+
 def get_client(servername):
     if servername.startswith("http:") or servername.startswith("https:"):
         logging.getLogger('requests').setLevel(logging.WARNING)
@@ -397,17 +1748,33 @@ if __name__ == '__main__':
 
     actions = {name: action_parser.add_parser(name) 
                for name in ('status', 'result', 'check', 'process', 'process_inline',
-                            'bulk_status', 'bulk_result', 'store_result', 'store_error')}
+                            'bulk_status', 'bulk_result', 'bulk_export', 'enqueue', 'requeue', 'reprocess',
+                            'get_task', 'store_result', 'store_error')}
     for action in 'status', 'result', 'store_result', 'store_error':
         actions[action].add_argument('id', help="Task ID")
 
-    for action in 'bulk_status', 'bulk_result':
+    for action in 'bulk_status', 'bulk_result', 'bulk_export', 'enqueue':
         actions[action].add_argument('ids', nargs="+", help="Task IDs")
+    actions['bulk_export'].add_argument("--format", help="Export format: parquet (default) or arrow")
+    actions['requeue'].add_argument("--status", nargs="+", choices=["ERROR", "STARTED"],
+                                    help="Requeue failed (ERROR, default) and/or stalled (STARTED) tasks")
+    actions['requeue'].add_argument("--ids", nargs="+", help="Only requeue these task IDs")
+    actions['requeue'].add_argument("--older-than", type=float,
+                                    help="Only requeue tasks that have had their status for this many seconds")
+    actions['requeue'].add_argument("--message", help="Only requeue errors matching this regular expression")
+    actions['reprocess'].add_argument("--ids", nargs="+", help="Only reprocess these task IDs")
+    actions['bulk_status'].add_argument("--stale", action="store_true",
+                                        help="Report results of an older module version as STALE")
     for action in 'result', 'process_inline', 'bulk_result':
         actions[action].add_argument("--format", help="Optional output format to retrieve")
     for action in 'process', 'process_inline':
         actions[action].add_argument('doc', help="Document to process (use - to read from stdin")
         actions[action].add_argument('id', nargs="?", help="Optional explicit ID")
+        actions[action].add_argument('--priority', choices=PRIORITIES,
+                                     help="Task priority (default: interactive for process_inline, otherwise batch)")
+        actions[action].add_argument('--submitter', help="Submitter or project key for fair scheduling")
+    actions['get_task'].add_argument('--sizes', nargs="+", choices=[name for (name, _bound) in SIZE_CLASSES],
+                                     help="Only take batch tasks of these size classes")
     for action in ('store_result', 'store_error'):
         actions[action].add_argument('result', help="Document to store (use - to read from stdin")
     
@@ -432,6 +1799,8 @@ if __name__ == '__main__':
             print(doc)
     elif action in ("store_result", "store_error"):
         pass
+    elif action == "bulk_export":
+        sys.stdout.buffer.write(result)
     else:
         if result is not None:
             print(result)
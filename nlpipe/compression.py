@@ -0,0 +1,114 @@
+"""
+Compression of stored documents and results
+
+Compressed data is recognized by its magic header, so compressed and uncompressed files can be mixed.
+gzip is always available, zstd requires the zstandard package (pip install zstandard).
+"""
+import gzip
+import os
+import zlib
+from typing import BinaryIO, Iterator, Mapping, Optional, Union
+
+CODECS = ("gzip", "zstd")
+
+# Only compress HTTP bodies larger than this (bytes), smaller bodies are not worth the cpu time
+HTTP_MIN_SIZE = 4096
+# Bytes read from a file at a time by compress_stream
+STREAM_CHUNK_SIZE = 256 * 1024
+
+_MAGIC = [(b"\x1f\x8b", "gzip"),
+          (b"\x28\xb5\x2f\xfd", "zstd")]
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd compression requires zstandard, use e.g. pip install zstandard")
+    return zstandard
+
+
+def detect(data: bytes) -> Optional[str]:
+    """Return the codec the data was compressed with, or None if it is not compressed"""
+    for magic, codec in _MAGIC:
+        if data[:len(magic)] == magic:
+            return codec
+    return None
+
+
+def detect_file(f) -> Optional[str]:
+    """Detect the compression codec of a (seekable) binary file without changing its position"""
+    pos = f.tell()
+    codec = detect(f.read(4))
+    f.seek(pos)
+    return codec
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if codec == "zstd":
+        return _zstd().ZstdCompressor().compress(data)
+    raise ValueError("Unknown compression codec: {codec}, use one of {CODECS}".format(codec=codec, CODECS=CODECS))
+
+
+def compress_stream(f: BinaryIO, codec: str) -> Iterator[bytes]:
+    """
+    Compress a binary file a chunk at a time, e.g. to stream a large file as compressed response body without
+    reading it into memory as a whole. The file is closed when done
+    """
+    if codec == "gzip":
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # 16 + MAX_WBITS: gzip header
+    elif codec == "zstd":
+        compressor = _zstd().ZstdCompressor().compressobj()
+    else:
+        raise ValueError("Unknown compression codec: {codec}, use one of {CODECS}".format(codec=codec, CODECS=CODECS))
+    with f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+    yield compressor.flush()
+
+
+def zstd_available() -> bool:
+    try:
+        import zstandard
+    except ImportError:
+        return False
+    return True
+
+
+def decompress(data: bytes) -> bytes:
+    """Decompress the data if it is compressed, otherwise return it unchanged"""
+    codec = detect(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        # use a stream reader as the frame might not contain the content size
+        return _zstd().ZstdDecompressor().stream_reader(data).read()
+    return data
+
+
+def parse_compression(spec: Optional[str]) -> Union[None, str, Mapping[str, str]]:
+    """
+    Parse a compression specification: either a codec name (used for all modules)
+    or a comma separated list of module=codec pairs, e.g. 'corenlp_parse=zstd,alpinonerc=gzip'
+    """
+    if not spec:
+        return None
+    if "=" not in spec:
+        return spec
+    return dict(part.split("=", 1) for part in spec.split(","))
+
+
+def get_codec(compression: Union[None, str, Mapping[str, str]], module: str) -> Optional[str]:
+    """Get the codec to use for the given module from a compression setting (see parse_compression)"""
+    if compression is None or isinstance(compression, str):
+        return compression
+    return compression.get(module)
+
+
+def default_compression() -> Union[None, str, Mapping[str, str]]:
+    """Compression setting from the NLPIPE_COMPRESSION environment variable"""
+    return parse_compression(os.environ.get("NLPIPE_COMPRESSION"))
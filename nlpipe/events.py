@@ -0,0 +1,60 @@
+"""
+Following the task status changes of all processes, e.g. for streaming them to clients as server-sent events
+
+Every status change is appended to a log file of its module (see FSClient._publish), so following these logs from
+their current end sees the changes made by any process: the server processes and workers with direct file system
+access alike. The position in each log is a byte offset, like the cursor of the change feed (see Client.changes)
+"""
+import os
+import time
+from typing import Callable, Hashable, Iterable, Iterator, Optional, Tuple
+
+# Seconds between checks for new lines
+POLL = 0.2
+
+
+def _size(filename):
+    try:
+        return os.stat(filename).st_size
+    except OSError:  # not created (yet)
+        return 0
+
+
+def follow(files: Callable[[], Iterable[Tuple[Hashable, str]]], timeout=None,
+           poll=POLL) -> Iterator[Optional[Tuple[Hashable, bytes]]]:
+    """
+    Iterate over the lines appended to the given files from now on (i.e. after calling follow, not after starting
+    to iterate), as (key, line) pairs in the order of the lines in each file
+    :param files: Function that gives the (key, filename) pairs to follow. It is called before each check, so files
+                  that are added later are followed (from their start) as well. Missing files are skipped
+    :param timeout: If given, yield None if there was no new line for this many seconds (e.g. to send a keepalive)
+    """
+    positions = {key: _size(filename) for (key, filename) in files()}
+    return _follow(files, positions, timeout, poll)
+
+
+def _follow(files, positions, timeout, poll):
+    idle = 0
+    while True:
+        found = False
+        for key, filename in files():
+            position = positions.setdefault(key, 0)
+            if _size(filename) <= position:
+                continue
+            with open(filename, 'rb') as f:
+                f.seek(position)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # the last line can be incomplete while it is being written
+                    position += len(line)
+                    positions[key] = position
+                    found = True
+                    yield key, line
+        if found:
+            idle = 0
+            continue
+        if timeout is not None and idle >= timeout:
+            idle = 0
+            yield None
+        time.sleep(poll)
+        idle += poll
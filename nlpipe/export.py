@@ -0,0 +1,82 @@
+"""
+Export the token tables of many documents as a single typed columnar file (parquet or arrow ipc)
+
+Requires pyarrow (pip install pyarrow). Column types are taken from the module's columns declaration;
+low-cardinality string columns such as lemma and POS are dictionary encoded, so e.g. pandas reads them
+as categoricals and R/arrow as factors.
+"""
+from typing import Iterable, Mapping, Tuple, Union
+
+from nlpipe.module import get_module
+from nlpipe.tokens import TokenTable, _pyarrow
+
+EXPORT_FORMATS = ("parquet", "arrow")
+
+
+Results = Union[Mapping[str, str], Iterable[Tuple[str, str]]]
+
+
+def to_table(module: str, results: Results) -> TokenTable:
+    """
+    Combine the results of multiple documents into a single token table
+
+    :param module: Module name
+    :param results: a dict of {id: result} as returned by Client.bulk_result, or an iterable of (id, result) pairs.
+                    Results can also be bytes or buffers (see nlpipe.buffers)
+    :return: a nlpipe.tokens.TokenTable
+    """
+    m = get_module(module)
+    if not m.columns:
+        raise ValueError("Module {module} results cannot be exported".format(**locals()))
+    table = TokenTable(m.columns)
+    if isinstance(results, Mapping):
+        results = results.items()
+    for id, result in results:
+        try:
+            tokens = m.tokens(str(id), result)  # ids can be ints (e.g. from nlpamcat), but the id column is str
+        except Exception as e:
+            raise ValueError("Cannot convert the result of {module}/{id}: {e}".format(**locals()))
+        table.extend(tokens)
+    return table
+
+
+def _invalid_id(table: TokenTable):
+    """Get the id of the first document with a value that does not match the type of its column, if any"""
+    if "id" not in table.names:
+        return None
+    ids = table.column("id")
+    for (_name, type), values in zip(table.columns, table.data):
+        cls = int if type == "int" else str
+        for i, value in enumerate(values):
+            if value is not None and not isinstance(value, cls):
+                return ids[i]
+    return None
+
+
+def export(module: str, results: Results, format: str="parquet") -> bytes:
+    """
+    Export the results of multiple documents as a parquet or arrow ipc file
+
+    :param module: Module name
+    :param results: {id: result} dict or (id, result) pairs, see to_table
+    :param format: 'parquet' or 'arrow'
+    :return: The file contents (bytes)
+    """
+    if format not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format: {format}, use one of {EXPORT_FORMATS}"
+                         .format(format=format, EXPORT_FORMATS=EXPORT_FORMATS))
+    pa = _pyarrow()
+    tokens = to_table(module, results)
+    try:
+        table = tokens.to_arrow()
+    except pa.ArrowException as e:
+        id = _invalid_id(tokens)
+        raise ValueError("Cannot export the results of {module} (document {id}): {e}".format(**locals()))
+    sink = pa.BufferOutputStream()
+    if format == "parquet":
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, sink)
+    else:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return sink.getvalue().to_pybytes()
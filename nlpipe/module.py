@@ -1,10 +1,19 @@
-from typing import Iterable
+import hashlib
+import json
+from typing import Iterable, Optional
+
+from nlpipe.tokens import TokenTable
 
 
 class Module(object):
     """Abstract base class for NLPipe modules"""
     name = None
-    
+    # Sequence of (name, type) pairs describing the columns of the token table (see tokens()),
+    # type is 'str' or 'int'. Leave as None if the module has no token table conversion.
+    columns = None
+    # Version of the module (or of the tool it wraps), change it when an upgrade changes the results (see fingerprint)
+    version = None
+
     def check_status(self):
         """Check the status of this module and return an error if not available (e.g. service or tool not found)"""
         raise NotImplementedError()
@@ -15,8 +24,47 @@ class Module(object):
 
     def convert(self, id, result, format):
         """Convert the given result to the given format (e.g. 'xml'), if possible or raise an exception if not"""
+        if self.columns is not None and format in ("csv", "json"):
+            return self.tokens(id, result).convert(format)
         raise ValueError("Module {self.name} results cannot be converted to {format}".format(**locals()))
 
+    def tokens(self, id, result) -> TokenTable:
+        """
+        Convert the given result to a TokenTable with the module's columns.
+        The result can be a str, bytes or a buffer such as a memory-mapped file (see nlpipe.buffers)
+        """
+        raise ValueError("Module {self.name} results cannot be converted to a token table".format(**locals()))
+
+    def config(self):
+        """Settings that affect the results (e.g. which annotators are used), as a json serializable value or None"""
+        return None
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        Identify the version and configuration of the module. This is stored with each result,
+        so results of an older version or another configuration can be found and reprocessed (see Client.reprocess)
+        :return: a string '<version>:<hash of the config>', or None if the module has no version or config
+        """
+        config = self.config()
+        if self.version is None and config is None:
+            return None
+        digest = hashlib.md5(json.dumps(config, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+        return "{self.version}:{digest}".format(**locals())
+
+    def merge(self, results) -> str:
+        """
+        Merge the results of the chunks of a document (see nlpipe.chunks) into a single result,
+        renumbering sentences and shifting character offsets so they refer to the whole document
+
+        :param results: a list of (offset, result) pairs in document order, offset being the position of the chunk
+        """
+        raise NotImplementedError()
+
+    @property
+    def chunkable(self) -> bool:
+        """Whether large documents can be split into chunks for this module, i.e. whether it implements merge"""
+        return type(self).merge is not Module.merge
+
     @classmethod
     def register(cls):
         """Register this module in the nlpipe.module.known_modules"""
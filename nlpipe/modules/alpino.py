@@ -9,7 +9,6 @@ docker run -dp 5002:5002 vanatteveldt/alpino-server
 If running alpino locally, note that the module needs the dependencies end_hook, which seems to be missing in
 some builds. See: http://www.let.rug.nl/vannoord/alp/Alpino
 """
-import csv
 import datetime
 import json
 import logging
@@ -19,9 +18,10 @@ import requests
 
 import itertools
 import tempfile
-from io import StringIO
 
 from nlpipe.module import Module
+from nlpipe.buffers import to_text
+from nlpipe.tokens import TokenTable
 
 log = logging.getLogger(__name__)
 
@@ -31,6 +31,10 @@ CMD_TOKENIZE = ["Tokenization/tok"]
 
 class AlpinoParser(Module):
     name = "alpino"
+    columns = [("doc", "str"), ("id", "int"), ("sentence", "int"), ("offset", "int"), ("word", "str"),
+               ("lemma", "str"), ("pos", "str"), ("rel", "str"), ("parent", "int")]
+    # e.g. the tag of the alpino-server image, set ALPINO_VERSION when upgrading to find the results to reprocess
+    version = os.environ.get("ALPINO_VERSION")
 
     def check_status(self):
         if 'ALPINO_HOME' in os.environ:
@@ -57,14 +61,23 @@ class AlpinoParser(Module):
                                 .format(**locals()))
             return r.text
 
-    def convert(self, id, result, format):
-        assert format in ["csv"]
-        s = StringIO()
-        w = csv.writer(s)
-        w.writerow(["doc", "id", "sentence", "offset", "word", "lemma", "pos", "rel", "parent"])
-        for line in interpret_parse(result):
-            w.writerow((id,) + line)
-        return s.getvalue()
+    def tokens(self, id, result):
+        table = TokenTable(self.columns)
+        doc, tids, sents, offsets, words, lemmas, poss, rels, parents = table.data
+        for tid, sid, offset, word, lemma, pos, rel, parent in interpret_parse(to_text(result)):
+            doc.append(id)
+            tids.append(tid)
+            sents.append(sid)
+            offsets.append(offset)
+            words.append(word)
+            lemmas.append(lemma)
+            poss.append(pos)
+            rels.append(rel)
+            parents.append(parent)
+        return table
+
+    def merge(self, results):
+        return merge_parses([to_text(result) for (_offset, result) in results])
 
 
 AlpinoParser.register()
@@ -105,6 +118,26 @@ def get_fields(parse):
                 yield line.strip().split("|")
 
 
+def merge_parses(parses):
+    """
+    Merge the parses of the chunks of a document, renumbering the sentences.
+    (Alpino tokens have word positions rather than character offsets, so these do not change)
+    """
+    if parses and parses[0].strip().startswith("{"):
+        merged, n = {}, 0
+        for parse in parses:
+            parse = json.loads(parse)
+            merged.update((str(int(sid) + n), sent) for (sid, sent) in parse.items())
+            n += max((int(sid) for sid in parse), default=0)
+        return json.dumps(merged)
+    lines, n = [], 0
+    for parse in parses:
+        fields = list(get_fields(parse))
+        lines += ["|".join(line[:-1] + [str(int(line[-1]) + n)]) for line in fields]
+        n += max((int(line[-1]) for line in fields), default=0)
+    return "\n".join(lines) + "\n"
+
+
 def interpret_parse(parse):
     rels = {}  # child: (rel, parent)
     for line in get_fields(parse):
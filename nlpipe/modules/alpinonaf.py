@@ -9,22 +9,24 @@ docker run -dp 5002:5002 vanatteveldt/alpino-server
 If running alpino locally, note that the module needs the dependencies end_hook, which seems to be missing in
 some builds. See: http://www.let.rug.nl/vannoord/alp/Alpino
 """
-import csv
 import logging
 import os
-from io import StringIO, BytesIO
 
 import requests
-from KafNafParserPy import KafNafParser
 
 from nlpipe.module import Module
+from nlpipe.tokens import TokenTable
 from .alpino import POSMAP
+from .naf import read_terms
 
 log = logging.getLogger(__name__)
 
 
 class AlpinoNERCParser(Module):
     name = "alpinonerc"
+    columns = [("id", "str"), ("token_id", "str"), ("offset", "int"), ("sentence", "int"), ("para", "int"),
+               ("word", "str"), ("term_id", "str"), ("lemma", "str"), ("pos", "str"), ("pos1", "str"),
+               ("parent", "str"), ("relation", "str")]
 
     def check_status(self):
         alpino_server = os.environ.get('ALPINO_SERVER', 'http://localhost:5002')
@@ -39,34 +41,11 @@ class AlpinoNERCParser(Module):
         r.raise_for_status()
         return r.content.decode("utf-8")
 
-    def convert(self, id, result, format):
-        assert format == "csv"
-
-        _int = lambda x: None if x is None else int(x)
-        naf = KafNafParser(BytesIO(result.encode("utf-8")))
-
-        deps = {dep.get_to(): (dep.get_function(), dep.get_from())
-                for dep in naf.get_dependencies()}
-        tokendict = {token.get_id(): token for token in naf.get_tokens()}
-
-        s = StringIO()
-        w = csv.writer(s)
-        w.writerow(["id", "token_id", "offset", "sentence", "para", "word", "term_id",
-                    "lemma", "pos", "pos1", "parent", "relation"])
-        for term in naf.get_terms():
-            tokens = [tokendict[id] for id in term.get_span().get_span_ids()]
-            for token in tokens:
-                tid = term.get_id()
-                pos = term.get_pos()
-                pos1 = POSMAP[pos]
-                row = [id,  token.get_id(), _int(token.get_offset()), _int(token.get_para()), token.get_text(),
-                       tid, term.get_lemma(), pos, pos1]
-                if tid in deps:
-                    rel, parent = deps[tid]
-                    row += [parent, rel.split("/")[-1]]
-                else:
-                    row += [None, None]
-                w.writerow(row)
-        return s.getvalue()
+    def tokens(self, id, result):
+        t = read_terms(result)
+        return TokenTable.from_columns(self.columns, [
+            [id] * len(t["token_id"]), t["token_id"], t["offset"], t["sentence"], t["para"], t["word"], t["term_id"],
+            t["lemma"], t["pos"], [POSMAP[pos] for pos in t["pos"]], t["parent"],
+            [None if rel is None else rel.split("/")[-1] for rel in t["relation"]]])
 
 AlpinoNERCParser.register()
@@ -4,26 +4,37 @@ Wrapper around the CoreNLP server (http://nlp.stanford.edu/software/corenlp.shtm
 Assumes a CoreNLP server is listening at CORENLP_HOST (default localhost:9000)
 E.g. you can run:
 docker run -dp 9000:9000 chilland/corenlp-docker
+
+Results are requested as xml, or as the (more compact) json output if CORENLP_FORMAT=json.
+Conversion detects the format of each stored result, so stores containing both keep working.
 """
 
 from nlpipe.module import Module
+from nlpipe.tokens import TokenTable
 from urllib.parse import urlencode
 import requests
 import json
 import os
-from io import StringIO
-import csv
 import logging
+from xml.etree import ElementTree
+from nlpipe.buffers import iterparse, startswith, to_bytes, to_text
+
+OUTPUT_FORMATS = ("xml", "json")
 
-from corenlp_xml.document import Document
 
 class CoreNLPBase(Module):
 
 
-    def __init__(self, server=None):
+    def __init__(self, server=None, output_format=None):
         if server is None:
             server = os.getenv('CORENLP_HOST', 'http://localhost:9000')
+        if output_format is None:
+            output_format = os.getenv('CORENLP_FORMAT', 'xml')
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError("Unknown CoreNLP output format: {output_format}, use one of {OUTPUT_FORMATS}"
+                             .format(output_format=output_format, OUTPUT_FORMATS=OUTPUT_FORMATS))
         self.server = server
+        self.properties = dict(self.properties, outputFormat=output_format)
 
     def check_status(self):
         res = requests.get(self.server)
@@ -38,64 +49,249 @@ class CoreNLPBase(Module):
             raise Exception("Error calling corenlp at {url}: {res.status_code}\n{res.content}".format(**locals()))
         return res.content.decode("utf-8")
 
+    def config(self):
+        # both output formats are converted in the same way, so switching formats does not require reprocessing
+        return {k: v for (k, v) in self.properties.items() if k != "outputFormat"}
+
+    def merge(self, results):
+        return merge_results(results)
+
 class CoreNLPParser(CoreNLPBase):
     name = "corenlp_parse"
     properties = {"annotators": "tokenize,ssplit,pos,lemma,ner,parse,dcoref", "outputFormat": "xml"}
+    columns = [("doc", "str"), ("sentence", "int"), ("id", "int"), ("offset", "int"), ("word", "str"),
+               ("lemma", "str"), ("POS", "str"), ("pos1", "str"), ("ner", "str"), ("relation", "str"),
+               ("parent", "int")]
 
-    def convert(self, id, result, format):
-        assert format in ["csv"]
-        try:
-            doc = Document(result.encode("utf-8"))
-        except:
-            logging.exception("Error on parsing xml")
-            raise
-
-        s = StringIO()
-        w = csv.writer(s)
-        w.writerow(["doc", "sentence", "id", "offset", "word", "lemma", "POS", "pos1", "ner", "relation", "parent"])
-
-        parents = {}  # sentence, child.id : (rel, parent.id)
-        for sent in doc.sentences:
-            if sent.collapsed_ccprocessed_dependencies:
-                for dep in sent.collapsed_ccprocessed_dependencies.links:
-                    if dep.type != 'root':
-                        parents[sent.id, dep.dependent.idx] = (dep.type, dep.governor.idx)
-
-        for sent in doc.sentences:
-            for t in sent.tokens:
-                rel, parent = parents.get((sent.id, t.id), (None, None))
-                w.writerow([id, sent.id, t.id, t.character_offset_begin, t.word, t.lemma,
-                            t.pos, POSMAP[t.pos], t.ner, rel, parent])
-
-        return s.getvalue()
+    def tokens(self, id, result):
+        t = read_tokens(result)
+        return TokenTable.from_columns(self.columns, [
+            [id] * len(t["id"]), t["sentence"], t["id"], t["offset"], t["word"], t["lemma"], t["pos"],
+            [POSMAP[pos] for pos in t["pos"]], t["ner"], t["relation"], t["parent"]])
 
 
 class CoreNLPLemmatizer(CoreNLPBase):
     name = "corenlp_lemmatize"
     properties = {"annotators": "tokenize,ssplit,pos,lemma,ner", "outputFormat": "xml"}
+    columns = [("id", "str"), ("sentence", "int"), ("offset", "int"), ("word", "str"), ("lemma", "str"),
+               ("POS", "str"), ("pos1", "str"), ("ner", "str")]
+
+    def tokens(self, id, result):
+        t = read_tokens(result, dependencies=False)
+        return TokenTable.from_columns(self.columns, [
+            [id] * len(t["id"]), t["sentence"], t["offset"], t["word"], t["lemma"], t["pos"],
+            [POSMAP[pos] for pos in t["pos"]], t["ner"]])
+
 
-    def convert(self, id, result, format):
-        assert format in ["csv"]
-        try:
-            doc = Document(result.encode("utf-8"))
-        except:
-            logging.exception("Error on parsing xml")
-            raise
-
-        s = StringIO()
-        w = csv.writer(s)
-        w.writerow(["id", "sentence", "offset", "word", "lemma", "POS", "pos1", "ner"])
-        
-        for sent in doc.sentences:
-            for t in sent.tokens:
-                w.writerow([id, sent.id, t.character_offset_begin, t.word, t.lemma,
-                            t.pos, POSMAP[t.pos], t.ner])
-        return s.getvalue()
-    
 CoreNLPLemmatizer.register()
 CoreNLPParser.register()
 
 
+# Dependency layer used for the relation and parent columns
+DEPENDENCIES = "collapsed-ccprocessed-dependencies"
+# Newer CoreNLP versions only output the enhanced layers in json, use enhanced++ if collapsed-cc is missing
+JSON_DEPENDENCIES = (DEPENDENCIES, "enhancedPlusPlusDependencies")
+
+# Columns returned by read_tokens
+TOKEN_COLUMNS = ("sentence", "id", "offset", "word", "lemma", "pos", "ner", "relation", "parent")
+_TOKEN_FIELDS = {"word": 0, "lemma": 1, "CharacterOffsetBegin": 2, "POS": 3, "NER": 4}
+
+
+def read_tokens(result, dependencies=True):
+    """
+    Parse a CoreNLP result (xml or json output) into columns: a dict of {column: [values]} with a value per token
+    for each of TOKEN_COLUMNS (sentence, id, offset, word, lemma, pos, ner, relation, parent)
+
+    :param result: The CoreNLP output (string, bytes or a buffer such as a memory-mapped file)
+    :param dependencies: If False, skip the dependency layer and give None for relation and parent
+    """
+    if startswith(result, b"{"):
+        columns = read_json_tokens(result, dependencies=dependencies)
+    else:
+        columns = read_xml_tokens(result, dependencies=dependencies)
+    if not dependencies:
+        columns["relation"], columns["parent"] = [None] * len(columns["id"]), [None] * len(columns["id"])
+    return columns
+
+
+def _add_dependencies(columns, start, deps):
+    """Add the relation and parent of the tokens of a sentence (from index start) given its (rel, child, parent)s"""
+    parents = _get_parents(deps)
+    rels, parent_ids = columns["relation"], columns["parent"]
+    for tid in columns["id"][start:]:
+        rel, parent = parents.get(tid, (None, None))
+        rels.append(rel)
+        parent_ids.append(parent)
+
+
+def read_json_tokens(result, dependencies=True):
+    """Parse a CoreNLP json document, see read_tokens"""
+    doc = json.loads(to_text(result))
+    columns = {name: [] for name in TOKEN_COLUMNS}
+    for sent in doc["sentences"]:
+        tokens = sent["tokens"]
+        start = len(columns["id"])
+        columns["sentence"].extend([sent["index"] + 1] * len(tokens))  # xml sentence ids start at 1
+        columns["id"].extend([t["index"] for t in tokens])
+        columns["offset"].extend([t.get("characterOffsetBegin") for t in tokens])
+        for name in "word", "lemma", "pos", "ner":
+            columns[name].extend([t.get(name) for t in tokens])
+        if dependencies:
+            layer = next((sent[key] for key in JSON_DEPENDENCIES if key in sent), [])
+            _add_dependencies(columns, start, [(dep["dep"], dep["dependent"], dep["governor"]) for dep in layer])
+    return columns
+
+
+def _parse_events(xml):
+    """iterparse the start and end events of the xml, logging parse errors"""
+    try:
+        yield from iterparse(xml, events=("start", "end"))
+    except ElementTree.ParseError:
+        logging.exception("Error on parsing xml")
+        raise
+
+
+def read_xml_tokens(xml, dependencies=True):
+    """
+    Incrementally parse a CoreNLP xml document, see read_tokens.
+    Only the xml of the current sentence is kept in memory, so this works for arbitrarily large documents.
+    """
+    columns = {name: [] for name in TOKEN_COLUMNS}
+    sids, tids, offsets, words, lemmas, poss, ners = (columns[name] for name in TOKEN_COLUMNS[:7])
+    sentences = sentences_depth = None  # processed sentences are removed from the <sentences> element
+    sentence_depth = None  # only look at /root/document/sentences/sentence, not at <sentence> in coreferences
+    deptype = None
+    depth = 0
+    start, deps = 0, []  # index of the first token of the current sentence, and its dependencies
+    for event, elem in _parse_events(xml):
+        tag = elem.tag
+        if event == "start":
+            depth += 1
+            if tag == "sentences" and sentences is None:
+                sentences, sentences_depth = elem, depth
+            elif tag == "sentence" and sentences_depth is not None and depth == sentences_depth + 1:
+                sentence_depth = depth
+            elif tag == "dependencies":
+                deptype = elem.get("type")
+            continue
+        depth -= 1
+        if tag == "coreference":
+            elem.clear()  # coreferences are not converted, so do not keep them in memory
+            continue
+        if sentence_depth is None:
+            continue
+        if tag == "token":
+            values = [None] * 5
+            for child in elem:
+                i = _TOKEN_FIELDS.get(child.tag)
+                if i is not None:
+                    values[i] = child.text
+            tids.append(int(elem.get("id")))
+            words.append(values[0])
+            lemmas.append(values[1])
+            offsets.append(None if values[2] is None else int(values[2]))
+            poss.append(values[3])
+            ners.append(values[4])
+            elem.clear()
+        elif tag == "dep" and dependencies and deptype == DEPENDENCIES:
+            governor, dependent = elem.find("governor"), elem.find("dependent")
+            deps.append((elem.get("type"), int(dependent.get("idx")), int(governor.get("idx"))))
+        elif tag == "dependencies":
+            deptype = None
+        elif tag == "sentence" and depth + 1 == sentence_depth:
+            sids.extend([int(elem.get("id"))] * (len(tids) - start))
+            if dependencies:
+                _add_dependencies(columns, start, deps)
+            start, deps = len(tids), []
+            sentence_depth = None
+            sentences.remove(elem)
+    return columns
+
+
+def merge_results(results):
+    """
+    Merge the CoreNLP results (xml or json output) of the chunks of a document, see Module.merge.
+    Sentences are renumbered and character offsets and coreference mentions are updated to refer to the document
+    """
+    if results and startswith(results[0][1], b"{"):
+        return merge_json(results)
+    return merge_xml(results)
+
+
+def merge_xml(results):
+    """Merge CoreNLP xml documents, see merge_results"""
+    root = None
+    nsentences = 0
+    for offset, result in results:
+        tree = ElementTree.fromstring(to_bytes(result))
+        document = tree.find("document")
+        sentences = document.find("sentences")
+        for sentence in sentences.findall("sentence"):
+            sentence.set("id", str(int(sentence.get("id")) + nsentences))
+            for tag in "CharacterOffsetBegin", "CharacterOffsetEnd":
+                for elem in sentence.iter(tag):
+                    elem.text = str(int(elem.text) + offset)
+        for elem in document.findall("coreference/coreference/mention/sentence"):
+            elem.text = str(int(elem.text) + nsentences)
+        nsentences += len(sentences)
+        if root is None:
+            root = tree
+            continue
+        target = root.find("document")
+        target.find("sentences").extend(sentences)
+        coreference = document.find("coreference")
+        if coreference is not None:
+            if target.find("coreference") is None:
+                target.append(coreference)
+            else:
+                target.find("coreference").extend(coreference)
+    return '<?xml version="1.0" encoding="UTF-8"?>\n' + ElementTree.tostring(root, encoding="unicode")
+
+
+def merge_json(results):
+    """Merge CoreNLP json documents, see merge_results"""
+    merged = None
+    nsentences = nmentions = 0
+    for offset, result in results:
+        doc = json.loads(to_text(result))
+        for sent in doc.get("sentences", []):
+            sent["index"] += nsentences
+            for elem in sent.get("tokens", []) + sent.get("entitymentions", []):
+                for key in "characterOffsetBegin", "characterOffsetEnd":
+                    if key in elem:
+                        elem[key] += offset
+        corefs, maxid = {}, 0
+        for key, mentions in doc.get("corefs", {}).items():
+            for mention in mentions:
+                maxid = max(maxid, mention["id"] + 1)
+                mention["id"] += nmentions
+                mention["sentNum"] += nsentences
+            corefs[str(int(key) + nmentions)] = mentions
+        nsentences += len(doc.get("sentences", []))
+        nmentions += maxid
+        if merged is None:
+            merged = dict(doc, corefs=corefs) if "corefs" in doc else doc
+        else:
+            merged.setdefault("sentences", []).extend(doc.get("sentences", []))
+            if corefs:
+                merged.setdefault("corefs", {}).update(corefs)
+    return json.dumps(merged)
+
+
+def _get_parents(deps):
+    """
+    Get a {dependent: (relation, governor)} dict from a list of (relation, dependent, governor) triples.
+    Links are applied grouped by relation (in order of first occurrence), so if a token has multiple governors
+    the result is the same as in the corenlp_xml dependency graph used by earlier versions.
+    """
+    order = {}
+    for rel, _, _ in deps:
+        order.setdefault(rel, len(order))
+    return {dependent: (rel, governor)
+            for (rel, dependent, governor) in sorted(deps, key=lambda dep: order[dep[0]])
+            if rel.lower() != 'root'}
+
+
 POSMAP = { # Penn treebank POS -> simple POS
     # P preposition
     'IN': 'P',
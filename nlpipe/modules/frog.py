@@ -19,10 +19,14 @@ import socket
 
 from pynlpl.clients.frogclient import FrogClient
 from nlpipe.module import Module
+from nlpipe.buffers import to_text
+from nlpipe.tokens import TokenTable
 
 
 class FrogLemmatizer(Module):
     name = "frog"
+    columns = [("id", "str"), ("sentence", "int"), ("offset", "int"), ("word", "str"), ("lemma", "str"),
+               ("morphofeat", "str"), ("ner", "str"), ("chunk", "str"), ("pos", "str")]
     
     def __init__(self, server=None):
         if server is None:
@@ -58,20 +62,15 @@ class FrogLemmatizer(Module):
             w.writerow(list(line))
         return s.getvalue()
 
-    def convert(self, id, result, format):
-        assert format in ["csv"]
+    def tokens(self, id, result):
         # add id and pos column to result
-        r = csv.reader(StringIO(result), delimiter=',')
-        out = StringIO()
-        w = csv.writer(out)
-        header = next(r)
-        w.writerow(["id"] + header + ["pos"])
-
-        for row in r:
-            morphofeat = row[4].split("(")[0]
-            pos = _POSMAP[morphofeat]
-            w.writerow([id] + row + [pos])
-        return out.getvalue()
+        r = csv.reader(StringIO(to_text(result)), delimiter=',')
+        next(r)  # header
+        columns = [list(values) for values in zip(*r)] or [[] for _ in range(7)]
+        sents, offsets, words, lemmas, morphofeats, ners, chunks = columns
+        return TokenTable.from_columns(self.columns, [
+            [id] * len(sents), [int(s) for s in sents], [int(o) for o in offsets], words, lemmas, morphofeats, ners,
+            chunks, [_POSMAP[m.split("(")[0]] for m in morphofeats]])
 
 
 FrogLemmatizer.register()
@@ -0,0 +1,62 @@
+"""
+Streaming reader for NAF (NLP Annotation Format) documents, see http://wordpress.let.vupr.nl/naf/
+
+Reads the text, terms and deps layers in a single incremental pass without building a KafNafParser tree,
+so it can be used by any NAF-producing module (alpinonerc, newsreader, ...) to convert results to csv
+"""
+from nlpipe.buffers import iterparse
+
+# Layers read by read_terms, all other layers are skipped and discarded while parsing
+_LAYERS = {"text", "terms", "deps"}
+# Columns returned by read_terms
+TERM_COLUMNS = ("token_id", "offset", "sentence", "para", "word", "term_id", "lemma", "pos", "parent", "relation")
+
+
+def _int(x):
+    return None if x is None else int(x)
+
+
+def read_terms(naf):
+    """
+    Parse a NAF document into columns: a dict of {column: [values]} with a value per token per term for each of
+    TERM_COLUMNS (token_id, offset, sentence, para, word, term_id, lemma, pos, parent, relation),
+    where parent is the governing term id and relation the dependency function (or None if not a dependent)
+
+    :param naf: The NAF document (string, bytes or a buffer such as a memory-mapped file)
+    """
+    tokens = {}  # token id : (offset, sentence, para, word)
+    terms = []  # (term id, lemma, pos, [token ids])
+    deps = {}  # term id : (rfunc, governing term id)
+    depth = 0
+    for event, elem in iterparse(naf, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        tag = elem.tag
+        if depth == 1 and tag not in _LAYERS:
+            elem.clear()  # top-level layer we don't need
+        elif tag == "wf":
+            tokens[elem.get("id")] = (_int(elem.get("offset")), _int(elem.get("sent")), _int(elem.get("para")),
+                                      elem.text)
+            elem.clear()
+        elif tag == "term":
+            span = elem.find("span")
+            targets = [] if span is None else [target.get("id") for target in span.iter("target")]
+            terms.append((elem.get("id"), elem.get("lemma"), elem.get("pos"), targets))
+            elem.clear()
+        elif tag == "dep":
+            deps[elem.get("to")] = (elem.get("rfunc"), elem.get("from"))
+            elem.clear()
+
+    columns = {name: [] for name in TERM_COLUMNS}
+    token_ids = columns["token_id"]
+    for tid, lemma, pos, targets in terms:
+        rel, parent = deps.get(tid, (None, None))
+        token_ids.extend(targets)
+        for name, value in (("term_id", tid), ("lemma", lemma), ("pos", pos), ("parent", parent), ("relation", rel)):
+            columns[name].extend([value] * len(targets))
+    token_values = [tokens[token_id] for token_id in token_ids]
+    for i, name in enumerate(("offset", "sentence", "para", "word")):
+        columns[name] = [values[i] for values in token_values]
+    return columns
@@ -20,4 +20,7 @@ class TestUpper(Module):
             return json.dumps({"id": id, "status": "OK", "result": result})
         super().convert(result, format)
 
+    def merge(self, results):
+        return "\n\n".join(result for (_offset, result) in results)
+
 TestUpper.register()
@@ -2,11 +2,13 @@ import argparse
 import json
 from collections import Counter
 import re
+import sys
 from io import BytesIO
 from typing import Union, Iterable, Mapping
 
 from amcatclient import AmcatAPI
 from nlpipe.client import get_client, Client
+from nlpipe.export import EXPORT_FORMATS
 import logging
 from KafNafParserPy import KafNafParser, CfileDesc, Cpublic, CHeader
 
@@ -51,7 +53,7 @@ def get_status(amcat_server: Union[str, AmcatAPI], project: int, articleset: int
 
 def process(amcat_server: Union[str, AmcatAPI], project: int, articleset: int,
             nlpipe_server: Union[str, Client], module: str,
-            reset_error: bool=False, reset_started: bool=False, to_naf: bool=False) -> None:
+            reset_error: bool=False, reset_started: bool=False, to_naf: bool=False, submitter: str=None) -> None:
     """
     Process the given documents
 
@@ -63,7 +65,10 @@ def process(amcat_server: Union[str, AmcatAPI], project: int, articleset: int,
     :param reset_started: Re-set started documents to pending
     :param reset_error: Re-assign documents with errors
     :param to_naf: Assign as NAF documents with metadata (otherwise, assign as plain text)
+    :param submitter: Submitter key for sharing the workers with other projects (default: amcat-<project>)
     """
+    if submitter is None:
+        submitter = "amcat-{project}".format(**locals())
     status = get_status(amcat_server, project, articleset, nlpipe_server, module)
     accept_status = {"UNKNOWN"}
     if reset_error:
@@ -72,17 +77,24 @@ def process(amcat_server: Union[str, AmcatAPI], project: int, articleset: int,
         accept_status |= {"STARTED"}
 
     todo = [id for (id, status) in status.items() if status in accept_status]
+    if todo and not to_naf:
+        # queue articles that were already uploaded for another module from the document store (only plain text
+        # documents are enqueued, the NAF input is generated with the article metadata and uploaded each time)
+        known = len(todo)
+        todo = _nlpipe(nlpipe_server).enqueue(module, todo, reset_error=reset_error, reset_pending=reset_started,
+                                              submitter=submitter)
+        logging.info("Assigned {} already stored articles".format(known - len(todo)))
     if todo:
         logging.info("Assigning {} articles from {amcat_server} set {project}:{articleset}"
                      .format(len(todo), **locals()))
-        columns = 'headline,text,creator,date,url,uuid,medium,section,page' if args.naf else 'headline,text'
+        columns = 'headline,text,creator,date,url,uuid,medium,section,page' if to_naf else 'headline,text'
         for arts in _amcat(amcat_server).get_articles_by_id(articles=todo, columns=columns,
                                                             page_size=100, yield_pages=True):
             ids = [a['id'] for a in arts]
-            texts = [_get_text(a, to_naf=args.naf) for a in arts]
+            texts = [_get_text(a, to_naf=to_naf) for a in arts]
             logging.debug("Assigning {} articles".format(len(ids)))
-            _nlpipe(nlpipe_server).bulk_process(args.module, texts, ids=ids, reset_error=reset_error,
-                                                reset_pending=reset_started)
+            _nlpipe(nlpipe_server).bulk_process(module, texts, ids=ids, reset_error=reset_error,
+                                                reset_pending=reset_started, submitter=submitter)
     logging.info("Done! Assigned {} articles".format(len(todo)))
 
 
@@ -90,6 +102,8 @@ def get_results(amcat_server: Union[str, AmcatAPI], project: int, articleset: in
             nlpipe_server: Union[str, Client], module: str, format: str=None):
     status = get_status(amcat_server, project, articleset, nlpipe_server, module)
     toget = [id for (id, status) in status.items() if status == "DONE"]
+    if format in EXPORT_FORMATS:
+        return _nlpipe(nlpipe_server).bulk_export(module, toget, format=format)
     kargs = {'format': format} if format else {}
     return _nlpipe(nlpipe_server).bulk_result(module, toget, **kargs)
 
@@ -151,7 +165,10 @@ if __name__ == '__main__':
     parser.add_argument("module", help="Module name")
     parser.add_argument("action", help="NLPipe action", choices=["process", "status", "result"])
     parser.add_argument("--naf", help="Use NAF input format (action=process)", action="store_true")
-    parser.add_argument("--format", "-f", help="Result format (action=result)")
+    parser.add_argument("--format", "-f", help="Result format (action=result), use parquet or arrow "
+                                               "to get a single columnar file for the whole set")
+    parser.add_argument("--submitter", "-s", help="Submitter key for fair scheduling (action=process, "
+                                                  "default: amcat-<project>)")
     parser.add_argument("--verbose", "-v", help="Verbose (debug) output", action="store_true")
     parser.add_argument("--reset-error", "-e", help="Reset errored documents (action=process)", action="store_true")
     parser.add_argument("--reset-started", "-p", help="Reset started documents (action=process)", action="store_true")
@@ -167,7 +184,7 @@ if __name__ == '__main__':
 
     if args.action == "process":
         process(args.amcatserver, args.project, args.articleset, args.nlpipeserver, args.module,
-                args.reset_error, args.reset_started)
+                args.reset_error, args.reset_started, to_naf=args.naf, submitter=args.submitter)
     if args.action == "status":
         status = get_status(args.amcatserver, args.project, args.articleset, args.nlpipeserver, args.module)
         for k, v in Counter(status.values()).items():
@@ -180,6 +197,8 @@ if __name__ == '__main__':
                 if i != 0 and "\n" in csv_bytes:
                     csv_bytes = csv_bytes.split("\n", 1)[1]
                 print(csv_bytes.strip())
+        elif args.format in EXPORT_FORMATS:
+            sys.stdout.buffer.write(results)
         else:
             print(json.dumps(results, indent=4))
 
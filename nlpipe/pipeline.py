@@ -0,0 +1,90 @@
+"""
+Pipelines of modules that are run on the server: when a task is done, its result is queued as input for the next
+module(s) of the pipeline, without the client downloading and re-submitting it (see Client.process_pipeline)
+"""
+from typing import Iterable, List, Mapping, Sequence, Union
+
+
+class UnknownPipelineError(ValueError):
+    pass
+
+
+class Pipeline(object):
+    """A tree of modules, in which the result of each module is the input for its next modules"""
+
+    def __init__(self, name: str, stages: Union[Sequence[str], Mapping[str, Sequence[str]]]):
+        """
+        :param name: Pipeline name
+        :param stages: a list of module names that are run in this order,
+                       or a {module: [next modules]} dict, e.g. {'alpinonerc': ['srl', 'coreference']}
+        """
+        self.name = name
+        if isinstance(stages, Mapping):
+            self._next = {module: list(next) for (module, next) in stages.items()}
+        else:
+            self._next = {module: [next] for (module, next) in zip(stages, stages[1:])}
+        parents = {}
+        for module, next in self._next.items():
+            for child in next:
+                if child in parents:
+                    raise ValueError("Module {child} follows both {} and {module} in pipeline {name}"
+                                     .format(parents[child], **locals()))
+                parents[child] = module
+        self.first = [module for module in self._modules(stages) if module not in parents]
+        if not self.first:
+            raise ValueError("Pipeline {name} has no first module".format(**locals()))
+        self.modules = []  # all modules, each after the module it follows
+        todo = list(self.first)
+        while todo:
+            module = todo.pop(0)
+            self.modules.append(module)
+            todo += self.next(module)
+        if len(self.modules) != len(parents) + len(self.first):
+            raise ValueError("Pipeline {name} contains a cycle".format(**locals()))
+
+    @staticmethod
+    def _modules(stages):
+        modules = list(stages)
+        if isinstance(stages, Mapping):
+            modules += [child for next in stages.values() for child in next if child not in stages]
+        return modules
+
+    @property
+    def stages(self) -> Mapping[str, List[str]]:
+        """The {module: [next modules]} of the pipeline, so it can be recreated as Pipeline(name, stages)"""
+        return {module: list(next) for (module, next) in self._next.items()}
+
+    def next(self, module: str) -> List[str]:
+        """Get the modules that take the result of the given module as input"""
+        return self._next.get(module, [])
+
+    def __repr__(self):
+        return "Pipeline({self.name!r}, {self._next!r})".format(**locals())
+
+
+_known_pipelines = {}
+
+
+def register_pipeline(pipeline: Pipeline):
+    """Register a pipeline so it can be used by the client and server"""
+    _known_pipelines[pipeline.name] = pipeline
+
+
+def get_pipeline(name: str) -> Pipeline:
+    try:
+        return _known_pipelines[name]
+    except KeyError:
+        raise UnknownPipelineError("Unknown pipeline: {name}. Known pipelines: {}"
+                                   .format(list(_known_pipelines.keys()), **locals()))
+
+
+def known_pipelines() -> Iterable[Pipeline]:
+    return _known_pipelines.values()
+
+
+def parse_pipeline(spec: str) -> Pipeline:
+    """Parse a pipeline specification of the form name=module1,module2,... (modules are run in this order)"""
+    if "=" not in spec:
+        raise ValueError("Invalid pipeline: {spec!r}, use e.g. name=module1,module2".format(**locals()))
+    name, modules = spec.split("=", 1)
+    return Pipeline(name, modules.split(","))
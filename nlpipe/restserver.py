@@ -5,7 +5,13 @@ from flask import Flask, request, make_response, Response, abort, jsonify
 from flask.templating import render_template
 
 from nlpipe.client import FSClient
+from werkzeug.wsgi import wrap_file
+
+from nlpipe.compression import (CODECS, HTTP_MIN_SIZE, compress, compress_stream, decompress, detect_file,
+                                parse_compression, zstd_available)
+from nlpipe.segments import SegmentClient
 from nlpipe.module import UnknownModuleError, get_module, known_modules
+from nlpipe.pipeline import UnknownPipelineError, get_pipeline, parse_pipeline, register_pipeline
 from nlpipe.worker import run_workers
 import logging
 
@@ -19,9 +25,100 @@ STATUS_CODES = {
     'PENDING': 202,
     'STARTED': 202,
     'DONE': 200,
+    'STALE': 200,
     'ERROR': 500
 }
 ERROR_MIME = 'application/prs.error+text'
+# Threads per process when serving with gunicorn, see serve
+DEFAULT_THREADS = 8
+# Gunicorn restarts workers from the (forked) master and may run an old and a new worker side by side, which would
+# lose or corrupt the in-memory index of a segment store
+SEGMENTS_GUNICORN = ("The segment store cannot be served with gunicorn, "
+                     "use the threaded server (python -m nlpipe.restserver --store segments)")
+# Seconds between keepalive comments on an idle event stream
+EVENT_KEEPALIVE = 15
+
+
+def _get_data() -> bytes:
+    """Get the request body, decompressing it if it was sent with a gzip or zstd Content-Encoding"""
+    data = request.get_data()
+    if request.content_encoding in CODECS:
+        data = decompress(data)
+    return data
+
+
+def _get_json():
+    return json.loads(_get_data().decode('UTF-8'))
+
+
+def _flag(name) -> bool:
+    return request.args.get(name, False) in ('1', 'Y', 'True')
+
+
+def _accepted_codec():
+    """Get the compression codec to use for the response, or None if the client doesn't accept compression"""
+    accepted = request.accept_encodings
+    if 'zstd' in accepted and zstd_available():
+        return 'zstd'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def _file_response(f, status=200):
+    """
+    Respond with the contents of the (possibly compressed) stored file.
+    Compressed files are streamed as-is if the client accepts the encoding. Uncompressed files are streamed as-is,
+    or compressed while they are streamed if they are large and the client accepts compression (like
+    compress_response, but without reading the file into memory).
+    Otherwise, the file is read and decompressed in memory.
+    """
+    codec = detect_file(f)
+    size = f.seek(0, os.SEEK_END)
+    f.seek(0)
+    accepted = _accepted_codec() if codec is None and size >= HTTP_MIN_SIZE else None
+    if accepted is not None:
+        resp = Response(compress_stream(f, accepted), status=status, direct_passthrough=True)
+        resp.headers['Content-Encoding'] = accepted
+        resp.vary.add('Accept-Encoding')
+        return resp
+    if codec is None or codec in request.accept_encodings:
+        resp = Response(wrap_file(request.environ, f), status=status, direct_passthrough=True)
+        resp.content_length = size
+        if codec is not None:
+            resp.headers['Content-Encoding'] = codec
+            resp.vary.add('Accept-Encoding')
+        return resp
+    with f:
+        return Response(decompress(f.read()), status=status)
+
+
+def _cacheable(response, etag):
+    """
+    Add the ETag of a (DONE) result to the response. Results can be replaced by reprocessing, so clients and
+    proxies should revalidate them (If-None-Match) rather than using them as immutable
+    """
+    if etag is not None:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """Compress large responses if the client accepts gzip or zstd encoding"""
+    if (response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers
+            or response.status_code < 200 or response.status_code >= 300):
+        return response
+    data = response.get_data()
+    if len(data) < HTTP_MIN_SIZE:
+        return response
+    codec = _accepted_codec()
+    if codec is not None:
+        response.set_data(compress(data, codec))
+        response.headers['Content-Encoding'] = codec
+        response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/')
 def index():
@@ -41,7 +138,9 @@ def post_task(module):
     """
     POST a new task to the NLPipe server.
     Post body should contain the test to process.
-    You can specify an explicit document id with ?id=<id>
+    You can specify an explicit document id with ?id=<id>,
+    use ?priority=interactive to process it before batch tasks,
+    and ?submitter=<key> to share the workers fairly between submitters or projects
     Response will be an empty HTTP 202 response with Location and ID headers
 
     :param module: The name of the module to process with
@@ -50,9 +149,13 @@ def post_task(module):
         get_module(module)  # check if module exists
     except UnknownModuleError as e:
         return str(e), 404
-    doc = request.get_data().decode('UTF-8')
+    doc = _get_data()
     id = request.args.get("id")
-    id = app.client.process(module, doc, id=id)
+    try:
+        id = app.client.process(module, doc, id=id, priority=request.args.get("priority"),
+                                submitter=request.args.get("submitter"))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
     resp = Response(id+"\n", status=202)
     resp.headers['Location'] = '/api/modules/{module}/{id}'.format(**locals())
     resp.headers['ID'] = id
@@ -65,11 +168,12 @@ def task_status(module, id):
     """
     HEAD gets the status of a task as HTTP Status code.
     Response will also contain a status header.
+    Use ?stale=1 to get status STALE for results of an older version or configuration of the module
 
     :param module: The module name
     :param id: ID of the task to get status for
     """
-    status = app.client.status(module, id)
+    status = app.client.status(module, id, stale=_flag('stale'))
     resp = Response(status=STATUS_CODES[status])
     resp.headers['Status'] = status
     return resp
@@ -88,6 +192,14 @@ def result(module, id):
     :param id: ID of the task to get result for
     """
     format = request.args.get('format', None)
+    etag = app.client.result_etag(module, id, format=format)
+    if etag is not None and etag in request.if_none_match:
+        return _cacheable(Response(status=304), etag)
+    if format is None and etag is not None:
+        try:
+            return _cacheable(_file_response(app.client.result_file(module, id)), etag)
+        except FileNotFoundError:
+            pass  # status changed in the meantime, use normal path below
     try:
         result = app.client.result(module, id, format=format)
     except FileNotFoundError:
@@ -95,7 +207,7 @@ def result(module, id):
     except Exception as e:
         result = {"exception_class": type(e).__name__, "message": str(e)}
         return make_response(jsonify(result), 500)
-    return result, 200
+    return _cacheable(make_response(result, 200), etag)
 
 
 @app.route('/api/modules/<module>/', methods=['GET'])
@@ -104,14 +216,19 @@ def get_task(module):
     """
     GET a task to process.
     This is intended to be called by a worker and will set status of the task to STARTED.
-    Returns the text to process with HTTP headers ID and Location
+    Returns the text to process with HTTP headers ID and Location.
+    Use e.g. ?sizes=large (or sizes=small,medium) to only get batch tasks of these size classes
 
     :param module: Module name
     """
-    id, doc = app.client.get_task(module)
-    if doc is None:
+    sizes = request.args.get("sizes")
+    try:
+        id, f = app.client.get_task_file(module, sizes=sizes.split(",") if sizes else None)
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    if f is None:
         return 'Queue {module} empty!\n'.format(**locals()), 404
-    resp = Response(doc, status=200)
+    resp = _file_response(f)
     resp.headers['Location'] = '/api/modules/{module}/{id}'.format(**locals())
     resp.headers['ID'] = id
     return resp
@@ -129,11 +246,11 @@ def put_results(module, id):
     :param id:
     :return:
     """
-    doc = request.get_data().decode('UTF-8')
+    doc = _get_data()
     if request.content_type == ERROR_MIME:
         app.client.store_error(module, id, doc)
     else:
-        app.client.store_result(module, id, doc)
+        app.client.store_result(module, id, doc, fingerprint=request.headers.get('Fingerprint'))
     return '', 204
 
 
@@ -142,17 +259,18 @@ def put_results(module, id):
 def bulk_status(module):
     """
     Bulk method: POST a json list of IDs to get status information from.
+    Use ?stale=1 to get status STALE for results of an older version or configuration of the module.
     Returns a json dict of {id: status}
 
     :param module: The module name
     """
     try:
-        ids = request.get_json(force=True)
+        ids = _get_json()
         if not ids:
             raise ValueError("Empty request")
     except:
         return "Error: Please provive bulk IDs as a json list\nd ", 400
-    statuses = {id: app.client.status(module, str(id)) for id in ids}
+    statuses = app.client.bulk_status(module, [str(id) for id in ids], stale=_flag('stale'))
     return json.dumps(statuses, indent=4), 200
 
 
@@ -166,7 +284,7 @@ def bulk_result(module):
     :param module: The module name
     """
     try:
-        ids = request.get_json(force=True)
+        ids = _get_json()
         if not ids:
             raise ValueError("Empty request")
     except:
@@ -176,11 +294,59 @@ def bulk_result(module):
     return jsonify(results)
 
 
+@app.route('/api/modules/<module>/bulk/etag', methods=['POST'])
+@auto.doc()
+def bulk_etag(module):
+    """
+    Bulk method: POST a json list of IDs to get the ETags of their results, e.g. to check which cached results
+    are still valid. Use ?format=<format> for the ETags of converted results.
+    Returns a json dict of {id: etag} for the ids that are DONE
+
+    :param module: The module name
+    """
+    try:
+        ids = _get_json()
+        if not ids:
+            raise ValueError("Empty request")
+    except:
+        return "Error: Please provide bulk IDs as a json list\n", 400
+    format = request.args.get('format', None)
+    etags = {id: app.client.result_etag(module, id, format=format) for id in ids}
+    return jsonify({id: etag for (id, etag) in etags.items() if etag is not None})
+
+
+@app.route('/api/modules/<module>/bulk/export', methods=['POST'])
+@auto.doc()
+def bulk_export(module):
+    """
+    Bulk method: POST a json list of IDs to export as a single columnar file.
+    Use ?format=parquet (default) or ?format=arrow (arrow ipc file)
+    Returns the binary file
+
+    :param module: The module name
+    """
+    try:
+        ids = _get_json()
+        if not ids:
+            raise ValueError("Empty request")
+    except:
+        return "Error: Please provive bulk IDs as a json list\nd ", 400
+    format = request.args.get('format', 'parquet')
+    try:
+        data = app.client.bulk_export(module, ids, format=format)
+    except ValueError as e:  # including results that cannot be converted, see nlpipe.export
+        return "Error: {e}\n".format(**locals()), 400
+    mimetype = 'application/vnd.apache.arrow.file' if format == 'arrow' else 'application/octet-stream'
+    return Response(data, status=200, mimetype=mimetype)
+
+
 @app.route('/api/modules/<module>/bulk/process', methods=['POST'])
 @auto.doc()
 def bulk_process(module):
     """
     Bulk method: POST a json list or {id: text} dict containing texts to process
+    Use ?priority=interactive to process them before batch tasks, and ?submitter=<key> to tag them with a
+    submitter or project key (workers share the batch throughput over the submitters)
     Returns a json list of ids
 
     :param module: The module name
@@ -188,22 +354,247 @@ def bulk_process(module):
     reset_error = request.args.get('reset_error', False) in ('1', 'Y', 'True')
     reset_pending = request.args.get('reset_pending', False) in ('1', 'Y', 'True')
     try:
-        docs = request.get_json(force=True)
+        docs = _get_json()
         if not docs:
             raise ValueError("Empty request")
     except:
-        logging.exception("bulk/process: Error parsing json {}".format(repr(request.data)[:20]))
+        logging.exception("bulk/process: Error parsing json {}".format(repr(request.get_data())[:20]))
         return "Error: Please provive bulk docs as a json list or {id:doc, } dict\n ", 400
     if isinstance(docs, list):
         docs, ids = docs, None
     else:
         docs, ids = docs.values(), docs.keys()
-    ids = app.client.bulk_process(module, docs, ids=ids, reset_error=reset_error, reset_pending=reset_pending)
+    try:
+        ids = app.client.bulk_process(module, docs, ids=ids, reset_error=reset_error, reset_pending=reset_pending,
+                                      priority=request.args.get("priority"), submitter=request.args.get("submitter"))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
     return jsonify(ids)
 
 
+@app.route('/api/modules/<module>/bulk/enqueue', methods=['POST'])
+@auto.doc()
+def enqueue(module):
+    """
+    Bulk method: POST a json list of IDs of documents that are already stored (e.g. for another module)
+    to add them to the queue of this module without uploading them again.
+    Use ?priority=interactive and ?submitter=<key> as for bulk/process
+    Returns a json list of the ids of unknown documents, which should be posted with bulk/process
 
+    :param module: The module name
+    """
+    try:
+        get_module(module)  # check if module exists
+    except UnknownModuleError as e:
+        return str(e), 404
+    reset_error = request.args.get('reset_error', False) in ('1', 'Y', 'True')
+    reset_pending = request.args.get('reset_pending', False) in ('1', 'Y', 'True')
+    try:
+        ids = _get_json()
+        if not ids:
+            raise ValueError("Empty request")
+    except:
+        return "Error: Please provive bulk IDs as a json list\nd ", 400
+    try:
+        unknown = app.client.enqueue(module, ids, reset_error=reset_error, reset_pending=reset_pending,
+                                     priority=request.args.get("priority"), submitter=request.args.get("submitter"))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    return jsonify(unknown)
+
+
+@app.route('/api/modules/<module>/requeue', methods=['POST'])
+@auto.doc()
+def requeue(module):
+    """
+    Admin method: put failed or stalled tasks back on the queue, using the stored input documents.
+    Use ?status=ERROR (default) and/or ?status=STARTED, ?older_than=<seconds> to only requeue tasks that have
+    had their status at least that long, and ?message=<regex> to only requeue matching errors.
+    Optionally POST a json list of IDs to only requeue those tasks.
+    Returns a json list of the requeued ids
 
+    :param module: The module name
+    """
+    try:
+        get_module(module)  # check if module exists
+    except UnknownModuleError as e:
+        return str(e), 404
+    status = request.args.getlist('status') or ['ERROR']
+    older_than = request.args.get('older_than', None)
+    message = request.args.get('message', None)
+    try:
+        ids = _get_json() if _get_data() else None
+        older_than = None if older_than is None else float(older_than)
+        requeued = app.client.requeue(module, status=status, ids=ids, older_than=older_than, message=message)
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    return jsonify(requeued)
+
+
+@app.route('/api/modules/<module>/changes', methods=['GET'])
+@auto.doc()
+def changes(module):
+    """
+    GET the tasks that were completed (DONE or ERROR) since a cursor, for incrementally harvesting results.
+    Use ?since=<cursor> (default 0: all changes), ?limit=<n> (default 1000) and ?results=1 to include the results.
+    Returns a json dict with a list of changes {id, status, cursor} and the cursor to use for the next request
+
+    :param module: The module name
+    """
+    try:
+        get_module(module)  # check if module exists
+    except UnknownModuleError as e:
+        return str(e), 404
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', 1000))
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    changes = app.client.changes(module, since=since, limit=limit, results=_flag('results'))
+    return jsonify(changes=changes, cursor=changes[-1]['cursor'] if changes else since)
+
+
+@app.route('/api/events', methods=['GET'])
+@auto.doc()
+def events():
+    """
+    GET a stream of task status changes as server-sent events (text/event-stream), each event being a json dict
+    {id, module, status, submitter}. Use ?module=<name> and/or ?submitter=<name> (repeatable) to filter the events.
+    The stream follows the change logs of the modules, so it contains the changes of all server processes and workers
+    """
+    modules = request.args.getlist('module') or None
+    submitters = request.args.getlist('submitter') or None
+    for module in modules or []:
+        try:
+            get_module(module)  # check if module exists
+        except UnknownModuleError as e:
+            return str(e), 404
+
+    events = app.client.events(modules, submitters, timeout=EVENT_KEEPALIVE)
+
+    def stream():
+        yield ": connected\n\n"
+        for event in events:
+            if event is None:
+                yield ": keepalive\n\n"  # a comment, so proxies and clients don't time out the connection
+            else:
+                yield "data: {}\n\n".format(json.dumps(event))
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/api/modules/<module>/reprocess', methods=['POST'])
+@auto.doc()
+def reprocess(module):
+    """
+    POST to queue the documents with a stale result (produced by an older version or configuration of the module)
+    to be processed again, as low priority batch tasks. Optionally POST a json list of IDs to only reprocess those.
+    Returns a json list of the queued ids
+
+    :param module: The module name
+    """
+    try:
+        get_module(module)  # check if module exists
+    except UnknownModuleError as e:
+        return str(e), 404
+    try:
+        ids = _get_json() if _get_data() else None
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    try:
+        return jsonify(app.client.reprocess(module, ids=ids))
+    except ValueError as e:  # the input documents are not stored
+        return "Error: {e}\n".format(**locals()), 409
+
+
+@app.route('/api/pipelines/<pipeline>/', methods=['POST'])
+@auto.doc()
+def post_pipeline_task(pipeline):
+    """
+    POST a new document to be processed by a pipeline (see nlpipe.pipeline).
+    The result of each module is queued for the next module(s) on the server.
+    Accepts the same ?id=, ?priority= and ?submitter= options as posting a task to a module.
+    Response will be an empty HTTP 202 response with Location and ID headers
+
+    :param pipeline: The pipeline name
+    """
+    try:
+        id = app.client.process_pipeline(pipeline, _get_data(), id=request.args.get("id"),
+                                         priority=request.args.get("priority"),
+                                         submitter=request.args.get("submitter"))
+    except UnknownPipelineError as e:
+        return str(e), 404
+    except ValueError as e:
+        return "Error: {e}\n".format(**locals()), 400
+    resp = Response(id+"\n", status=202)
+    resp.headers['Location'] = '/api/pipelines/{pipeline}/{id}'.format(**locals())
+    resp.headers['ID'] = id
+    return resp
+
+
+@app.route('/api/pipelines/<pipeline>/<id>', methods=['GET'])
+@auto.doc()
+def pipeline_status(pipeline, id):
+    """
+    GET the status of a document in each module of the pipeline as a json {module: status} dict
+
+    :param pipeline: The pipeline name
+    :param id: ID of the document
+    """
+    try:
+        return jsonify(app.client.pipeline_status(pipeline, id))
+    except UnknownPipelineError as e:
+        return str(e), 404
+
+
+def serve(setup, host="localhost", port=5001, processes=1, threads=DEFAULT_THREADS, timeout=120):
+    """
+    Serve the app with a pre-forking gunicorn server, requires gunicorn (pip install gunicorn)
+    :param setup: Function that configures the app (see configure). It is called in every worker process after it
+                  is forked, so the master holds no client state that (re)started workers would inherit
+    :param processes: Number of worker processes, e.g. the number of cores
+    :param threads: Threads per process, each open request (including event streams) occupies a thread
+    :param timeout: Restart a worker process that has not responded for this many seconds
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise ValueError("Serving with multiple processes requires gunicorn, use e.g. pip install gunicorn")
+    options = dict(bind="{host}:{port}".format(**locals()), workers=processes, threads=threads, timeout=timeout,
+                   worker_class="gthread", preload_app=False)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            client = setup()
+            if isinstance(client, SegmentClient):
+                raise ValueError(SEGMENTS_GUNICORN)
+            return app
+
+    Server().run()
+
+
+def configure(directory, store="files", compression=None, weights=None, chunk_size=None, pipelines=(),
+              keep_documents=True):
+    """
+    Set up the client that the app serves from, see the command line options below for the parameters.
+    The segment store is kept in memory by a single process, so it cannot be served with gunicorn (see serve)
+    :return: the client (app.client)
+    """
+    compression = parse_compression(compression)
+    if store == "segments":
+        app.client = SegmentClient(directory, compression=compression)
+    else:
+        app.client = FSClient(directory, compression=compression)
+    if weights:
+        app.client.submitter_weights = {k: float(v) for (k, v) in (w.split("=") for w in weights.split(","))}
+    app.client.chunk_size = chunk_size
+    app.client.keep_documents = keep_documents
+    for spec in pipelines:
+        register_pipeline(parse_pipeline(spec))
+    return app.client
 
 
 if __name__ == '__main__':
@@ -217,6 +608,28 @@ if __name__ == '__main__':
     parser.add_argument("--port", "-p", type=int, default=5001,
                         help="Port number to listen to (default: $NLPIPE_PORT or 5001)")
     parser.add_argument("--host", "-H", help="Host address to listen on (default: $NLPIPE_HOST or localhost)")
+    parser.add_argument("--store", "-s", choices=["files", "segments"], default="files",
+                        help="Storage backend: one file per document (default) or append-only segment files")
+    parser.add_argument("--weights", help="Share of the workers per submitter, e.g. groupA=2,groupB=1 "
+                                          "(submitters that are not listed have weight 1)")
+    parser.add_argument("--chunk-size", type=int,
+                        help="Split documents larger than this many characters on paragraph boundaries and process "
+                             "the chunks in parallel (for modules that can merge the results)")
+    parser.add_argument("--pipeline", action="append", default=[],
+                        help="Register a pipeline of modules that are run in order, e.g. naf=alpinonerc,my_module "
+                             "(can be given multiple times)")
+    parser.add_argument("--release-documents", dest="keep_documents", action="store_false",
+                        help="Remove documents once no module has them pending, started or failed. By default "
+                             "they are kept, so they can be enqueued for other modules and stale results can be "
+                             "reprocessed")
+    parser.add_argument("--compression", "-c",
+                        help="Compress stored documents and results: gzip or zstd for all modules, or e.g. "
+                             "corenlp_parse=zstd,alpinonerc=gzip (default: $NLPIPE_COMPRESSION)")
+    parser.add_argument("--processes", "-P", type=int,
+                        help="Serve with gunicorn using this many processes, e.g. the number of cores "
+                             "(default: the single process development server)")
+    parser.add_argument("--threads", "-T", type=int, default=DEFAULT_THREADS,
+                        help="Threads per gunicorn process (default: {})".format(DEFAULT_THREADS))
     parser.add_argument("--debug", "-d", help="Set debug mode (implies -v)", action="store_true")
     parser.add_argument("--verbose", "-v", help="Verbose (debug) output", action="store_true")
     args = parser.parse_args()
@@ -233,7 +646,25 @@ if __name__ == '__main__':
         else:
             tempdir = tempfile.TemporaryDirectory(prefix="nlpipe_")
             args.directory = tempdir.name
-    app.client = FSClient(args.directory)
+    if args.store == "segments" and args.workers is not None:
+        parser.error("The segment store can only be used by the server process, "
+                     "run workers separately with python -m nlpipe.worker http://{host}:{port} ..."
+                     .format(**locals()))
+    if args.store == "segments" and args.processes:
+        parser.error(SEGMENTS_GUNICORN)
+    if args.processes and args.workers is not None:
+        parser.error("Workers cannot be run in a multi-process server, "
+                     "run them separately with python -m nlpipe.worker {args.directory} ...".format(**locals()))
+
+    def setup():
+        return configure(args.directory, store=args.store, compression=args.compression, weights=args.weights,
+                         chunk_size=args.chunk_size, pipelines=args.pipeline, keep_documents=args.keep_documents)
+
+    if args.processes:
+        logging.debug("Serving from {args.directory}".format(**locals()))
+        serve(setup, host, port, processes=args.processes, threads=args.threads)
+        sys.exit()
+    setup()
 
     if args.workers is not None:
         module_names = args.workers or [m.name for m in known_modules()]
@@ -241,4 +672,4 @@ if __name__ == '__main__':
         run_workers(app.client, module_names)
 
     logging.debug("Serving from {args.directory}".format(**locals()))
-    app.run(port=port, host=host, debug=args.debug)
+    app.run(port=port, host=host, debug=args.debug, threaded=True)  # event streams keep their thread busy
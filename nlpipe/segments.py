@@ -0,0 +1,527 @@
+"""
+Append-only segment storage for NLPipe
+
+Instead of one file per document and result (as in FSClient), all documents and results are appended to large
+segment files in <result_dir>/_segments, and an in-memory index maps (module, status, id) to the location of the data.
+Status transitions (e.g. PENDING -> STARTED) only append a small record, and the index is rebuilt by replaying
+the segments when the store is opened.
+
+Superseded data (e.g. a document after its result is stored) is reclaimed by compaction: when enough garbage has
+accumulated, a background thread copies all live data to new segments and removes the old ones.
+
+The index lives in the memory of a single process, so a segment store can only be opened by one process at a time
+(the restserver). Workers should connect to it over HTTP.
+"""
+import fcntl
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+
+from nlpipe.client import FSClient, DOCUMENTS, LANE, TEXT
+from nlpipe.compression import decompress
+from nlpipe.module import known_modules
+
+# Record operations
+_PUT, _MOVE, _DELETE, _LINK = 1, 2, 3, 4
+# Record header: operation, key length, value length, crc32 of key+value
+_HEADER = struct.Struct("<BHQI")
+
+_SEGMENT_RE = re.compile(r"^(\d{8})\.(\d{4})\.seg$")
+
+
+def _key(module, status, id):
+    return "\0".join([module, status, str(id)]).encode("utf-8")
+
+
+def _unkey(key):
+    return tuple(key.decode("utf-8").split("\0"))
+
+
+def _document_status(format):
+    """Documents are stored as pseudo-module DOCUMENTS, with a pseudo-status per format (see client.TEXT)"""
+    return "DOCUMENT" if format == TEXT else "DOCUMENT." + format
+
+
+class _Entry(object):
+    """Location of a stored document or result. The same entry object is kept when it moves to another status"""
+    __slots__ = ("segment", "offset", "length", "size", "mtime")
+
+    def __init__(self, segment, offset, length, size, mtime=None):
+        self.segment, self.offset, self.length = segment, offset, length
+        self.size = size  # size of the record including header and key
+        # time of the last put or move (after replaying, the modification time of the segment file)
+        self.mtime = time.time() if mtime is None else mtime
+
+
+class SegmentStore(object):
+    """
+    Key-value store of (module, status, id) -> bytes with append-only segment files.
+    All methods are thread-safe.
+    """
+
+    def __init__(self, directory, segment_size=256 * 1024 * 1024, compact_ratio=0.5,
+                 compact_min_bytes=64 * 1024 * 1024, compact_interval=60):
+        """
+        :param directory: Directory for the segment files
+        :param segment_size: Start a new segment when the current segment is larger than this
+        :param compact_ratio: Compact when more than this fraction of the stored bytes is garbage
+        :param compact_min_bytes: ... and there are at least this many bytes of garbage
+        :param compact_interval: Seconds between checks in the background compaction thread (None to disable)
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.compact_ratio = compact_ratio
+        self.compact_min_bytes = compact_min_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._lockfile = open(os.path.join(directory, "LOCK"), "w")
+        try:
+            fcntl.flock(self._lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise Exception("Segment store {directory} is in use by another process".format(**locals()))
+
+        self._lock = threading.RLock()
+        self._compacting = threading.Lock()
+        self._index = {}  # (module, status) : OrderedDict(id : _Entry), in order of insertion
+        self._readers = {}  # segment name : file descriptor
+        self._maps = {}  # segment name : memoryview of the memory-mapped (sealed) segment
+        self._size = {}  # segment name : bytes
+        self._live = 0  # total bytes of the records of live entries
+        for name in self._segments():
+            self._replay(name)
+        self._open_writer(self._next_segment())
+
+        self._closed = threading.Event()
+        if compact_interval:
+            t = threading.Thread(target=self._compaction_loop, args=(compact_interval,), daemon=True)
+            t.start()
+
+    # ---- segment files ----
+
+    def _segments(self):
+        """Names of all segment files in replay order"""
+        return sorted(fn for fn in os.listdir(self.directory) if _SEGMENT_RE.match(fn))
+
+    def _next_segment(self, compacted=False):
+        """Get a new segment name, sorting after all existing segments (or after all replaced segments if compacted)"""
+        names = self._segments()
+        if not names:
+            return "00000001.0000.seg"
+        number, sub = map(int, _SEGMENT_RE.match(names[-1]).groups())
+        if compacted:
+            return "{:08d}.{:04d}.seg".format(number, sub + 1)
+        return "{:08d}.0000.seg".format(number + 1)
+
+    def _open_writer(self, name):
+        self._writer_name = name
+        self._writer = open(os.path.join(self.directory, name), "ab")
+        self._size.setdefault(name, 0)
+
+    def _reader(self, segment):
+        fd = self._readers.get(segment)
+        if fd is None:
+            fd = self._readers[segment] = os.open(os.path.join(self.directory, segment), os.O_RDONLY)
+        return fd
+
+    def _append(self, op, key, value=b"", writer=None, name=None):
+        """Append a record, returning a pair of (offset of the value, size of the record)"""
+        if writer is None:
+            if self._writer.tell() >= self.segment_size:
+                self._writer.close()
+                self._open_writer(self._next_segment())
+            writer, name = self._writer, self._writer_name
+        header = _HEADER.pack(op, len(key), len(value), zlib.crc32(value, zlib.crc32(key)))
+        offset = writer.tell() + _HEADER.size + len(key)
+        writer.write(header + key + value)
+        writer.flush()
+        size = _HEADER.size + len(key) + len(value)
+        self._size[name] = self._size.get(name, 0) + size
+        return offset, size
+
+    def _replay(self, name):
+        """Rebuild the index from the records in the given segment"""
+        fn = os.path.join(self.directory, name)
+        mtime = os.stat(fn).st_mtime
+        self._size[name] = 0
+        with open(fn, "rb") as f:
+            while True:
+                pos = f.tell()
+                header = f.read(_HEADER.size)
+                if not header:
+                    break
+                valid = len(header) == _HEADER.size
+                if valid:
+                    op, keylen, valuelen, crc = _HEADER.unpack(header)
+                    key = f.read(keylen)
+                    value, check = self._read_value(f, valuelen, zlib.crc32(key), keep=op in (_MOVE, _LINK))
+                    valid = len(key) == keylen and check == crc
+                if not valid:
+                    logging.warning("Truncating incomplete or corrupt record at {fn}:{pos}".format(**locals()))
+                    with open(fn, "r+b") as w:
+                        w.truncate(pos)
+                    break
+                size = _HEADER.size + keylen + valuelen
+                self._size[name] += size
+                module, status, id = _unkey(key)
+                if op == _PUT:
+                    self._set(module, status, id, _Entry(name, pos + _HEADER.size + keylen, valuelen, size, mtime))
+                elif op == _MOVE:
+                    entry = self._rekey(module, status, id, *_unkey(value))
+                    if entry is not None:
+                        entry.mtime = mtime
+                elif op == _DELETE:
+                    self._remove(module, status, id)
+                elif op == _LINK:
+                    self._link(module, status, id, _unkey(value), size, mtime)
+
+    @staticmethod
+    def _read_value(f, length, crc, keep, bufsize=1024 * 1024):
+        """
+        Read the value of a record in blocks to check its crc, returning the pair (value if keep else None, crc).
+        The crc is None if the value is cut short
+        """
+        value = []
+        while length > 0:
+            block = f.read(min(length, bufsize))
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            length -= len(block)
+            if keep:
+                value.append(block)
+        if length > 0:
+            crc = None
+        return (b"".join(value) if keep else None), crc
+
+    # ---- index ----
+
+    def _ids(self, module, status):
+        ids = self._index.get((module, status))
+        if ids is None:
+            ids = self._index[module, status] = OrderedDict()
+        return ids
+
+    def _peek(self, module, status):
+        """Like _ids, but don't create an entry in the index (so it is safe to call without holding the lock)"""
+        return self._index.get((module, status), {})
+
+    def _set(self, module, status, id, entry):
+        self._remove(module, status, id)
+        self._ids(module, status)[id] = entry
+        self._live += entry.size
+
+    def _remove(self, module, status, id):
+        entry = self._ids(module, status).pop(id, None)
+        if entry is not None:
+            self._live -= entry.size
+        return entry
+
+    def _rekey(self, module, status, id, to_module, to_status, to_id):
+        entry = self._remove(module, status, id)
+        if entry is not None:
+            self._set(to_module, to_status, to_id, entry)
+        return entry
+
+    def _link(self, module, status, id, to, size, mtime=None):
+        entry = self._ids(module, status).get(id)
+        if entry is not None:
+            self._set(*to, entry=_Entry(entry.segment, entry.offset, entry.length, size, mtime))
+        return entry
+
+    @property
+    def garbage(self):
+        """
+        Total bytes of superseded data and status transition records.
+        Linked data is counted with the entry that stored it, so this is an estimate if that entry was removed
+        """
+        return sum(self._size.values()) - self._live
+
+    # ---- public interface ----
+
+    def put(self, module, status, id, data: bytes):
+        with self._lock:
+            offset, size = self._append(_PUT, _key(module, status, id), data)
+            self._set(module, status, id, _Entry(self._writer_name, offset, len(data), size))
+
+    def get(self, module, status, id) -> bytes:
+        with self._lock:
+            entry = self._ids(module, status).get(id)
+            if entry is None:
+                raise FileNotFoundError("{module}/{status}/{id}".format(**locals()))
+            # read while holding the lock, as compaction closes the readers of the segments it removes
+            return os.pread(self._reader(entry.segment), entry.length, entry.offset)
+
+    def view(self, module, status, id) -> memoryview:
+        """
+        Get the data as a memoryview into the memory-mapped segment, without copying it.
+        Data in the segment that is currently being written is read with get() instead.
+        """
+        with self._lock:
+            entry = self._ids(module, status).get(id)
+            if entry is None:
+                raise FileNotFoundError("{module}/{status}/{id}".format(**locals()))
+            if entry.segment == self._writer_name:
+                return memoryview(self.get(module, status, id))
+            view = self._maps.get(entry.segment)
+            if view is None:
+                mapped = mmap.mmap(self._reader(entry.segment), 0, access=mmap.ACCESS_READ)
+                view = self._maps[entry.segment] = memoryview(mapped)
+            return view[entry.offset:entry.offset + entry.length]
+
+    def move(self, module, id, from_status, to_status):
+        with self._lock:
+            if id not in self._ids(module, from_status):
+                raise FileNotFoundError("{module}/{from_status}/{id}".format(**locals()))
+            self._append(_MOVE, _key(module, from_status, id), _key(module, to_status, id))
+            entry = self._rekey(module, from_status, id, module, to_status, id)
+            entry.mtime = time.time()
+
+    def link(self, module, status, id, to_module, to_status, to_id):
+        """Make the data of an existing item also available under another key, without copying it"""
+        with self._lock:
+            if id not in self._ids(module, status):
+                raise FileNotFoundError("{module}/{status}/{id}".format(**locals()))
+            to = (to_module, to_status, to_id)
+            _, size = self._append(_LINK, _key(module, status, id), _key(*to))
+            self._link(module, status, id, to, size)
+
+    def delete(self, module, status, id):
+        with self._lock:
+            if id not in self._ids(module, status):
+                raise FileNotFoundError("{module}/{status}/{id}".format(**locals()))
+            self._append(_DELETE, _key(module, status, id))
+            self._remove(module, status, id)
+
+    def exists(self, module, status, id) -> bool:
+        return id in self._peek(module, status)
+
+    def oldest(self, module, status):
+        with self._lock:
+            return next(iter(self._ids(module, status)), None)
+
+    def count(self, module, status) -> int:
+        return len(self._peek(module, status))
+
+    def statuses(self, module) -> list:
+        """Get the statuses for which the given module has items"""
+        with self._lock:
+            return [status for ((m, status), ids) in self._index.items() if m == module and ids]
+
+    def ids(self, module, status) -> list:
+        with self._lock:
+            return list(self._peek(module, status))
+
+    def length(self, module, status, id) -> int:
+        """Length in bytes of the stored value of the given item"""
+        entry = self._peek(module, status).get(id)
+        if entry is None:
+            raise FileNotFoundError("{module}/{status}/{id}".format(**locals()))
+        return entry.length
+
+    def mtime(self, module, status, id) -> float:
+        """Time of the last put or move of the given item"""
+        entry = self._peek(module, status).get(id)
+        if entry is None:
+            raise FileNotFoundError("{module}/{status}/{id}".format(**locals()))
+        return entry.mtime
+
+    def location(self, module, status, id):
+        """Get a sortable (segment, offset) location for the given item, for reading in storage order"""
+        entry = self._peek(module, status).get(id)
+        return ("", 0) if entry is None else (entry.segment, entry.offset)
+
+    def close(self):
+        self._closed.set()
+        with self._compacting, self._lock:
+            self._writer.close()
+            for fd in self._readers.values():
+                os.close(fd)
+            self._readers.clear()
+            self._maps.clear()
+            self._lockfile.close()
+
+    # ---- compaction ----
+
+    def needs_compaction(self) -> bool:
+        total = sum(self._size.values())
+        return self.garbage >= self.compact_min_bytes and self.garbage > total * self.compact_ratio
+
+    def _compaction_loop(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                if self.needs_compaction():
+                    self.compact()
+            except:
+                logging.exception("Error on compacting segments in {self.directory}".format(**locals()))
+
+    def compact(self):
+        """
+        Copy all live data to new segments and remove the old segments.
+        New writes go to a fresh segment while the (unlocked) copy is running; the compacted segments are named
+        so they are replayed after the old segments but before any segment written during compaction.
+        """
+        with self._compacting:
+            with self._lock:
+                old = [name for name in self._segments()]
+                self._writer.close()
+                compacted = self._next_segment(compacted=True)
+                # writes during compaction go to a new numbered segment, which sorts after the compacted ones
+                self._open_writer(self._next_segment())
+                live = [(module, status, id, entry) for ((module, status), ids) in self._index.items()
+                        for (id, entry) in ids.items()]
+            live.sort(key=lambda item: (item[3].segment, item[3].offset))
+            logging.info("Compacting {} segments with {} live items".format(len(old), len(live)))
+
+            copied = []  # (entry, new segment, new offset, new size)
+            stored = {}  # (old segment, old offset) : (key, new segment, new offset) of data that was copied
+            writer = open(os.path.join(self.directory, compacted), "ab")
+            for module, status, id, entry in live:
+                if writer.tell() >= self.segment_size:
+                    writer.close()
+                    compacted = "{}.{:04d}.seg".format(compacted[:8], int(compacted[9:13]) + 1)
+                    writer = open(os.path.join(self.directory, compacted), "ab")
+                key = _key(module, status, id)
+                location = (entry.segment, entry.offset)
+                if location in stored:
+                    # linked data (e.g. a shared document) is copied once, the other keys are linked to it
+                    source, segment, offset = stored[location]
+                    _, size = self._append(_LINK, source, key, writer=writer, name=compacted)
+                    copied.append((entry, segment, offset, size))
+                    continue
+                with self._lock:
+                    data = os.pread(self._reader(entry.segment), entry.length, entry.offset)
+                offset, size = self._append(_PUT, key, data, writer=writer, name=compacted)
+                stored[location] = (key, compacted, offset)
+                copied.append((entry, compacted, offset, size))
+            writer.close()
+
+            with self._lock:
+                for entry, segment, offset, size in copied:
+                    entry.size = size  # entries that moved in the meantime are the same object
+                # re-point all entries by location rather than only the copied entry objects, so entries that were
+                # linked to copied data during compaction are moved as well; deleted entries are simply garbage
+                for ids in self._index.values():
+                    for entry in ids.values():
+                        new = stored.get((entry.segment, entry.offset))
+                        if new is not None:
+                            entry.segment, entry.offset = new[1], new[2]
+                self._live = sum(entry.size for ids in self._index.values() for entry in ids.values())
+                for name in old:
+                    if name == self._writer_name:
+                        continue
+                    fd = self._readers.pop(name, None)
+                    if fd is not None:
+                        os.close(fd)
+                    # views handed out earlier keep the mapping (and so the removed file's data) alive
+                    self._maps.pop(name, None)
+                    os.remove(os.path.join(self.directory, name))
+                    del self._size[name]
+
+
+class SegmentClient(FSClient):
+    """
+    NLPipe client that stores documents and results in append-only segment files (see nlpipe.segments)
+    """
+
+    def __init__(self, result_dir, compression=None, **kargs):
+        """
+        :param result_dir: The storage directory, segments are stored in <result_dir>/_segments
+        :param compression: See FSClient
+        :param kargs: Additional options for SegmentStore (e.g. segment_size)
+        """
+        self.store = SegmentStore(os.path.join(result_dir, "_segments"), **kargs)
+        super().__init__(result_dir, compression=compression)
+
+    def _check_dirs(self, module):
+        pass
+
+    def _write(self, module, status, id, doc):
+        self.store.put(module, status, str(id), self._encode(module, doc))
+
+    def _read_raw(self, module, status, id):
+        return self.store.get(module, status, str(id))
+
+    def _open(self, module, status, id):
+        return BytesIO(self._read_raw(module, status, id))
+
+    def _buffer(self, module, status, id):
+        return decompress(self.store.view(module, status, str(id)))
+
+    def _link(self, module, status, id, to_id):
+        self.store.link(module, status, str(id), module, status, str(to_id))
+
+    def _move(self, module, id, from_status, to_status):
+        self.store.move(module, str(id), from_status, to_status)
+
+    def _delete(self, module, status, id):
+        self.store.delete(module, status, str(id))
+
+    def _exists(self, module, status, id):
+        return self.store.exists(module, status, str(id))
+
+    def _oldest(self, module, status):
+        return self.store.oldest(module, status)
+
+    def _size(self, module, status, id):
+        return self.store.length(module, status, str(id))
+
+    def _etag(self, module, status, id):
+        if not self.store.exists(module, status, str(id)):
+            raise FileNotFoundError("{module}/{status}/{id}".format(**locals()))
+        # every put appends a new record, so its location identifies the stored value (compaction moves it)
+        segment, offset = self.store.location(module, status, str(id))
+        return "{segment}-{offset:x}".format(**locals())
+
+    def _count(self, module, status):
+        return self.store.count(module, status)
+
+    def _list(self, module, status):
+        return self.store.ids(module, status)
+
+    def _lanes(self, module):
+        return [status[len(LANE):] for status in self.store.statuses(module) if status.startswith(LANE)]
+
+    def _age(self, module, status, id):
+        return time.time() - self.store.mtime(module, status, str(id))
+
+    def _has_document(self, id, format=TEXT):
+        return self.store.exists(DOCUMENTS, _document_status(format), str(id))
+
+    def _read_document(self, id, format=TEXT):
+        return decompress(self.store.get(DOCUMENTS, _document_status(format), str(id)))
+
+    def _write_document(self, id, data, format=TEXT):
+        self.store.put(DOCUMENTS, _document_status(format), str(id), data)
+
+    def _link_document(self, module, status, id, format=TEXT):
+        self.store.link(DOCUMENTS, _document_status(format), str(id), module, status, str(id))
+
+    def _delete_document(self, id, format=TEXT):
+        self.store.delete(DOCUMENTS, _document_status(format), str(id))
+
+    def _document_in_use(self, id, format=TEXT):
+        # links are separate index entries, so check whether any module has a task (that may be linked) for the id
+        return any(self.store.exists(module.name, status, str(id)) for module in known_modules()
+                   for status in ('PENDING', 'STARTED', 'ERROR_DOCUMENT'))
+
+    def bulk_result(self, module, ids, format=None):
+        # read in storage order so reading a whole set is (mostly) sequential i/o
+        ids = list(ids)
+        results = {id: self.result(module, id, format=format) for id in self._storage_order(module, ids)}
+        return {id: results[id] for id in ids}
+
+    def bulk_export(self, module, ids, format="parquet"):
+        return super().bulk_export(module, self._storage_order(module, ids), format=format)
+
+    def _storage_order(self, module, ids):
+        """Sort the ids by the location of their result, so reading a whole set is (mostly) sequential i/o"""
+        return sorted(ids, key=lambda id: self.store.location(module, 'DONE', str(id)))
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,134 @@
+"""
+Column-oriented token table shared by the module converters
+
+Converters append values to the column lists of a TokenTable instead of building and writing a row per token,
+and the csv, json and columnar (arrow) serializations are all derived from the table.
+"""
+import json
+import re
+import sys
+from typing import Iterable, List, Sequence, Tuple
+
+# Low-cardinality string columns: interned when tables are combined and dictionary encoded in arrow
+DICTIONARY_COLUMNS = {"lemma", "pos", "POS", "pos1", "ner", "rel", "relation", "morphofeat", "chunk"}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ValueError("Exporting to parquet or arrow requires pyarrow, use e.g. pip install pyarrow")
+    return pyarrow
+
+
+def _intern(values):
+    intern = sys.intern
+    return [v if v is None else intern(v) for v in values]
+
+
+# Characters that require a csv field to be quoted (as csv.QUOTE_MINIMAL with the default excel dialect)
+_CSV_SPECIAL = re.compile(r'[",\r\n]')
+
+
+def _csv_field(value) -> str:
+    if value is None:
+        return ""
+    value = str(value)
+    if _CSV_SPECIAL.search(value):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _csv_column(values: list, type: str) -> List[str]:
+    """Format the values of a column as csv fields, checking the whole column at once for the common cases"""
+    if None in values:
+        return [_csv_field(v) for v in values]
+    if type == "int":
+        return list(map(str, values))
+    try:
+        if not _CSV_SPECIAL.search("".join(values)):
+            return values  # strings that need no quoting
+    except TypeError:
+        pass  # not all values are strings, e.g. integer document ids
+    return [_csv_field(v) for v in values]
+
+
+class TokenTable(object):
+    """
+    A table of tokens stored as one python list per column.
+    Fill it by appending to the lists in table.data (in the order of table.columns), e.g.:
+
+    table = TokenTable(module.columns)
+    doc, sentence, ... = table.data
+    for token in tokens:
+        doc.append(id)
+        ...
+    """
+
+    def __init__(self, columns: Sequence[Tuple[str, str]]):
+        """
+        :param columns: sequence of (name, type) pairs with type 'str' or 'int', see Module.columns
+        """
+        self.columns = list(columns)
+        self.names = [name for (name, _type) in self.columns]
+        self.data = [[] for _ in self.columns]
+
+    @classmethod
+    def from_columns(cls, columns: Sequence[Tuple[str, str]], data: Sequence[list]) -> "TokenTable":
+        """Create a table from a list of values per column (in the order of columns), the lists are not copied"""
+        table = cls(columns)
+        if len(data) != len(table.columns) or len({len(values) for values in data}) > 1:
+            raise ValueError("Expected {} columns of equal length".format(len(table.columns)))
+        table.data = list(data)
+        return table
+
+    def __len__(self):
+        return len(self.data[0]) if self.data else 0
+
+    def column(self, name: str) -> list:
+        """Get the list of values for the given column"""
+        return self.data[self.names.index(name)]
+
+    def rows(self) -> Iterable[tuple]:
+        """Iterate over the rows of the table as tuples"""
+        return zip(*self.data)
+
+    def extend(self, other: "TokenTable"):
+        """Append the rows of another table with the same columns, interning low-cardinality strings"""
+        if other.names != self.names:
+            raise ValueError("Cannot combine tables with columns {} and {}".format(self.names, other.names))
+        for name, column, values in zip(self.names, self.data, other.data):
+            column.extend(_intern(values) if name in DICTIONARY_COLUMNS else values)
+
+    def to_csv(self) -> str:
+        """Serialize as csv (as csv.writer would), formatting the fields a column at a time"""
+        fields = [_csv_column(values, type) for ((_name, type), values) in zip(self.columns, self.data)]
+        lines = [",".join(_csv_field(name) for name in self.names)]
+        lines.extend(map(",".join, zip(*fields)))
+        lines.append("")
+        return "\r\n".join(lines)
+
+    def to_json(self) -> str:
+        """Serialize as a json dict of {column: [values]}"""
+        return json.dumps(dict(zip(self.names, self.data)))
+
+    def to_arrow(self):
+        """Convert to a pyarrow.Table, with int64 columns for ints and dictionary encoded categorical strings"""
+        pa = _pyarrow()
+        arrays = []
+        for (name, type), values in zip(self.columns, self.data):
+            if type == "int":
+                arrays.append(pa.array(values, type=pa.int64()))
+            elif name in DICTIONARY_COLUMNS:
+                arrays.append(pa.array(values, type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(values, type=pa.string()))
+        return pa.Table.from_arrays(arrays, names=self.names)
+
+    def convert(self, format: str) -> str:
+        """Serialize the table as 'csv' or 'json'"""
+        if format == "csv":
+            return self.to_csv()
+        if format == "json":
+            return self.to_json()
+        raise ValueError("Token tables cannot be converted to {format}".format(**locals()))
@@ -19,24 +19,26 @@ class Worker(Process):
 
     sleep_timeout = 1
 
-    def __init__(self, client, module):
+    def __init__(self, client, module, sizes=None):
         """
         :param client: a Client object to connect to the NLP Server
+        :param sizes: Only process documents of these size classes (see nlpipe.client.SIZE_CLASSES)
         """
         super().__init__()
         self.client = client
         self.module = module
+        self.sizes = sizes
 
     def run(self):
         while True:
-            id, doc = self.client.get_task(self.module.name)
+            id, doc = self.client.get_task(self.module.name, sizes=self.sizes)
             if id is None:
                 time.sleep(self.sleep_timeout)
                 continue
             logging.info("Received task {self.module.name}/{id} ({n} bytes)".format(n=len(doc), **locals()))
             try:
                 result = self.module.process(doc)
-                self.client.store_result(self.module.name, id, result)
+                self.client.store_result(self.module.name, id, result, fingerprint=self.module.fingerprint())
                 logging.debug("Succesfully completed task {self.module.name}/{id} ({n} bytes)"
                               .format(n=len(result), **locals()))
             except Exception as e:
@@ -56,12 +58,13 @@ def _import(name):
     return result
 
 
-def run_workers(client: Client, modules: Iterable[str], nprocesses:int=1) -> Iterable[Worker]:
+def run_workers(client: Client, modules: Iterable[str], nprocesses:int=1, sizes=None) -> Iterable[Worker]:
     """
     Run the given workers as separate processes
     :param client: a nlpipe.client.Client object
     :param modules: names of the modules (module name or fully qualified class name)
     :param nprocesses: Number of processes per module
+    :param sizes: Only process documents of these size classes, e.g. ['large'] on a machine with more memory
     """
     # import built-in workers
     import nlpipe.modules
@@ -74,7 +77,7 @@ def run_workers(client: Client, modules: Iterable[str], nprocesses:int=1) -> Ite
             module = get_module(module_class)
         for i in range(1, nprocesses+1):
             logging.debug("[{i}/{nprocesses}] Starting worker {module}".format(**locals()))
-            Worker(client=client, module=module).start()
+            Worker(client=client, module=module, sizes=sizes).start()
         result.append(module)
 
     logging.info("Workers active and waiting for input")
@@ -87,6 +90,8 @@ if __name__ == '__main__':
     parser.add_argument("modules", nargs="+", help="Class names of module(s) to run")
     parser.add_argument("--verbose", "-v", help="Verbose (debug) output", action="store_true", default=False)
     parser.add_argument("--processes", "-p", help="Number of processes per worker", type=int, default=1)
+    parser.add_argument("--sizes", "-s", nargs="+", choices=[name for (name, _bound) in client.SIZE_CLASSES],
+                        help="Only process (batch) documents of these size classes")
 
     args = parser.parse_args()
 
@@ -94,4 +99,4 @@ if __name__ == '__main__':
                         format='[%(asctime)s %(name)-12s %(levelname)-5s] %(message)s')
     
     client = client.get_client(args.server)
-    run_workers(client, args.modules, nprocesses=args.processes)
+    run_workers(client, args.modules, nprocesses=args.processes, sizes=args.sizes)
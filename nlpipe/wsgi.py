@@ -0,0 +1,36 @@
+"""
+WSGI entry point for serving NLPipe with a production server such as gunicorn or uwsgi, e.g.:
+
+NLPIPE_DIR=/data/nlpipe gunicorn --workers 8 --threads 8 --bind 0.0.0.0:5001 nlpipe.wsgi:app
+
+(or python -m nlpipe.restserver --processes 8, see restserver.serve). The server is configured with environment
+variables, see the restserver command line options for their meaning:
+
+NLPIPE_DIR: storage directory (required)
+NLPIPE_STORE: 'files' (the segment store cannot be served with gunicorn, see restserver.SEGMENTS_GUNICORN)
+NLPIPE_COMPRESSION: compression codec(s)
+NLPIPE_WEIGHTS: submitter weights, e.g. groupA=2,groupB=1
+NLPIPE_CHUNK_SIZE: document size above which documents are chunked
+NLPIPE_PIPELINES: pipelines separated by semicolons, e.g. naf=alpinonerc,srl;ner=frog,my_ner
+NLPIPE_KEEP_DOCUMENTS: set to 0 to remove processed documents (see --release-documents)
+
+The file store can be shared by any number of processes (and workers) as it only relies on atomic file system
+operations. Scheduling state (the fair share of submitters and the deduplication statistics) is kept per process,
+so with multiple processes the shares are approximate. The event stream (/api/events) follows the change logs in the
+file store, so it contains the changes of all processes.
+"""
+import os
+
+from nlpipe.restserver import SEGMENTS_GUNICORN, app, configure
+
+if "NLPIPE_DIR" not in os.environ:
+    raise ValueError("Please set NLPIPE_DIR to the NLPipe storage directory")
+if os.environ.get("NLPIPE_STORE", "files") != "files":
+    raise ValueError(SEGMENTS_GUNICORN)
+
+configure(os.environ["NLPIPE_DIR"],
+          compression=os.environ.get("NLPIPE_COMPRESSION"),
+          weights=os.environ.get("NLPIPE_WEIGHTS"),
+          chunk_size=int(os.environ["NLPIPE_CHUNK_SIZE"]) if os.environ.get("NLPIPE_CHUNK_SIZE") else None,
+          pipelines=[p for p in os.environ.get("NLPIPE_PIPELINES", "").split(";") if p],
+          keep_documents=os.environ.get("NLPIPE_KEEP_DOCUMENTS", "1") != "0")
@@ -21,7 +21,6 @@ setup(
         "Flask",
         "requests",
         "pynlpl",
-        "corenlp_xml>=1.0.4",
         "amcatclient>=3.4.5",
         "flask-autodoc",
         "KafNafParserPy",
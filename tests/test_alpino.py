@@ -49,6 +49,13 @@ def test_interpret_parse():
     assert_equal(tokens[1], (1, 1, 1, 'is', 'ben', 'V', 'hd', None))
 
 
+def test_merge():
+    merged = AlpinoParser().merge([(0, _PARSE), (12, _PARSE)])
+    tokens = list(interpret_parse(merged))
+    assert_equal([token[:2] for token in tokens], [(0, 1), (1, 1), (2, 1), (3, 2), (4, 2), (5, 2)])
+    assert_equal(tokens[3][-2:], ("su", 4))
+
+
 def test_convert():
     p = AlpinoParser()
     check_status(p)
@@ -0,0 +1,54 @@
+"""
+Test the Alpino NAF (alpinonerc) module and the streaming NAF reader
+"""
+import csv
+from io import StringIO
+
+from nose.tools import assert_equal
+
+from nlpipe.modules.alpinonaf import AlpinoNERCParser
+from nlpipe.modules.naf import TERM_COLUMNS, read_terms
+
+_NAF = """<?xml version='1.0' encoding='UTF-8'?>
+<NAF xml:lang="nl" version="v3">
+  <nafHeader>
+    <linguisticProcessors layer="terms"><lp name="alpino" version="1"/></linguisticProcessors>
+  </nafHeader>
+  <raw><![CDATA[Toob is dik]]></raw>
+  <text>
+    <wf id="w1" offset="0" length="4" sent="1" para="1">Toob</wf>
+    <wf id="w2" offset="5" length="2" sent="1" para="1">is</wf>
+    <wf id="w3" offset="8" length="3" sent="1" para="1">dik</wf>
+  </text>
+  <terms>
+    <term id="t1" type="open" lemma="Toob" pos="name" morphofeat="name(PER)"><span><target id="w1"/></span></term>
+    <term id="t2" type="open" lemma="ben" pos="verb" morphofeat="verb(copula)"><span><target id="w2"/></span></term>
+    <term id="t3" type="open" lemma="dik" pos="adj" morphofeat="adj"><span><target id="w3"/></span></term>
+  </terms>
+  <entities>
+    <entity id="e1" type="PER"><references><span><target id="t1"/></span></references></entity>
+  </entities>
+  <deps>
+    <dep from="t2" to="t1" rfunc="hd/su"/>
+    <dep from="t2" to="t3" rfunc="hd/predc"/>
+  </deps>
+</NAF>
+"""
+
+
+def test_read_terms():
+    terms = read_terms(_NAF)
+    assert_equal(set(terms), set(TERM_COLUMNS))
+    assert_equal(len(terms["token_id"]), 3)
+    assert_equal([terms[name][0] for name in TERM_COLUMNS],
+                 ["w1", 0, 1, 1, "Toob", "t1", "Toob", "name", "t2", "hd/su"])
+    assert_equal([terms[name][1] for name in TERM_COLUMNS], ["w2", 5, 1, 1, "is", "t2", "ben", "verb", None, None])
+
+
+def test_convert():
+    tokens = list(csv.DictReader(StringIO(AlpinoNERCParser().convert(123, _NAF, "csv"))))
+    assert_equal(len(tokens), 3)
+    assert_equal(tokens[0], {"id": "123", "token_id": "w1", "offset": "0", "sentence": "1", "para": "1",
+                             "word": "Toob", "term_id": "t1", "lemma": "Toob", "pos": "name", "pos1": "M",
+                             "parent": "t2", "relation": "su"})
+    assert_equal(tokens[1]['parent'], "")
@@ -0,0 +1,72 @@
+import asyncio
+import threading
+from tempfile import TemporaryDirectory
+from unittest import SkipTest
+
+from nose.tools import assert_equal
+from werkzeug.serving import make_server
+
+from nlpipe.client import FSClient, ServerError
+from nlpipe.restserver import app
+from nlpipe.modules.test_upper import TestUpper
+from tests.tools import FlakyApp
+
+
+def _async_client(url, **kargs):
+    try:
+        from nlpipe.asyncclient import AsyncHTTPClient
+        return AsyncHTTPClient(url, **kargs)
+    except ValueError as e:
+        raise SkipTest(e)
+
+
+def test_async_client():
+    m = "test_upper"
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        flaky = FlakyApp(app, fail=[])
+        server = make_server("localhost", 0, flaky, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        progress = []
+        c = _async_client("http://localhost:{}".format(server.server_port),
+                          progress=lambda done, total: progress.append((done, total)))
+        c.batch_size, c.parallel, c.retry_wait = 3, 2, 0
+
+        async def run():
+            async with c:
+                id = await c.process(m, "a test")
+                assert_equal(await c.status(m, id), "PENDING")
+                task = await c.get_task(m)
+                assert_equal(task, (id, "a test"))
+                await c.store_result(m, id, task[1].upper())
+                assert_equal(await c.result(m, id), "A TEST")
+                assert_equal(await c.get_task(m), (None, None))
+
+                # the bulk methods send batches of 3 documents concurrently
+                docs = ["doc {}".format(i) for i in range(10)]
+                ids = await c.bulk_process(m, docs)
+                assert_equal(len(ids), 10)
+                assert_equal(len(progress), 4)  # the batches can finish in any order
+                assert_equal(progress[-1], (10, 10))
+                assert_equal(set((await c.bulk_status(m, ids)).values()), {"PENDING"})
+                for _ in ids:
+                    id, doc = await c.get_task(m)
+                    await c.store_result(m, id, doc.upper())
+                assert_equal(await c.bulk_result(m, ids), {id: doc.upper() for (id, doc) in zip(ids, docs)})
+
+                # failed batches are retried, except when they reset tasks
+                flaky.fail = {flaky.n + 1}
+                assert_equal(len(await c.bulk_status(m, ids)), 10)
+                flaky.fail = {flaky.n + 1}
+                n = flaky.n
+                try:
+                    await c.bulk_process(m, docs[:1], reset_error=True)
+                except ServerError:
+                    pass
+                else:
+                    raise AssertionError("ServerError not raised")
+                assert_equal(flaky.n, n + 1)
+        try:
+            asyncio.get_event_loop().run_until_complete(run())
+        finally:
+            server.shutdown()
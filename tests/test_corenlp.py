@@ -1,8 +1,11 @@
-from nose.tools import assert_in, assert_equal
-from nlpipe.modules.corenlp import CoreNLPLemmatizer
+from nose.tools import assert_in, assert_equal, assert_raises
+from nlpipe.modules.corenlp import CoreNLPLemmatizer, CoreNLPParser
 from tests.tools import check_status
 from io import StringIO
 import csv
+import json
+from unittest import TestCase
+from xml.etree import ElementTree
 
 
 def test_process():
@@ -20,3 +23,119 @@ def test_process():
     assert_equal(len(tokens), 2)
     assert_equal(tokens[1]['lemma'], "word")
     
+
+_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<root>
+  <document>
+    <sentences>
+      <sentence id="1">
+        <tokens>
+          <token id="1">
+            <word>John</word><lemma>John</lemma>
+            <CharacterOffsetBegin>0</CharacterOffsetBegin><CharacterOffsetEnd>4</CharacterOffsetEnd>
+            <POS>NNP</POS><NER>PERSON</NER>
+          </token>
+          <token id="2">
+            <word>sleeps</word><lemma>sleep</lemma>
+            <CharacterOffsetBegin>5</CharacterOffsetBegin><CharacterOffsetEnd>11</CharacterOffsetEnd>
+            <POS>VBZ</POS><NER>O</NER>
+          </token>
+        </tokens>
+        <dependencies type="basic-dependencies">
+          <dep type="root"><governor idx="0">ROOT</governor><dependent idx="2">sleeps</dependent></dep>
+          <dep type="dep"><governor idx="2">sleeps</governor><dependent idx="1">John</dependent></dep>
+        </dependencies>
+        <dependencies type="collapsed-ccprocessed-dependencies">
+          <dep type="root"><governor idx="0">ROOT</governor><dependent idx="2">sleeps</dependent></dep>
+          <dep type="nsubj"><governor idx="2">sleeps</governor><dependent idx="1">John</dependent></dep>
+        </dependencies>
+      </sentence>
+      <sentence id="2">
+        <tokens>
+          <token id="1">
+            <word>He</word><lemma>he</lemma>
+            <CharacterOffsetBegin>13</CharacterOffsetBegin><CharacterOffsetEnd>15</CharacterOffsetEnd>
+            <POS>PRP</POS><NER>O</NER>
+          </token>
+        </tokens>
+      </sentence>
+    </sentences>
+    <coreference>
+      <coreference>
+        <mention representative="true"><sentence>1</sentence><start>1</start><end>2</end><head>1</head></mention>
+        <mention><sentence>2</sentence><start>1</start><end>2</end><head>1</head></mention>
+      </coreference>
+    </coreference>
+  </document>
+</root>
+"""
+
+
+def test_convert():
+    """Test converting CoreNLP xml to csv (does not need a CoreNLP server)"""
+    tokens = list(csv.reader(StringIO(CoreNLPParser().convert(1, _XML, format="csv"))))
+    assert_equal(tokens, [["doc", "sentence", "id", "offset", "word", "lemma", "POS", "pos1", "ner", "relation", "parent"],
+                          ["1", "1", "1", "0", "John", "John", "NNP", "R", "PERSON", "nsubj", "2"],
+                          ["1", "1", "2", "5", "sleeps", "sleep", "VBZ", "V", "O", "", ""],
+                          ["1", "2", "1", "13", "He", "he", "PRP", "O", "O", "", ""]])
+
+    tokens = list(csv.reader(StringIO(CoreNLPLemmatizer().convert(1, _XML, format="csv"))))
+    assert_equal(tokens, [["id", "sentence", "offset", "word", "lemma", "POS", "pos1", "ner"],
+                          ["1", "1", "0", "John", "John", "NNP", "R", "PERSON"],
+                          ["1", "1", "5", "sleeps", "sleep", "VBZ", "V", "O"],
+                          ["1", "2", "13", "He", "he", "PRP", "O", "O"]])
+
+
+def test_convert_invalid():
+    """Test that xml parse errors are logged and raised"""
+    with TestCase().assertLogs(level="ERROR"):
+        assert_raises(ElementTree.ParseError, CoreNLPParser().convert, 1, "<root><document>", format="csv")
+
+
+_JSON = {"sentences": [
+    {"index": 0,
+     "tokens": [{"index": 1, "word": "John", "lemma": "John", "characterOffsetBegin": 0, "characterOffsetEnd": 4,
+                 "pos": "NNP", "ner": "PERSON"},
+                {"index": 2, "word": "sleeps", "lemma": "sleep", "characterOffsetBegin": 5, "characterOffsetEnd": 11,
+                 "pos": "VBZ", "ner": "O"}],
+     "basicDependencies": [{"dep": "ROOT", "governor": 0, "dependent": 2},
+                           {"dep": "dep", "governor": 2, "dependent": 1}],
+     "enhancedPlusPlusDependencies": [{"dep": "ROOT", "governor": 0, "dependent": 2},
+                                      {"dep": "nsubj", "governor": 2, "dependent": 1}]},
+    {"index": 1,
+     "tokens": [{"index": 1, "word": "He", "lemma": "he", "characterOffsetBegin": 13, "characterOffsetEnd": 15,
+                 "pos": "PRP", "ner": "O"}]}]}
+
+
+def test_convert_json():
+    """Test that json output gives the same csv as xml output"""
+    for c in CoreNLPParser(output_format="json"), CoreNLPLemmatizer(output_format="json"):
+        assert_equal(c.properties["outputFormat"], "json")
+        assert_equal(c.convert(1, json.dumps(_JSON), format="csv"), c.convert(1, _XML, format="csv"))
+
+
+def test_convert_buffer():
+    """Test converting results from bytes and buffers, parsed in (small) chunks"""
+    from nlpipe import buffers
+    chunk_size, buffers.CHUNK_SIZE = buffers.CHUNK_SIZE, 16
+    try:
+        c = CoreNLPParser()
+        expected = c.convert(1, _XML, format="csv")
+        assert_equal(c.convert(1, _XML.encode("utf-8"), format="csv"), expected)
+        assert_equal(c.convert(1, memoryview(_XML.encode("utf-8")), format="csv"), expected)
+        assert_equal(c.convert(1, memoryview(json.dumps(_JSON).encode("utf-8")), format="csv"), expected)
+    finally:
+        buffers.CHUNK_SIZE = chunk_size
+
+
+def test_merge():
+    """Test merging the results of two chunks (the same document twice, the second one at offset 100)"""
+    for c in CoreNLPParser(), CoreNLPParser(output_format="json"):
+        result = _XML if c.properties["outputFormat"] == "xml" else json.dumps(_JSON)
+        merged = c.merge([(0, result), (100, result)])
+        tokens = list(csv.reader(StringIO(c.convert(1, merged, format="csv"))))
+        assert_equal([row[1:4] for row in tokens[1:]], [["1", "1", "0"], ["1", "2", "5"], ["2", "1", "13"],
+                                                        ["3", "1", "100"], ["3", "2", "105"], ["4", "1", "113"]])
+        assert_equal(tokens[4][-2:], ["nsubj", "2"])
+    merged = CoreNLPParser().merge([(0, _XML), (100, _XML)])
+    assert_in("<mention><sentence>4</sentence>", merged)
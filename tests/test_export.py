@@ -0,0 +1,84 @@
+"""
+Test exporting results as a columnar (parquet/arrow) file
+"""
+import json
+from tempfile import TemporaryDirectory
+from unittest import SkipTest
+
+from nose.tools import assert_equal, assert_in
+
+from nlpipe.client import FSClient
+from nlpipe.module import Module
+from nlpipe.restserver import app
+from nlpipe.tokens import TokenTable
+
+_FROG = ('sentence,offset,word,lemma,morphofeat,ner,chunk\n'
+         '1,0,dit,dit,"VNW(aanw,pron,stan,vol,3o,ev)",O,B-NP\n'
+         '1,3,is,zijn,"WW(pv,tgw,ev)",O,B-VP\n')
+
+
+class TestTokens(Module):
+    """Gives a token table with the result as offset, which should be an int"""
+    name = "test_tokens"
+    columns = [("id", "str"), ("offset", "int")]
+
+    def tokens(self, id, result):
+        result = bytes(result).decode("utf-8")
+        if result == "error":
+            raise Exception("Cannot parse result")
+        return TokenTable.from_columns(self.columns, [[id], [result if result == "x" else int(result)]])
+
+TestTokens.register()
+
+
+def _pyarrow():
+    try:
+        import pyarrow, pyarrow.parquet
+    except ImportError:
+        raise SkipTest("pyarrow not installed")
+    return pyarrow
+
+
+def test_bulk_export():
+    pa = _pyarrow()
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        for id in "1", "2":
+            c._write("frog", "DONE", id, _FROG)
+
+        table = pa.parquet.read_table(pa.BufferReader(c.bulk_export("frog", ["1", "2"])))
+        assert_equal(table.num_rows, 4)
+        assert_equal(table.column("id").to_pylist(), ["1", "1", "2", "2"])
+        assert_equal(table.schema.field("offset").type, pa.int64())
+        assert_equal(table.schema.field("lemma").type, pa.dictionary(pa.int32(), pa.string()))
+        assert_equal(table.column("pos").to_pylist(), ["O", "V", "O", "V"])
+
+        table = pa.ipc.open_file(pa.BufferReader(c.bulk_export("frog", ["1"], format="arrow"))).read_all()
+        assert_equal(table.column("lemma").to_pylist(), ["dit", "zijn"])
+
+        # integer ids (as used by nlpamcat) are exported as strings
+        table = pa.parquet.read_table(pa.BufferReader(c.bulk_export("frog", [1, 2])))
+        assert_equal(table.column("id").to_pylist(), ["1", "1", "2", "2"])
+
+        app.client = c
+        x = app.test_client().post("/api/modules/frog/bulk/export?format=parquet", data=json.dumps(["2"]))
+        assert_equal(x.status_code, 200)
+        assert_equal(pa.parquet.read_table(pa.BufferReader(x.data)).num_rows, 2)
+
+
+def test_export_errors():
+    _pyarrow()
+    with TemporaryDirectory() as dir:
+        app.client = FSClient(dir)
+        for id, result in ("1", "1"), ("2", "x"), ("3", "error"):
+            app.client._write("test_tokens", "DONE", id, result)
+        client = app.test_client()
+        x = client.post("/api/modules/test_tokens/bulk/export", data=json.dumps(["1"]))
+        assert_equal(x.status_code, 200)
+        # results that cannot be converted give a bad request that names the document
+        x = client.post("/api/modules/test_tokens/bulk/export", data=json.dumps(["1", "2"]))
+        assert_equal(x.status_code, 400)
+        assert_in("document 2", x.data.decode("utf-8"))  # not an int offset, so pyarrow cannot convert it
+        x = client.post("/api/modules/test_tokens/bulk/export", data=json.dumps(["1", "3"]))
+        assert_equal(x.status_code, 400)
+        assert_in("test_tokens/3", x.data.decode("utf-8"))
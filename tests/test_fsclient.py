@@ -3,11 +3,21 @@ import time
 import os.path
 import json
 
-from nose.tools import assert_equal, assert_true, assert_false
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
 
 from nlpipe.client import FSClient, get_id
+from nlpipe.compression import detect_file
 from nlpipe import modules
 
+
+def test_get_id():
+    id = get_id("a document")
+    assert_equal(get_id("a document".encode("utf-8")), id)
+    # hashes are passed through, whether they are str or bytes
+    assert_equal(get_id(id), id)
+    assert_equal(get_id(id.encode("utf-8")), id)
+
+
 def test_pipeline():
     with TemporaryDirectory() as dir:
         c = FSClient(dir)
@@ -46,3 +56,402 @@ def test_pipeline():
         # Retrieve results in different format
         result = c.result(m, id1, format='json')
         assert_equal(json.loads(result), {'id': id1, 'result': 'THIS IS A TEST', 'status': 'OK'})
+
+
+def test_compression():
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir, compression={"test_upper": "gzip"})
+        m = "test_upper"
+        id = c.process(m, "This is a test")
+        assert_equal(open(c._filename(m, 'PENDING', id), 'rb').read()[:2], b"\x1f\x8b")
+        assert_equal(c.get_task(m), (id, "This is a test"))
+        c.store_result(m, id, "THIS IS A TEST")
+        assert_equal(c.result(m, id), "THIS IS A TEST")
+        with c.result_file(m, id) as f:
+            assert_equal(detect_file(f), "gzip")
+
+        # uncompressed files in the same store can still be read
+        c.compression = None
+        id2 = c.process(m, "Another test")
+        assert_equal(open(c._filename(m, 'PENDING', id2), 'rb').read(), b"Another test")
+        assert_equal(c.get_task(m), (id2, "Another test"))
+
+
+def test_result_buffer():
+    from tests.test_corenlp import _XML
+    from nlpipe.segments import SegmentClient
+    m = "corenlp_parse"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), FSClient(dir, compression="gzip"), SegmentClient(dir, compact_interval=None, segment_size=1):
+            id = c.process(m, "John sleeps. He ...")
+            c.get_task(m)
+            c.store_result(m, id, _XML)
+            assert_equal(bytes(c.result_buffer(m, id)), _XML.encode("utf-8"))
+            assert_equal(c.result(m, id, format="csv"), modules.corenlp.CoreNLPParser().convert(id, _XML, "csv"))
+        c.close()  # segment_size=1 seals each segment after one record, so the result was memory-mapped
+
+
+def test_result_buffer_restore():
+    """A memory-mapped result stays readable when the result is stored again"""
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir, compression={})
+        id = c.process(m, "a test " * 1000)
+        c.get_task(m)
+        c.store_result(m, id, "A TEST " * 1000)
+        buffer = c.result_buffer(m, id)
+        assert_true(isinstance(buffer, memoryview))
+        c.store_result(m, id, "a")
+        assert_equal(bytes(buffer), ("A TEST " * 1000).encode("utf-8"))
+        assert_equal(c.result(m, id), "a")
+        assert_equal(c._list(m, 'DONE'), [id])
+
+
+def test_shared_documents():
+    from nlpipe.segments import SegmentClient
+    m1, m2 = "test_upper", "corenlp_lemmatize"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            id = c.process(m1, "This is a test")
+            assert_equal(c.enqueue(m2, [id, "unknown"]), ["unknown"])
+            assert_equal(c.status(m2, id), "PENDING")
+            assert_equal(c.get_task(m2), (id, "This is a test"))
+            # enqueueing again does not reset the task
+            assert_equal(c.enqueue(m2, [id]), [])
+            assert_equal(c.status(m2, id), "STARTED")
+
+            # documents are stored per format, and an explicit id used for another document gets its own copy
+            c.process(m1, "<NAF>...</NAF>", id="123")
+            c.process(m1, "plain text", id="456")
+            c.process(m2, "other text", id="456")
+            assert_equal(c.get_task(m1)[1], "This is a test")
+            assert_equal(c.get_task(m1), ("123", "<NAF>...</NAF>"))
+            assert_equal(c.get_task(m1), ("456", "plain text"))
+            assert_equal(c.get_task(m2), ("456", "other text"))
+            # the NAF document is not enqueued for plain text input
+            assert_equal(c.enqueue(m2, ["123"]), ["123"])
+
+        # with the file store, tasks are hard links to the shared document
+        c = FSClient(dir)
+        assert_equal(os.stat(c._document_filename(id)).st_ino, os.stat(c._filename(m2, "STARTED", id)).st_ino)
+
+
+def test_release_documents():
+    from nlpipe.segments import SegmentClient
+    m1, m2 = "test_upper", "corenlp_lemmatize"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            c.keep_documents = False
+            id = c.process(m1, "This is a test")
+            c.enqueue(m2, [id])
+            c.store_result(m1, c.get_task(m1)[0], "THIS IS A TEST")
+            assert_equal(c._has_document(id), True)  # still pending for the second module
+            c.store_error(m2, c.get_task(m2)[0], "Error")
+            assert_equal(c._has_document(id), True)  # kept for requeueing
+            c.requeue(m2)
+            c.store_result(m2, c.get_task(m2)[0], "result")
+            assert_equal(c._has_document(id), False)
+
+            del c.keep_documents  # documents are kept by default
+            id = c.process(m1, "Another test")
+            c.store_result(m1, c.get_task(m1)[0], "ANOTHER TEST")
+            assert_equal(c.enqueue(m2, [id]), [])
+
+
+def test_requeue():
+    from nlpipe.segments import SegmentClient
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            ids = [c.process(m, "doc {}".format(i)) for i in range(4)]
+            tasks = [c.get_task(m) for _ in range(4)]
+            c.store_error(m, tasks[0][0], "Timeout")
+            c.store_error(m, tasks[1][0], "Parse error")
+            c.store_result(m, tasks[2][0], "DOC 2")
+
+            if isinstance(c, FSClient) and not isinstance(c, SegmentClient):
+                # a task is started when it is claimed, not when its (possibly shared) file was written
+                os.utime(c._filename(m, "STARTED", tasks[3][0]), (0, 0))
+            assert_equal(c.requeue(m, older_than=3600), [])
+            assert_raises(ValueError, c.requeue, m, message="(")
+            assert_equal(c.requeue(m, message="^Time"), [tasks[0][0]])
+            assert_equal(c.status(m, tasks[0][0]), "PENDING")
+            assert_equal(sorted(c.requeue(m, status=["ERROR", "STARTED"])), sorted([tasks[1][0], tasks[3][0]]))
+            assert_equal(dict(c.statistics(m)), {"PENDING": 3, "STARTED": 0, "DONE": 1, "ERROR": 0,
+                                                "PENDING:default": 3, "PENDING@small": 3})
+            # the original documents are requeued
+            assert_equal(sorted(c.get_task(m)[1] for _ in range(3)), ["doc 0", "doc 1", "doc 3"])
+
+            # requeued tasks keep their submitter
+            id = c.process(m, "doc 4", submitter="groupA")
+            c.get_task(m)
+            c.store_error(m, id, "Timeout")
+            assert_equal(c.requeue(m, ids=[id]), [id])
+            assert_equal(dict(c.statistics(m))["PENDING:groupA"], 1)
+            c.get_task(m)
+            assert_equal(c.requeue(m, status="STARTED", ids=[id]), [id])
+            assert_equal(dict(c.statistics(m))["PENDING:groupA"], 1)
+
+
+def test_priority():
+    from nlpipe.segments import SegmentClient
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            batch = []
+            for i in range(5):
+                batch.append(c.process(m, "batch {}".format(i)))
+                time.sleep(0.01)  # file system client orders tasks by modification time
+            urgent = c.process(m, "urgent", priority="interactive")
+            assert_equal(c.get_task(m), (urgent, "urgent"))
+            # an already pending task can be moved to the interactive lane
+            c.process(m, "batch 3", priority="interactive")
+            assert_equal(c.get_task(m), (batch[3], "batch 3"))
+            assert_equal(c.get_task(m), (batch[0], "batch 0"))
+
+            # starvation guard: every batch_every-th task is taken from the batch lane
+            c.batch_every, c._claims = 2, 0
+            time.sleep(0.01)
+            urgent = [c.process(m, "urgent {}".format(i), priority="interactive") for i in range(2)]
+            assert_equal([c.get_task(m)[0] for _ in range(3)], [urgent[0], batch[1], urgent[1]])
+
+
+def test_fair_share():
+    from nlpipe.segments import SegmentClient
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            big = [c.process(m, "big {}".format(i), submitter="big") for i in range(6)]
+            small = [c.process(m, "small {}".format(i), submitter="small") for i in range(2)]
+            stats = dict(c.statistics(m))
+            assert_equal((stats["PENDING"], stats["PENDING:big"], stats["PENDING:small"]), (8, 6, 2))
+
+            # tasks are claimed in turn for each submitter, even though the big submitter was first
+            claimed = [c.get_task(m)[1].split()[0] for _ in range(6)]
+            assert_equal(claimed, ["big", "small", "big", "small", "big", "big"])
+            assert_equal(dict(c.statistics(m))["PENDING:big"], 2)
+
+            # weights give a submitter a larger share
+            c.submitter_weights = {"small": 2}
+            small = [c.process(m, "small {}".format(i), submitter="small") for i in range(2, 6)]
+            claimed = [c.get_task(m)[1].split()[0] for _ in range(6)]
+            assert_equal(claimed, ["big", "small", "small", "big", "small", "small"])
+
+
+def test_size_classes():
+    from nlpipe.segments import SegmentClient
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            docs = ["large " * 50000, "medium " * 5000, "small 0", "small 1"]
+            ids = []
+            for doc in docs:
+                ids.append(c.process(m, doc))
+                time.sleep(0.01)  # file system client orders tasks by modification time
+            large, medium = ids[:2]
+            stats = dict(c.statistics(m))
+            assert_equal((stats["PENDING@small"], stats["PENDING@medium"], stats["PENDING@large"]), (2, 1, 1))
+
+            # a worker for large documents only gets the large task
+            assert_equal(c.get_task(m, sizes=["large"])[0], large)
+            assert_equal(c.get_task(m, sizes=["large"]), (None, None))
+            # other workers take the smallest documents first
+            assert_equal(c.get_task(m)[1], "small 0")
+            # unless a larger document has waited long enough
+            c.size_aging = 0
+            assert_equal(c.get_task(m)[0], medium)
+            assert_equal(c.get_task(m)[1], "small 1")
+
+
+def test_chunks():
+    from nlpipe.segments import SegmentClient
+    m = "test_upper"
+    doc = "\n\n".join("paragraph {}".format(i) for i in range(5))
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            c.chunk_size = 30
+            id = c.process(m, doc)
+            assert_equal(c.status(m, id), "PENDING")
+            assert_equal(dict(c.statistics(m))["PENDING"], 3)
+            tasks = [c.get_task(m) for _ in range(3)]
+            assert_equal([task[1] for task in tasks], ["paragraph 0\n\nparagraph 1", "paragraph 2\n\nparagraph 3",
+                                                       "paragraph 4"])
+            for task_id, text in reversed(tasks):
+                assert_equal(c.status(m, id), "PENDING")
+                c.store_result(m, task_id, text.upper())
+            assert_equal(c.result(m, id), doc.upper())
+            assert_equal(dict(c.statistics(m)), {"PENDING": 0, "STARTED": 0, "DONE": 1, "ERROR": 0})
+
+            # an error in a chunk is an error of the document, which can be requeued as a whole
+            id = c.process(m, doc + "\n\nfailing")
+            tasks = [c.get_task(m) for _ in range(2)]
+            c.store_error(m, tasks[0][0], "Parse error")
+            assert_equal(c.status(m, id), "ERROR")
+            c.store_result(m, tasks[1][0], "...")
+            assert_equal(dict(c.statistics(m)), {"PENDING": 0, "STARTED": 0, "DONE": 1, "ERROR": 1})
+            assert_equal(c.requeue(m), [id])
+            c.chunk_size = None
+            assert_equal(c.get_task(m), (id, doc + "\n\nfailing"))
+
+            # the chunk size is in characters, also for documents given as bytes
+            c.chunk_size = 30
+            short = ("\u00e9" * 20 + "\n\n" + "\u00e9" * 5).encode("utf-8")
+            id = c.process(m, short)
+            assert_equal(c.get_task(m), (id, short.decode("utf-8")))
+            # a document whose chunks are being merged is reported as STARTED, but cannot be reset
+            c._write(m, 'MERGING', "merging", "[]")
+            assert_equal(c.status(m, "merging"), "STARTED")
+            c.process(m, doc, id="merging", reset_pending=True)
+            assert_equal(c.status(m, "merging"), "STARTED")
+
+
+def test_reprocess():
+    from nlpipe.segments import SegmentClient
+    from nlpipe.modules.test_upper import TestUpper
+    m = "test_upper"
+    try:
+        with TemporaryDirectory() as dir:
+            for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+                c.keep_documents = True
+                TestUpper.version = "1"
+                ids = [c.process(m, "doc {}".format(i)) for i in range(3)]
+                for _ in ids:
+                    id, doc = c.get_task(m)
+                    c.store_result(m, id, doc.upper(), fingerprint=TestUpper().fingerprint())
+                assert_equal(c.reprocess(m), [])
+
+                TestUpper.version = "2"
+                # results are only stale once a worker reports the new version
+                assert_equal(c.status(m, ids[0], stale=True), "DONE")
+                c.process(m, "doc 3")
+                id, doc = c.get_task(m)
+                c.store_result(m, id, doc.upper(), fingerprint=TestUpper().fingerprint())
+                assert_equal(c.status(m, ids[0]), "DONE")
+                assert_equal(c.bulk_status(m, ids[:2], stale=True), {ids[0]: "STALE", ids[1]: "STALE"})
+                assert_equal(c.reprocess(m, ids=ids[:2]), ids[:2])
+                assert_equal(c.reprocess(m), [ids[2]])
+                assert_equal(c.reprocess(m), [])  # already queued
+                # the old result stays available (and the document is DONE) while the document is reprocessed
+                assert_equal(c.status(m, ids[0]), "DONE")
+                assert_equal(c.result(m, ids[0]), "DOC 0")
+                assert_equal(dict(c.statistics(m))["PENDING:reprocess"], 3)
+
+                id, doc = c.get_task(m)
+                c.store_result(m, id, "new", fingerprint=TestUpper().fingerprint())
+                assert_equal(c.status(m, id, stale=True), "DONE")
+                assert_equal(c.result(m, id), "new")
+                # if reprocessing fails, the old result is kept
+                id, doc = c.get_task(m)
+                c.store_error(m, id, "Failed")
+                assert_equal(c.status(m, id), "DONE")
+                assert_equal(c.status(m, id, stale=True), "STALE")
+    finally:
+        TestUpper.version = None
+
+
+def test_reprocess_without_documents():
+    from nlpipe.modules.test_upper import TestUpper
+    m = "test_upper"
+    try:
+        with TemporaryDirectory() as dir:
+            c = FSClient(dir)
+            c.keep_documents = False
+            TestUpper.version = "1"
+            for doc in "doc", "new doc":
+                if doc == "new doc":
+                    TestUpper.version = "2"
+                c.process(m, doc)
+                id, doc = c.get_task(m)
+                c.store_result(m, id, doc.upper(), fingerprint=TestUpper().fingerprint())
+            # the documents were removed after processing, so the stale result cannot be reprocessed
+            assert_raises(ValueError, c.reprocess, m)
+            assert_equal(c.get_task(m), (None, None))
+    finally:
+        TestUpper.version = None
+
+
+def test_dedup():
+    from nlpipe.segments import SegmentClient
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            c.process(m, "an article", id="1")
+            c.process(m, "an article", id="2")  # not done yet, so processed again
+            for _ in range(2):
+                id, doc = c.get_task(m)
+                c.store_result(m, id, doc.upper())
+            # the result of an identical document is reused
+            c.process(m, "an article", id="3")
+            assert_equal(c.status(m, "3"), "DONE")
+            assert_equal(c.result(m, "3"), "AN ARTICLE")
+            assert_equal(c.get_task(m), (None, None))
+            stats = dict(c.statistics(m))
+            assert_equal((stats["DEDUP:hits"], stats["DEDUP:misses"]), (1, 2))
+            # storing a new result for the copy does not change the original
+            c.store_result(m, "3", "changed")
+            assert_equal(c.result(m, "1"), "AN ARTICLE")
+
+            # the result of a document that was submitted without id is reused as well
+            id = c.process(m, "another article")
+            c.store_result(m, c.get_task(m)[0], "ANOTHER ARTICLE")
+            c.process(m, "another article", id="4")
+            assert_equal(c.result(m, "4"), "ANOTHER ARTICLE")
+            assert_equal(c.get_task(m), (None, None))
+            stats = dict(c.statistics(m))
+            assert_equal((stats["DEDUP:hits"], stats["DEDUP:misses"]), (2, 2))
+
+
+def test_changes():
+    from nlpipe.segments import SegmentClient
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(os.path.join(dir, "files")), SegmentClient(os.path.join(dir, "segments"),
+                                                                     compact_interval=None):
+            assert_equal(c.changes(m), [])
+            ids = [c.process(m, "doc {}".format(i)) for i in range(3)]
+            c.store_result(m, c.get_task(m)[0], "DOC 0")
+            c.store_error(m, c.get_task(m)[0], "Error")
+            changes = c.changes(m, results=True)
+            assert_equal([(ch['id'], ch['status'], ch.get('result')) for ch in changes],
+                         [(ids[0], "DONE", "DOC 0"), (ids[1], "ERROR", None)])
+            # continue from the cursor of the last change
+            cursor = changes[-1]['cursor']
+            assert_equal(c.changes(m, since=cursor), [])
+            c.store_result(m, c.get_task(m)[0], "DOC 2")
+            assert_equal([ch['id'] for ch in c.changes(m, since=cursor)], [ids[2]])
+            assert_equal([ch['id'] for ch in c.changes(m, limit=1)], [ids[0]])
+            assert_equal([ch['id'] for ch in c.iter_changes(m, batch=2)], ids)
+
+
+def test_events():
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        events = c.events(submitters=["groupA"], timeout=0)
+        c.process(m, "other")
+        id = c.process(m, "a test", submitter="groupA")
+        c.store_result(m, c.get_task(m)[0], "OTHER")
+        c.store_result(m, c.get_task(m)[0], "A TEST")
+        assert_equal([next(events) for _ in range(4)],
+                     [dict(id=id, module=m, status=status, submitter="groupA")
+                      for status in ("PENDING", "STARTED", "DONE")] + [None])
+
+        # changes made by other clients (e.g. workers with direct file system access in another process) as well
+        worker = FSClient(dir)
+        id = worker.process(m, "another test", submitter="groupA")
+        worker.store_result(m, worker.get_task(m)[0], "ANOTHER TEST")
+        assert_equal([next(events) for _ in range(3)],
+                     [dict(id=id, module=m, status=status, submitter="groupA")
+                      for status in ("PENDING", "STARTED", "DONE")])
+
+
+def test_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    m = "test_upper"
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        ids = {c.process(m, "doc {}".format(i), submitter="s{}".format(i % 3)) for i in range(50)}
+        with ThreadPoolExecutor(8) as pool:
+            claimed = list(pool.map(lambda _: c.get_task(m)[0], range(60)))
+        # every task is claimed exactly once
+        assert_equal(sorted(id for id in claimed if id is not None), sorted(ids))
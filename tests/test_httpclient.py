@@ -0,0 +1,97 @@
+import threading
+import time
+from tempfile import TemporaryDirectory
+
+from nose.tools import assert_equal, assert_raises
+from werkzeug.serving import make_server
+
+from nlpipe.cache import ResultCache
+from nlpipe.client import FSClient, HTTPClient, ServerError
+from nlpipe.restserver import app
+from tests.tools import FlakyApp
+
+
+def _serve(app):
+    server = make_server("localhost", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_bulk_batches():
+    m = "test_upper"
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        flaky = FlakyApp(app, fail=[2])
+        server = _serve(flaky)
+        try:
+            progress = []
+            c = HTTPClient("http://localhost:{}".format(server.server_port),
+                           progress=lambda done, total: progress.append((done, total)))
+            c.batch_size, c.max_batch_bytes, c.parallel, c.retry_wait = 3, 21, 1, 0  # "doc i" is 7 bytes of json
+            docs = ["doc {}".format(i) for i in range(7)] + ["a larger document"]
+            ids = c.bulk_process(m, docs)
+            # batches of 3 documents, except for the larger document; the failed second batch was retried
+            assert_equal(flaky.n, 5)
+            assert_equal(progress, [(3, 8), (6, 8), (7, 8), (8, 8)])
+            assert_equal(ids, [app.client.process(m, doc) for doc in docs])
+            assert_equal(set(c.bulk_status(m, ids).values()), {"PENDING"})
+            for _ in ids:
+                id, doc = app.client.get_task(m)
+                app.client.store_result(m, id, doc.upper())
+            assert_equal(c.bulk_result(m, ids), {id: doc.upper() for (id, doc) in zip(ids, docs)})
+
+            # errors are raised when the retries are exhausted
+            n = flaky.n
+            flaky.fail = set(range(n + 1, n + 10))
+            c.retries = 2
+            assert_raises(ServerError, c.bulk_status, m, ids)
+            assert_equal(flaky.n, n + 3)  # the remaining batches are not sent
+
+            # batches that reset tasks are not retried
+            n = flaky.n
+            assert_raises(ServerError, c.bulk_process, m, docs[:1], reset_error=True)
+            assert_equal(flaky.n, n + 1)
+        finally:
+            server.shutdown()
+
+
+def test_result_cache():
+    m = "test_upper"
+    with TemporaryDirectory() as root, TemporaryDirectory() as cache_dir:
+        app.client = FSClient(root)
+        ids = [app.client.process(m, doc) for doc in ("a", "b")]
+        for _ in ids:
+            id, doc = app.client.get_task(m)
+            app.client.store_result(m, id, doc.upper())
+        server = _serve(app)
+        try:
+            url = "http://localhost:{}".format(server.server_port)
+            cache = ResultCache(cache_dir)
+            c = HTTPClient(url, cache=cache)
+            assert_equal(c.result(m, ids[0]), "A")
+            assert_equal(c.bulk_result(m, ids), {ids[0]: "A", ids[1]: "B"})
+            # results that did not change are taken from the cache
+            for id in ids:
+                etag, _ = cache.get((url, m, id, None))
+                cache.put((url, m, id, None), etag, "cached")
+            assert_equal(c.result(m, ids[0]), "cached")
+            assert_equal(c.bulk_result(m, ids), {ids[0]: "cached", ids[1]: "cached"})
+            # changed results are downloaded again
+            time.sleep(0.01)
+            app.client.store_result(m, ids[0], "A!")
+            assert_equal(c.bulk_result(m, ids), {ids[0]: "A!", ids[1]: "cached"})
+            assert_equal(c.result(m, ids[0]), "A!")
+        finally:
+            server.shutdown()
+
+
+def test_cache_eviction():
+    with TemporaryDirectory() as dir:
+        cache = ResultCache(dir, max_bytes=120)
+        for i in range(3):
+            cache.put(("s", "m", i, None), "etag", "x" * 40)
+            time.sleep(0.01)
+        assert_equal(cache.get(("s", "m", 0, None)), None)
+        assert_equal(cache.get(("s", "m", 2, None)), ("etag", "x" * 40))
+        # reopening the cache keeps the results
+        assert_equal(ResultCache(dir, max_bytes=120).get(("s", "m", 1, None)), ("etag", "x" * 40))
@@ -0,0 +1,84 @@
+import json
+import os.path
+from tempfile import TemporaryDirectory
+
+from nose.tools import assert_equal, assert_raises
+
+from nlpipe.client import FSClient
+from nlpipe.module import Module
+from nlpipe.pipeline import Pipeline, register_pipeline, parse_pipeline
+from nlpipe.restserver import app
+from nlpipe.segments import SegmentClient
+from nlpipe import modules
+
+
+class TestReverse(Module):
+    name = "test_reverse"
+
+    def process(self, text):
+        return text[::-1]
+
+TestReverse.register()
+register_pipeline(Pipeline("test_pipeline", ["test_upper", "test_reverse"]))
+
+
+def test_pipeline():
+    p = Pipeline("naf", {"alpinonerc": ["srl", "coref"], "srl": ["events"]})
+    assert_equal(p.first, ["alpinonerc"])
+    assert_equal(p.modules, ["alpinonerc", "srl", "coref", "events"])
+    assert_equal(p.next("srl"), ["events"])
+    assert_equal(parse_pipeline("x=a,b").next("a"), ["b"])
+    assert_raises(ValueError, Pipeline, "cycle", {"a": ["b"], "b": ["a"]})
+    assert_raises(ValueError, Pipeline, "two parents", {"a": ["c"], "b": ["c"]})
+
+
+def test_handoff():
+    m1, m2 = "test_upper", "test_reverse"
+    with TemporaryDirectory() as dir:
+        for c in FSClient(dir), SegmentClient(os.path.join(dir, "segments"), compact_interval=None):
+            id = c.process_pipeline("test_pipeline", "a test")
+            assert_equal(c.pipeline_status("test_pipeline", id), {m1: "PENDING", m2: "UNKNOWN"})
+            assert_equal(c.get_task(m2), (None, None))
+            c.store_result(m1, id, c.get_task(m1)[1].upper())
+            # the result is queued for the next module directly
+            assert_equal(c.pipeline_status("test_pipeline", id), {m1: "DONE", m2: "PENDING"})
+            assert_equal(c.get_task(m2), (id, "A TEST"))
+            c.store_result(m2, id, "TSET A")
+            assert_equal(c.pipeline_status("test_pipeline", id), {m1: "DONE", m2: "DONE"})
+
+            # documents that were processed by the first module before continue with the existing result
+            id = c.process(m1, "done before")
+            c.store_result(m1, id, c.get_task(m1)[1].upper())
+            c.process_pipeline("test_pipeline", "done before")
+            assert_equal(c.get_task(m2), (id, "DONE BEFORE"))
+
+
+def test_handoff_unregistered():
+    """Workers that did not register the pipeline hand off results with the stages stored with the task"""
+    from nlpipe import pipeline
+    m1, m2 = "test_upper", "test_reverse"
+    with TemporaryDirectory() as dir:
+        c = FSClient(dir)
+        id = c.process_pipeline("test_pipeline", "a test")
+        known, pipeline._known_pipelines = pipeline._known_pipelines, {}
+        try:
+            c.store_result(m1, id, c.get_task(m1)[1].upper())
+        finally:
+            pipeline._known_pipelines = known
+        assert_equal(c.status(m1, id), "DONE")
+        assert_equal(c.get_task(m2), (id, "A TEST"))
+
+
+def test_server():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        client = app.test_client()
+        assert_equal(client.post("/api/pipelines/unknown/", data="test").status_code, 404)
+        res = client.post("/api/pipelines/test_pipeline/", data="test")
+        assert_equal(res.status_code, 202)
+        id = res.headers.get('ID')
+        task = client.get("/api/modules/test_upper/")
+        client.put(task.headers.get('Location'), data=task.data.upper())
+        assert_equal(client.get("/api/modules/test_reverse/").data, b"TEST")
+        status = client.get(res.headers.get('Location'))
+        assert_equal(json.loads(status.data.decode("utf-8")), {"test_upper": "DONE", "test_reverse": "STARTED"})
@@ -0,0 +1,123 @@
+import json
+import os.path
+from tempfile import TemporaryDirectory
+
+from nose.tools import assert_equal, assert_raises
+
+from nlpipe.restserver import app
+from nlpipe.segments import SegmentClient, SegmentStore
+
+
+def test_pipeline():
+    with TemporaryDirectory() as dir:
+        c = SegmentClient(dir, compact_interval=None)
+        m = "test_upper"
+        id1, id2 = c.process(m, "test 1"), c.process(m, "test 2")
+        assert_equal(c.status(m, id1), "PENDING")
+        assert_equal(dict(c.statistics(m))["PENDING"], 2)
+
+        assert_equal(c.get_task(m), (id1, "test 1"))  # fifo
+        assert_equal(c.status(m, id1), "STARTED")
+        c.store_result(m, id1, "TEST 1")
+        assert_equal(c.status(m, id1), "DONE")
+        assert_equal(c.result(m, id1), "TEST 1")
+        assert_equal(c.get_task(m), (id2, "test 2"))
+        c.store_error(m, id2, "Sorry")
+        assert_raises(Exception, c.result, m, id2)
+        assert_equal(c.get_task(m), (None, None))
+        c.close()
+
+        # the index is rebuilt from the segments
+        c = SegmentClient(dir, compact_interval=None)
+        assert_equal(c.status(m, id1), "DONE")
+        assert_equal(c.status(m, id2), "ERROR")
+        assert_equal(c.bulk_result(m, [id1]), {id1: "TEST 1"})
+        c.close()
+
+
+def test_compact():
+    with TemporaryDirectory() as dir:
+        c = SegmentClient(dir, compact_interval=None, segment_size=100)
+        m = "test_upper"
+        ids = [c.process(m, "document {}".format(i) * 10) for i in range(10)]
+        for i in range(10):
+            id, doc = c.get_task(m)
+            if i < 8:
+                c.store_result(m, id, doc.upper())
+        assert c.store.garbage > 0
+        segments = c.store._segments()
+        c.store.compact()
+        assert c.store._segments() != segments
+        assert_equal(c.store.garbage, 0)
+        assert_equal(c.result(m, ids[0]), "DOCUMENT 0" * 10)
+        c.close()
+
+        c = SegmentClient(dir, compact_interval=None)
+        assert_equal(dict(c.statistics(m)), {"PENDING": 0, "STARTED": 2, "DONE": 8, "ERROR": 0})
+        assert_equal(c.result(m, ids[7]), "DOCUMENT 7" * 10)
+        c.close()
+
+
+def test_server():
+    with TemporaryDirectory() as dir:
+        app.client = SegmentClient(dir, compact_interval=None)
+        client = app.test_client()
+        url = "/api/modules/test_upper/"
+        task_url = client.post(url, data="test").headers.get('Location')
+        assert_equal(client.get(url).data, b"test")
+        client.put(task_url, data="TEST")
+        assert_equal(client.get(task_url).data, b"TEST")
+        app.client.close()
+
+
+def test_compact_links():
+    with TemporaryDirectory() as dir:
+        c = SegmentClient(dir, compact_interval=None)
+        id = c.process("test_upper", "shared document " * 100)
+        c.enqueue("corenlp_lemmatize", [id])
+        c.store.compact()
+        # the document is copied once and linked to the other keys
+        assert sum(c.store._size.values()) < 2 * len("shared document " * 100)
+        c.close()
+        c = SegmentClient(dir, compact_interval=None)
+        assert_equal(c.get_task("corenlp_lemmatize"), (id, "shared document " * 100))
+        assert_equal(c.get_task("test_upper"), (id, "shared document " * 100))
+        c.close()
+
+
+def test_torn_record():
+    with TemporaryDirectory() as dir:
+        store = SegmentStore(dir, compact_interval=None)
+        store.put("m", "PENDING", "1", b"a test")
+        store.move("m", "1", "PENDING", "STARTED")
+        store.close()
+        # cut the value of the last record short, as if the server crashed while writing it
+        fn = os.path.join(dir, store._segments()[-1])
+        with open(fn, "r+b") as f:
+            f.truncate(os.path.getsize(fn) - 3)
+        store = SegmentStore(dir, compact_interval=None)
+        assert_equal(store.get("m", "PENDING", "1"), b"a test")
+        assert_equal(store.exists("m", "STARTED", "1"), False)
+        store.close()
+
+
+def test_link_during_compaction():
+    m1, m2 = "test_upper", "corenlp_lemmatize"
+    with TemporaryDirectory() as dir:
+        c = SegmentClient(dir, compact_interval=None)
+        id = c.process(m1, "a test")
+        store, append = c.store, c.store._append
+
+        def link_while_copying(op, key, value=b"", writer=None, name=None):
+            if writer is not None and not store.exists(m2, 'PENDING', id):
+                store.link(m1, 'PENDING', id, m2, 'PENDING', id)
+            return append(op, key, value, writer=writer, name=name)
+        store._append = link_while_copying
+        store.compact()
+        store._append = append
+        assert_equal(c.get_task(m2), (id, "a test"))
+        c.close()
+        c = SegmentClient(dir, compact_interval=None)
+        assert_equal(c.status(m2, id), "STARTED")
+        assert_equal(c.get_task(m1), (id, "a test"))
+        c.close()
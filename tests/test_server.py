@@ -1,9 +1,10 @@
 import json
+import time
 from tempfile import TemporaryDirectory
 
 from nlpipe.client import FSClient, get_id
 from nlpipe.restserver import app, ERROR_MIME
-from nose.tools import assert_equal, assert_raises
+from nose.tools import assert_equal, assert_raises, assert_true
 
 from nlpipe.modules.test_upper import TestUpper
 
@@ -116,3 +117,176 @@ def test_bulk():
         # test process without id
         ids = post_json("bulk/process", ["test1", "test2"])
         assert_equal(len(ids), 2)
+
+        # documents are only uploaded once for multiple modules, also after they were processed
+        res = client.post("/api/modules/corenlp_lemmatize/bulk/enqueue", data=json.dumps([todo, id1, "unknown"]))
+        assert_equal(json.loads(res.data.decode('UTF-8')), ["unknown"])
+        assert_equal(app.client.bulk_status("corenlp_lemmatize", [todo, id1]), {todo: "PENDING", id1: "PENDING"})
+
+        # failed tasks can be requeued without uploading them again
+        while client.get(url_base).status_code == 200:
+            pass
+        client.put(url_base + todo, data="sorry", headers={"Content-Type": ERROR_MIME})
+        assert_equal(json.loads(client.post(url_base + "requeue?message=other").data.decode('UTF-8')), [])
+        assert_equal(client.post(url_base + "requeue?message=%28").status_code, 400)
+        assert_equal(json.loads(client.post(url_base + "requeue?message=sor%2By").data.decode('UTF-8')), [todo])
+        assert_equal(app.client.status("test_upper", todo), "PENDING")
+
+
+def test_priority():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        client = app.test_client()
+        url = "/api/modules/test_upper/"
+        client.post(url, data="batch")
+        assert_equal(client.post(url + "?priority=urgent", data="urgent").status_code, 400)
+        id = client.post(url + "?priority=interactive", data="urgent").headers.get('ID')
+        assert_equal(client.get(url).headers.get('ID'), id)
+        assert_equal(client.get(url + "?sizes=huge").status_code, 400)
+        assert_equal(client.get(url + "?sizes=medium,large").status_code, 404)
+
+
+def test_reprocess():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        app.client.keep_documents = True
+        client = app.test_client()
+        url = "/api/modules/test_upper/"
+        task_url = client.post(url, data="test").headers.get('Location')
+        client.get(url)
+        client.put(task_url, data="TEST", headers={"Fingerprint": "1:abc"})
+        assert_equal(client.head(task_url + "?stale=1").headers.get('Status'), "DONE")
+        # results are stale once a worker reports another version, even if the server's module has no version
+        new_url = client.post(url, data="new").headers.get('Location')
+        client.get(url)
+        client.put(new_url, data="NEW", headers={"Fingerprint": "2:abc"})
+        assert_equal(client.head(new_url + "?stale=1").headers.get('Status'), "DONE")
+        assert_equal(client.head(task_url + "?stale=1").headers.get('Status'), "STALE")
+        assert_equal(client.head(task_url).headers.get('Status'), "DONE")
+        requeued = json.loads(client.post(url + "reprocess").data.decode("utf-8"))
+        assert_equal(client.get(url).headers.get('ID'), requeued[0])
+
+
+def test_changes():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        client = app.test_client()
+        url = "/api/modules/test_upper/"
+        task_url = client.post(url, data="test").headers.get('Location')
+        client.get(url)
+        client.put(task_url, data="TEST")
+        changes = json.loads(client.get(url + "changes?results=1").data.decode("utf-8"))
+        assert_equal([(ch['status'], ch['result']) for ch in changes['changes']], [("DONE", "TEST")])
+        changes = json.loads(client.get(url + "changes?since={}".format(changes['cursor'])).data.decode("utf-8"))
+        assert_equal(changes['changes'], [])
+        assert_equal(client.get(url + "changes?since=x").status_code, 400)
+
+
+def test_events():
+    import nlpipe.restserver
+    nlpipe.restserver.EVENT_KEEPALIVE = 0
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        client = app.test_client()
+        assert_equal(client.get("/api/events?module=unknown").status_code, 404)
+        # the stream follows the change logs, so it also works with multiple processes
+        assert_equal(client.get("/api/events", environ_overrides={"wsgi.multiprocess": True}).status_code, 200)
+        res = client.get("/api/events?module=test_upper", buffered=False)
+        assert_equal(res.mimetype, "text/event-stream")
+        stream = iter(res.response)
+        id = client.post("/api/modules/test_upper/", data="test").headers.get('ID')
+        assert_equal(next(stream), b": connected\n\n")
+        event = json.loads(next(stream).decode("utf-8")[len("data: "):])
+        assert_equal(event, dict(id=id, module="test_upper", status="PENDING", submitter="default"))
+        assert_equal(next(stream), b": keepalive\n\n")
+        res.close()
+
+
+def test_etag():
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        client = app.test_client()
+        url = "/api/modules/test_upper/"
+        task_url = client.post(url, data="test").headers.get('Location')
+        id = client.get(url).headers.get('ID')
+        assert_equal(client.get(task_url).headers.get('ETag'), None)  # not DONE
+        client.put(task_url, data="TEST")
+        res = client.get(task_url)
+        etag = res.headers.get('ETag')
+        assert_equal(res.headers.get('Cache-Control'), 'no-cache')
+        res = client.get(task_url, headers={'If-None-Match': etag})
+        assert_equal((res.status_code, res.data), (304, b""))
+        bulk = client.post(url + "bulk/etag", data=json.dumps([id, "unknown"]), content_type="application/json")
+        assert_equal(json.loads(bulk.data.decode("utf-8")), {id: etag.strip('"')})
+        # a new result gets a new etag
+        time.sleep(0.01)
+        app.client.store_result("test_upper", id, "TEST!")
+        res = client.get(task_url, headers={'If-None-Match': etag})
+        assert_equal((res.status_code, res.data), (200, b"TEST!"))
+        assert_true(res.headers.get('ETag') != etag)
+
+
+def test_compressed_result():
+    """Test whether compressed results are passed through with Content-Encoding"""
+    import gzip
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root, compression="gzip")
+        client = app.test_client()
+        url = "/api/modules/test_upper/"
+        task_url = client.post(url, data="test").headers.get('Location')
+        client.get(url)
+        client.put(task_url, data="TEST")
+
+        x = client.get(task_url, headers={"Accept-Encoding": "gzip, deflate"})
+        assert_equal(x.headers.get('Content-Encoding'), 'gzip')
+        assert_equal(gzip.decompress(x.data), b"TEST")
+
+        x = client.get(task_url)
+        assert_equal(x.headers.get('Content-Encoding'), None)
+        assert_equal(x.data, b"TEST")
+
+
+def test_http_compression():
+    """Test whether compressed request bodies are accepted and large responses compressed"""
+    import gzip
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        client = app.test_client()
+        txt = "this is a long test " * 1000
+        url = "/api/modules/test_upper/"
+        x = client.post(url, data=gzip.compress(txt.encode("utf-8")), headers={"Content-Encoding": "gzip"})
+        assert_equal(x.headers.get('ID'), get_id(txt))
+
+        x = client.get(url, headers={"Accept-Encoding": "gzip"})
+        assert_equal(x.headers.get('Content-Encoding'), 'gzip')
+        assert_equal(gzip.decompress(x.data).decode("utf-8"), txt)
+
+        body = gzip.compress(json.dumps([get_id(txt)]).encode("utf-8"))
+        x = client.post(url + "bulk/status", data=body, headers={"Content-Encoding": "gzip"})
+        assert_equal(json.loads(x.data.decode("utf-8")), {get_id(txt): "STARTED"})
+
+        # large stored results are compressed while they are streamed, rather than in memory
+        task_url = "/api/modules/test_upper/{}".format(get_id(txt))
+        client.put(task_url, data=txt.upper())
+        x = client.get(task_url, headers={"Accept-Encoding": "gzip"}, buffered=False)
+        assert_true(x.is_streamed)
+        assert_equal(x.headers.get('Content-Encoding'), 'gzip')
+        assert_equal(gzip.decompress(b"".join(x.response)).decode("utf-8"), txt.upper())
+        x.close()
+        assert_equal(client.get(task_url).data.decode("utf-8"), txt.upper())
+
+
+def test_bytes():
+    """Test whether non-ascii documents survive the bytes path unchanged"""
+    with TemporaryDirectory() as root:
+        app.client = FSClient(root)
+        client = app.test_client()
+        txt = "Bjarnfre\xf0arson leeft"
+        url = "/api/modules/test_upper/"
+        task_url = client.post(url, data=txt.encode("utf-8")).headers.get('Location')
+        x = client.get(url)
+        assert_equal(x.data, txt.encode("utf-8"))
+        assert_equal(x.headers.get('Content-Length'), str(len(txt.encode("utf-8"))))
+        client.put(task_url, data=txt.upper().encode("utf-8"))
+        assert_equal(app.client.result("test_upper", get_id(txt)), txt.upper())
+        assert_equal(client.get(task_url).data.decode("utf-8"), txt.upper())
@@ -0,0 +1,45 @@
+import csv
+import json
+from io import StringIO
+
+from nose.tools import assert_equal, assert_raises, assert_is
+
+from nlpipe.tokens import TokenTable
+
+_COLUMNS = [("id", "str"), ("offset", "int"), ("lemma", "str")]
+
+
+def _table(id, lemmas):
+    t = TokenTable(_COLUMNS)
+    ids, offsets, lemma_col = t.data
+    for i, lemma in enumerate(lemmas):
+        ids.append(id)
+        offsets.append(i)
+        lemma_col.append(lemma)
+    return t
+
+
+def test_serialize():
+    t = _table("1", ["a", None])
+    assert_equal(len(t), 2)
+    assert_equal(list(csv.reader(StringIO(t.convert("csv")))), [["id", "offset", "lemma"], ["1", "0", "a"], ["1", "1", ""]])
+    assert_equal(json.loads(t.convert("json")), {"id": ["1", "1"], "offset": [0, 1], "lemma": ["a", None]})
+    assert_raises(ValueError, t.convert, "xml")
+
+
+def test_csv_quoting():
+    lemmas = ["a,b", 'say "hi"', "line\nbreak", "", None, "plain"]
+    t = _table("x", lemmas)
+    s = StringIO()
+    w = csv.writer(s)
+    w.writerow(t.names)
+    w.writerows(t.rows())
+    assert_equal(t.to_csv(), s.getvalue())
+
+
+def test_extend():
+    t = _table("1", ["lemma"])
+    t.extend(_table("2", ["".join(["lem", "ma"])]))
+    assert_equal(t.column("id"), ["1", "2"])
+    assert_is(t.column("lemma")[0], t.column("lemma")[1])  # interned
+    assert_raises(ValueError, t.extend, TokenTable([("x", "str")]))
@@ -8,3 +8,17 @@ def check_status(module):
     except Exception as e:
         logging.exception("Module offline: {module}".format(**locals()))
         raise SkipTest(e)
+
+
+class FlakyApp(object):
+    """Let the n-th request fail with a 503 Service Unavailable"""
+
+    def __init__(self, app, fail):
+        self.app, self.fail, self.n = app, set(fail), 0
+
+    def __call__(self, environ, start_response):
+        self.n += 1
+        if self.n in self.fail:
+            start_response("503 Service Unavailable", [("Content-Type", "text/plain")])
+            return [b"try again"]
+        return self.app(environ, start_response)